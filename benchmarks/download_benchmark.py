@@ -0,0 +1,73 @@
+"""Benchmarks downloading a large build archive from a local range-serving
+server, whose responses are throttled like a single Cloud Storage stream.
+
+Compares a single stream with the sliced downloader."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from clusterfuzz import http_client
+from clusterfuzz import sliced_download
+from test import helpers
+
+
+def measure(url, path, jobs, slice_size):
+  """Returns the wall-clock time it takes to download url."""
+
+  start = time.time()
+  sliced_download.download(url, path, jobs=jobs, slice_size=slice_size,
+                           min_size=0)
+  elapsed = time.time() - start
+  os.remove(path)
+  return elapsed
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('-s', '--size', type=int, default=64,
+                      help='Size of the archive in MB.')
+  parser.add_argument('-r', '--rate', type=float, default=20,
+                      help='Throughput of each response in MB/s, 0 for '
+                           'unlimited.')
+  parser.add_argument('--slice-size', type=int, default=4,
+                      help='Size of each slice in MB.')
+  parser.add_argument('-j', '--jobs', type=int, nargs='+',
+                      default=[1, 4, 8, 16],
+                      help='Numbers of concurrent slices to measure.')
+  args = parser.parse_args()
+
+  server = helpers.start_http_server(
+      {'/build.zip': os.urandom(args.size * 1024 ** 2)})
+  server.rate = int(args.rate * 1024 ** 2)
+  temp_dir = tempfile.mkdtemp()
+  try:
+    url = 'http://localhost:%d/build.zip' % server.server_port
+    path = os.path.join(temp_dir, 'build.zip')
+    print '%-20s %10s %12s' % ('jobs', 'seconds', 'MB/s')
+    for jobs in args.jobs:
+      elapsed = measure(url, path, jobs, args.slice_size * 1024 ** 2)
+      print '%-20s %10.3f %12.1f' % (jobs, elapsed, args.size / elapsed)
+  finally:
+    shutil.rmtree(temp_dir)
+    http_client.get_session().close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,78 @@
+"""Benchmarks the output handling of common.execute.
+
+Compares the chunked reader against the previous byte-at-a-time loop."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import subprocess
+import time
+
+from clusterfuzz import common
+
+OUTPUT_COMMAND = ('yes "==1234==ERROR: AddressSanitizer: heap-use-after-free"'
+                  ' | head -c %d')
+
+
+def execute_bytewise(command, cwd):
+  """The byte-at-a-time loop that common.execute used to run."""
+
+  output = ''
+  proc = subprocess.Popen(
+      command,
+      shell=True,
+      stdout=subprocess.PIPE,
+      stderr=subprocess.STDOUT,
+      cwd=cwd)
+  for byte in iter(lambda: proc.stdout.read(1), b''):
+    output += byte
+  proc.wait()
+  return proc.returncode, output
+
+
+def execute_chunked(command, cwd):
+  return common.execute(command, cwd, print_output=False)
+
+
+def measure(fn, command, repeat):
+  """Returns the best wall-clock time of 'repeat' runs of fn(command)."""
+
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    fn(command, '.')
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('-s', '--size', type=int, default=8,
+                      help='Megabytes of output produced by the child.')
+  parser.add_argument('-r', '--repeat', type=int, default=3,
+                      help='Number of runs per implementation.')
+  args = parser.parse_args()
+
+  size = args.size * 1024 * 1024
+  command = OUTPUT_COMMAND % size
+  print '%-10s %10s %12s' % ('reader', 'seconds', 'MB/s')
+  for name, fn in [('bytewise', execute_bytewise),
+                   ('chunked', execute_chunked)]:
+    elapsed = measure(fn, command, args.repeat)
+    print '%-10s %10.3f %12.1f' % (name, elapsed, args.size / elapsed)
+
+
+if __name__ == '__main__':
+  main()
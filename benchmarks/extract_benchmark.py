@@ -0,0 +1,96 @@
+"""Benchmarks extracting a large synthetic build archive.
+
+Compares zipfile.extractall with the streaming and parallel extractors."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+
+from clusterfuzz import archive
+
+
+def create_archive(path, members, member_size):
+  """Writes a zip of compressible members, similar to an ASAN build."""
+
+  words = ['d8', 'v8', 'asan', 'heap', 'isolate', 'snapshot', '\x00' * 16,
+           '\x7fELF', 'turbofan', 'ignition']
+  zipped_file = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+  for i in range(members):
+    data = ''.join(random.choice(words) for _ in range(member_size / 8))
+    zipped_file.writestr('build/obj/file_%d.o' % i, data)
+  zipped_file.close()
+
+
+def extract_all(archive_path, destination, _):
+  zipped_file = zipfile.ZipFile(archive_path, 'r')
+  zipped_file.extractall(destination)
+  zipped_file.close()
+
+
+def extract_stream(archive_path, destination, _):
+  with open(archive_path, 'rb') as f:
+    archive.extract_stream(f, destination)
+
+
+def measure(fn, archive_path, temp_dir, jobs):
+  """Returns the wall-clock time fn takes to extract the archive."""
+
+  destination = os.path.join(temp_dir, 'out')
+  start = time.time()
+  fn(archive_path, destination, jobs)
+  elapsed = time.time() - start
+  shutil.rmtree(destination)
+  return elapsed
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('-m', '--members', type=int, default=2000,
+                      help='Number of members in the archive.')
+  parser.add_argument('-s', '--member-size', type=int, default=256 * 1024,
+                      help='Uncompressed size of each member in bytes.')
+  parser.add_argument('-j', '--jobs', type=int,
+                      default=multiprocessing.cpu_count(),
+                      help='Workers used by the parallel extractor.')
+  args = parser.parse_args()
+
+  temp_dir = tempfile.mkdtemp()
+  try:
+    archive_path = os.path.join(temp_dir, 'build.zip')
+    create_archive(archive_path, args.members, args.member_size)
+    total_size = args.members * args.member_size / (1024.0 * 1024)
+    print 'Archive: %d members, %.1fMB uncompressed, %.1fMB compressed' % (
+        args.members, total_size, os.path.getsize(archive_path) / 1048576.0)
+
+    print '%-20s %10s %12s' % ('extractor', 'seconds', 'MB/s')
+    runs = [('extractall', extract_all, 1),
+            ('stream', extract_stream, 1)]
+    runs += [('parallel -j %d' % jobs, archive.extract_parallel, jobs)
+             for jobs in sorted(set([1, args.jobs]))]
+    for name, fn, jobs in runs:
+      elapsed = measure(fn, archive_path, temp_dir, jobs)
+      print '%-20s %10.3f %12.1f' % (name, elapsed, total_size / elapsed)
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,121 @@
+"""Benchmarks how long the CLI takes to start.
+
+Measures 'clusterfuzz --help', subcommands that do next to nothing ('cache
+ls' on an empty cache, and 'reproduce' handed to a daemon that finishes the
+job at once), and the time it takes to import each module of the package,
+each in a fresh interpreter."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import pkgutil
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import clusterfuzz
+from clusterfuzz import daemon
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMANDS = [
+    ('--help', ['--help']),
+    ('cache ls', ['cache', 'ls']),
+    ('reproduce (daemon)', ['reproduce', '1234']),
+]
+RUN_CLI = 'import sys; from clusterfuzz import main; main.execute(sys.argv[1:])'
+IMPORT_MODULE = ('import time; start = time.time(); import %s; '
+                 'print time.time() - start')
+
+
+def measure(command, environment, repeat):
+  """Returns the best wall-clock time of 'repeat' runs of command."""
+
+  best = None
+  with open(os.devnull, 'w') as devnull:
+    for _ in range(repeat):
+      start = time.time()
+      subprocess.check_call(command, env=environment, cwd=ROOT_DIR,
+                            stdout=devnull, stderr=devnull)
+      elapsed = time.time() - start
+      best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def measure_import(module, environment, repeat):
+  """Returns the best time of 'repeat' imports of module, each in a fresh
+  interpreter, leaving out the interpreter's own startup."""
+
+  return min(
+      float(subprocess.check_output(
+          [sys.executable, '-c', IMPORT_MODULE % module], env=environment,
+          cwd=ROOT_DIR))
+      for _ in range(repeat))
+
+
+def get_modules():
+  return sorted(name for _, name, _ in pkgutil.walk_packages(
+      clusterfuzz.__path__, 'clusterfuzz.'))
+
+
+def start_daemon(socket_path):
+  """Starts a daemon whose reproduce jobs finish at once."""
+
+  server = daemon.Daemon({'reproduce': lambda **_: None}, 1, socket_path)
+  server.listen()
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('-r', '--repeat', type=int, default=10,
+                      help='Number of runs of each command.')
+  parser.add_argument('--no-modules', dest='modules', action='store_false',
+                      help="Don't measure the import time of each module.")
+  args = parser.parse_args()
+
+  temp_dir = tempfile.mkdtemp()
+  socket_path = os.path.join(temp_dir, 'daemon.sock')
+  environment = dict(os.environ, HOME=temp_dir,
+                     CLUSTERFUZZ_DAEMON_SOCKET=socket_path,
+                     PYTHONPATH=ROOT_DIR)
+  server = start_daemon(socket_path)
+  try:
+    print '%-40s %10s' % ('command', 'ms')
+    print '%-40s %10.1f' % ('python -c pass', 1000 * measure(
+        [sys.executable, '-c', 'pass'], environment, args.repeat))
+    for name, argv in COMMANDS:
+      elapsed = measure([sys.executable, '-c', RUN_CLI] + argv, environment,
+                        args.repeat)
+      print '%-40s %10.1f' % (name, 1000 * elapsed)
+
+    if args.modules:
+      print
+      print '%-40s %10s' % ('import', 'ms')
+      for module in get_modules():
+        elapsed = measure_import(module, environment, args.repeat)
+        print '%-40s %10.1f' % (module, 1000 * elapsed)
+  finally:
+    server.stop()
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,347 @@
+"""Module for extracting build archives."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import struct
+import zipfile
+import zlib
+import multiprocessing
+
+from clusterfuzz import common
+
+READ_SIZE = 1024 * 1024
+
+LOCAL_HEADER_SIGNATURE = 'PK\x03\x04'
+LOCAL_HEADER_FORMAT = '<4sHHHHHIIIHH'
+CENTRAL_HEADER_SIGNATURE = 'PK\x01\x02'
+CENTRAL_HEADER_FORMAT = '<4sHHHHHHIIIHHHHHII'
+DATA_DESCRIPTOR_SIGNATURE = 'PK\x07\x08'
+ZIP64_EXTRA_ID = 0x0001
+ZIP64_LIMIT = 0xFFFFFFFF
+FLAG_DATA_DESCRIPTOR = 0x08
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+UNIX_SYSTEM = 3
+
+
+def member_path(destination, name):
+  """Returns where member 'name' is extracted to, ignoring unsafe parts."""
+
+  parts = [p for p in name.replace('\\', '/').split('/')
+           if p not in ('', '.', '..')]
+  return os.path.join(destination, *parts)
+
+
+def member_mode(version_made_by, external_attr):
+  """Returns the Unix mode bits of a member, or None if it has none."""
+
+  if version_made_by >> 8 != UNIX_SYSTEM:
+    return None
+  return (external_attr >> 16) & 0777 or None
+
+
+class DiscardedOutput(object):
+  """A file-like object that drops everything written to it."""
+
+  def write(self, data):
+    pass
+
+  def close(self):
+    pass
+
+
+class StreamReader(object):
+  """Reads exact amounts of data from a non-seekable stream."""
+
+  def __init__(self, stream):
+    self.stream = stream
+    self.buffer = ''
+
+  def read(self, size):
+    """Returns up to size bytes, or less at the end of the stream."""
+
+    if not self.buffer:
+      return self.stream.read(min(size, READ_SIZE))
+    data = self.buffer[:size]
+    self.buffer = self.buffer[size:]
+    return data
+
+  def read_exact(self, size):
+    """Returns exactly size bytes, raising an error if the stream ends."""
+
+    chunks = []
+    while size:
+      chunk = self.read(size)
+      if not chunk:
+        raise common.BadArchiveError('Unexpected end of archive')
+      chunks.append(chunk)
+      size -= len(chunk)
+    return ''.join(chunks)
+
+  def unread(self, data):
+    self.buffer = data + self.buffer
+
+  def drain(self):
+    """Consumes the rest of the stream."""
+
+    self.buffer = ''
+    while self.stream.read(READ_SIZE):
+      pass
+
+
+def parse_zip64_sizes(extra, compressed_size, uncompressed_size):
+  """Reads the 64-bit sizes that replace 0xFFFFFFFF in a header."""
+
+  while len(extra) >= 4:
+    header_id, data_size = struct.unpack('<HH', extra[:4])
+    data = extra[4:4 + data_size]
+    extra = extra[4 + data_size:]
+    if header_id != ZIP64_EXTRA_ID:
+      continue
+
+    if uncompressed_size == ZIP64_LIMIT:
+      uncompressed_size = struct.unpack('<Q', data[:8])[0]
+      data = data[8:]
+    if compressed_size == ZIP64_LIMIT:
+      compressed_size = struct.unpack('<Q', data[:8])[0]
+    return compressed_size, uncompressed_size, True
+  return compressed_size, uncompressed_size, False
+
+
+def extract_stream(stream, destination):
+  """Extracts a zip archive while it is being read from stream.
+
+  Members are written as soon as their bytes arrive, relying on the local
+  header that precedes each of them. The central directory at the end of the
+  archive is then used to apply the Unix file modes. Only one read buffer is
+  held in memory and the archive itself is never written to disk."""
+
+  reader = StreamReader(stream)
+  names = []
+  while True:
+    signature = reader.read_exact(4)
+    reader.unread(signature)
+    if signature != LOCAL_HEADER_SIGNATURE:
+      break
+    names.append(extract_member(reader, destination))
+
+  apply_modes(reader, destination)
+  reader.drain()
+  return names
+
+
+def extract_member(reader, destination):
+  """Extracts the member whose local header is next in reader."""
+
+  (_, _, flags, method, _, _, crc, compressed_size, uncompressed_size,
+   name_length, extra_length) = struct.unpack(
+       LOCAL_HEADER_FORMAT,
+       reader.read_exact(struct.calcsize(LOCAL_HEADER_FORMAT)))
+  name = reader.read_exact(name_length)
+  extra = reader.read_exact(extra_length)
+  compressed_size, uncompressed_size, zip64 = parse_zip64_sizes(
+      extra, compressed_size, uncompressed_size)
+  has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+
+  path = member_path(destination, name)
+  directory = path if name.endswith('/') else os.path.dirname(path)
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+
+  # Directory entries may still carry an (empty) compressed payload.
+  output = DiscardedOutput() if name.endswith('/') else open(path, 'wb')
+  try:
+    if method == ZIP_DEFLATED:
+      actual_crc = inflate(reader, output, None if has_descriptor
+                           else compressed_size)
+    elif method == ZIP_STORED and not has_descriptor:
+      actual_crc = copy(reader, output, compressed_size)
+    else:
+      raise common.BadArchiveError(
+          'Unsupported compression for %s (method %d)' % (name, method))
+  finally:
+    output.close()
+
+  if has_descriptor:
+    crc = read_data_descriptor(reader, zip64)
+  if actual_crc != crc:
+    raise common.BadArchiveError('CRC mismatch in %s' % name)
+  return name
+
+
+def copy(reader, output, size):
+  """Copies size stored bytes to output and returns their CRC."""
+
+  crc = 0
+  while size:
+    chunk = reader.read(min(size, READ_SIZE))
+    if not chunk:
+      raise common.BadArchiveError('Unexpected end of archive')
+    output.write(chunk)
+    crc = zlib.crc32(chunk, crc)
+    size -= len(chunk)
+  return crc & 0xFFFFFFFF
+
+
+def inflate(reader, output, size):
+  """Inflates a deflated member to output and returns its CRC.
+
+  If size is None the compressed size is unknown, and the member ends where
+  the deflate stream ends."""
+
+  decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+  crc = 0
+  while size is None or size:
+    chunk = reader.read(READ_SIZE if size is None else min(size, READ_SIZE))
+    if not chunk:
+      raise common.BadArchiveError('Unexpected end of archive')
+    if size is not None:
+      size -= len(chunk)
+
+    data = decompressor.decompress(chunk)
+    output.write(data)
+    crc = zlib.crc32(data, crc)
+    if decompressor.unused_data:
+      reader.unread(decompressor.unused_data)
+      break
+
+  data = decompressor.flush()
+  output.write(data)
+  return zlib.crc32(data, crc) & 0xFFFFFFFF
+
+
+def read_data_descriptor(reader, zip64):
+  """Reads the data descriptor that follows a member and returns its CRC."""
+
+  signature = reader.read_exact(4)
+  if signature != DATA_DESCRIPTOR_SIGNATURE:
+    reader.unread(signature)
+  crc = struct.unpack('<I', reader.read_exact(4))[0]
+  reader.read_exact(16 if zip64 else 8)
+  return crc
+
+
+def apply_modes(reader, destination):
+  """Applies the file modes stored in the central directory."""
+
+  header_size = struct.calcsize(CENTRAL_HEADER_FORMAT)
+  while reader.read_exact(4) == CENTRAL_HEADER_SIGNATURE:
+    (_, version_made_by, _, _, _, _, _, _, _, _, name_length, extra_length,
+     comment_length, _, _, external_attr, _) = struct.unpack(
+         CENTRAL_HEADER_FORMAT,
+         CENTRAL_HEADER_SIGNATURE + reader.read_exact(header_size - 4))
+    name = reader.read_exact(name_length)
+    reader.read_exact(extra_length + comment_length)
+
+    mode = member_mode(version_made_by, external_attr)
+    path = member_path(destination, name)
+    if mode and not name.endswith('/') and os.path.isfile(path):
+      os.chmod(path, mode)
+
+
+def shard_members(infos, jobs):
+  """Splits zip members into 'jobs' shards of similar uncompressed size."""
+
+  shards = [[] for _ in range(jobs)]
+  sizes = [0] * jobs
+  for info in sorted(infos, key=lambda i: i.file_size, reverse=True):
+    smallest = sizes.index(min(sizes))
+    shards[smallest].append(info.filename)
+    sizes[smallest] += info.file_size
+  return [shard for shard in shards if shard]
+
+
+def extract_shard(args):
+  """Extracts the named members, using a handle of its own to the archive.
+
+  'strip_prefix' is removed from the start of member names."""
+
+  archive_path, destination, names, strip_prefix = args
+  zipped_file = zipfile.ZipFile(archive_path, 'r')
+  try:
+    for name in names:
+      info = zipped_file.getinfo(name)
+      path = member_path(destination, name[len(strip_prefix):])
+      if name.endswith('/'):
+        common.make_directory(path)
+        continue
+
+      common.make_directory(os.path.dirname(path))
+      source = zipped_file.open(info)
+      with open(path, 'wb') as f:
+        shutil.copyfileobj(source, f, READ_SIZE)
+      source.close()
+
+      mode = member_mode(info.create_system << 8, info.external_attr)
+      if mode:
+        os.chmod(path, mode)
+  finally:
+    zipped_file.close()
+  return len(names)
+
+
+def list_members(archive_path):
+  """Returns the names of the members of a zip archive on disk."""
+
+  zipped_file = zipfile.ZipFile(archive_path, 'r')
+  names = zipped_file.namelist()
+  zipped_file.close()
+  return names
+
+
+def get_common_prefix(names):
+  """Returns the top-level directory shared by all names, or ''."""
+
+  prefix = names[0].split('/')[0] + '/' if names else ''
+  if all(name.startswith(prefix) for name in names):
+    return prefix
+  return ''
+
+
+def extract_members(archive_path, destination, names, strip_prefix=''):
+  """Extracts only the named members of a zip archive on disk."""
+  extract_shard((archive_path, destination, names, strip_prefix))
+
+
+def extract_parallel(archive_path, destination, jobs, names=None,
+                     strip_prefix=''):
+  """Extracts a zip archive on disk with a pool of 'jobs' worker processes.
+
+  Members are sharded by size so that every worker inflates a similar amount
+  of data, and Unix file modes are preserved. If 'names' is set, only those
+  members are extracted."""
+
+  zipped_file = zipfile.ZipFile(archive_path, 'r')
+  infos = zipped_file.infolist()
+  zipped_file.close()
+  if names is not None:
+    names = set(names)
+    infos = [info for info in infos if info.filename in names]
+
+  shards = [(archive_path, destination, shard, strip_prefix)
+            for shard in shard_members(infos, max(jobs, 1))]
+  if len(shards) <= 1:
+    for shard in shards:
+      extract_shard(shard)
+    return [info.filename for info in infos]
+
+  pool = multiprocessing.Pool(len(shards))
+  try:
+    pool.map(extract_shard, shards)
+  finally:
+    pool.close()
+    pool.join()
+  return [info.filename for info in infos]
@@ -14,33 +14,152 @@
 # limitations under the License.
 
 import os
+import re
 import stat
-import zipfile
+import time
+import shutil
+import subprocess
 import multiprocessing
-import urllib
+import urllib2
 import json
-import urlfetch
 
+from clusterfuzz import archive
+from clusterfuzz import build_jobs
+from clusterfuzz import cache
 from clusterfuzz import common
+from clusterfuzz import elf
+from clusterfuzz import http_client
+from clusterfuzz import manifest
+from clusterfuzz import ninja_log
+from clusterfuzz import out_dirs
+from clusterfuzz import revisions
+from clusterfuzz import sliced_download
+from clusterfuzz import trace
+from clusterfuzz import worktrees
 
 CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
 CLUSTERFUZZ_BUILDS_DIR = os.path.join(CLUSTERFUZZ_DIR, 'builds')
+GCS_BROWSER_URL_PREFIX = 'https://storage.cloud.google.com/'
+PARALLEL_EXTRACTION_MIN_JOBS = 4
+BUILD_ARCHIVE_NAME = '.clusterfuzz_build.zip'
+PENDING_EXTRACTION_FILE = '.clusterfuzz_pending_extraction'
+BUILD_HANG_TIMEOUT = 30 * 60
+GYP_DEFINES = 'asan=1'
+SHARED_LIBRARY_PATTERN = re.compile(r'\.so(\.[0-9]+)*$')
+V8_DATA_FILES = ['natives_blob.bin', 'snapshot_blob.bin', 'icudtl.dat']
 
-def build_revision_to_sha_url(revision, repo):
-  return ('https://cr-rev.appspot.com/_ah/api/crrev/v1/get_numbering?%s' %
-          urllib.urlencode({
-              'number': revision,
-              'numbering_identifier': 'refs/heads/master',
-              'numbering_type': 'COMMIT_POSITION',
-              'project': 'chromium',
-              'repo': repo}))
 
+class GsutilStream(object):
+  """Reads a Google Cloud Storage object through 'gsutil cat'."""
 
-def sha_from_revision(revision, repo):
-  """Converts a chrome revision number to it corresponding git sha."""
+  def __init__(self, gsutil_path):
+    print 'Running: gsutil cat %s' % gsutil_path
+    self.gsutil_path = gsutil_path
+    self.proc = subprocess.Popen(['gsutil', 'cat', gsutil_path],
+                                 stdout=subprocess.PIPE)
 
-  response = urlfetch.fetch(build_revision_to_sha_url(revision, repo))
-  return json.loads(response.body)['git_sha']
+  def read(self, size):
+    return self.proc.stdout.read(size)
+
+  def close(self):
+    """Waits for gsutil and raises an error if it failed."""
+
+    self.proc.stdout.close()
+    self.proc.wait()
+    if self.proc.returncode != 0:
+      raise common.BuildDownloadError(
+          self.gsutil_path, 'gsutil exited with %d' % self.proc.returncode)
+
+  def abort(self):
+    """Stops gsutil before the object was read to the end."""
+
+    if self.proc.poll() is None:
+      self.proc.kill()
+    self.proc.stdout.close()
+    self.proc.wait()
+
+
+def abort_build_stream(stream):
+  """Closes a build stream that won't be read to the end. gsutil fails when
+  it is cut short, and that error would hide the one that stopped the
+  reading."""
+
+  if isinstance(stream, GsutilStream):
+    stream.abort()
+  else:
+    stream.close()
+
+
+def get_gsutil_path(build_url):
+  """Returns the gs:// path of a Cloud Storage build URL, or None."""
+
+  if build_url.startswith(GCS_BROWSER_URL_PREFIX):
+    return build_url.replace(GCS_BROWSER_URL_PREFIX, 'gs://')
+  if build_url.startswith('gs://'):
+    return build_url
+  return None
+
+
+def get_local_build_path(build_url):
+  """Returns the path of a build archive stored locally, or None."""
+
+  if build_url.startswith('file://'):
+    return build_url[len('file://'):]
+  if '://' not in build_url:
+    return build_url
+  return None
+
+
+def open_build_stream(build_url):
+  """Returns a file-like object that streams the build archive.
+
+  Cloud Storage URLs are read through gsutil. Other HTTP URLs and local paths
+  are supported too, which lets a local file or HTTP server stand in for
+  Cloud Storage."""
+
+  gsutil_path = get_gsutil_path(build_url)
+  if gsutil_path:
+    return GsutilStream(gsutil_path)
+  local_path = get_local_build_path(build_url)
+  if local_path:
+    return open(local_path, 'rb')
+  return urllib2.urlopen(build_url)
+
+
+def download_build_archive(build_url, directory):
+  """Downloads the build archive into directory and returns its path.
+
+  Archives are fetched in concurrent slices: natively over HTTP, and by
+  gsutil from Cloud Storage, which needs its credentials. An interrupted
+  download resumes from the slices already in directory."""
+
+  filename = os.path.join(directory, os.path.basename(build_url))
+  gsutil_path = get_gsutil_path(build_url)
+  if gsutil_path:
+    common.execute(
+        'gsutil -o GSUtil:sliced_object_download_max_components=%d cp %s .' %
+        (sliced_download.get_download_jobs(), gsutil_path), directory)
+    return filename
+  if not get_local_build_path(build_url):
+    return sliced_download.download(build_url, filename)
+
+  stream = open_build_stream(build_url)
+  try:
+    with open(filename, 'wb') as f:
+      shutil.copyfileobj(stream, f, archive.READ_SIZE)
+  finally:
+    stream.close()
+  return filename
+
+
+def get_extract_jobs():
+  """Returns the number of workers extracting a build.
+
+  Defaults to the number of cores, and can be set with
+  $CLUSTERFUZZ_EXTRACT_JOBS."""
+
+  return int(os.environ.get('CLUSTERFUZZ_EXTRACT_JOBS',
+                            multiprocessing.cpu_count()))
 
 
 class BinaryProvider(object):
@@ -51,61 +170,226 @@ class BinaryProvider(object):
     self.build_url = build_url
     self.build_directory = None
     self.target = 'd8'
+    self.data_files = []
+    self.extract_jobs = get_extract_jobs()
 
   def get_build_directory(self):
     """Get build directory. This method must be implemented by a subclass."""
     raise NotImplementedError
 
-  def download_build_data(self):
-    """Downloads a build and saves it locally."""
+  def release(self):
+    """Releases what was reserved for the binary, once it is no longer run."""
+    pass
 
-    build_dir = self.build_dir_name()
-    if os.path.exists(build_dir):
-      return build_dir
-
-    print 'Downloading build data...'
-    if not os.path.exists(CLUSTERFUZZ_BUILDS_DIR):
-      os.makedirs(CLUSTERFUZZ_BUILDS_DIR)
+  def download_build_data(self, minimal=False):
+    """Downloads a build and saves it locally.
 
-    gsutil_path = self.build_url.replace(
-        'https://storage.cloud.google.com/', 'gs://')
-    common.execute('gsutil cp %s .' % gsutil_path, CLUSTERFUZZ_DIR)
+    Builds are shared between all testcases with the same build URL, so the
+    download is skipped if another testcase already fetched it, unless the
+    build no longer matches its manifest. Least recently used entries are
+    evicted to keep the cache within its quota.
 
-    filename = os.path.split(gsutil_path)[1]
-    saved_file = os.path.join(CLUSTERFUZZ_DIR, filename)
+    With 'minimal', only the target and the files it needs at runtime are
+    extracted. The rest of the archive is kept and extracted by the first
+    call that needs the full build."""
 
-    print 'Extracting...'
-    zipped_file = zipfile.ZipFile(saved_file, 'r')
-    zipped_file.extractall(CLUSTERFUZZ_BUILDS_DIR)
-    zipped_file.close()
+    build_dir = self.build_dir_name()
+    pending = os.path.join(build_dir, PENDING_EXTRACTION_FILE)
+    if (cache.is_complete(build_dir) and
+        manifest.is_intact(build_dir, self.extract_jobs) and
+        (minimal or not os.path.isfile(pending))):
+      cache.CacheIndex().add_build(self.testcase_id, self.build_url,
+                                   build_dir)
+      return build_dir
 
-    print 'Cleaning up...'
-    os.remove(saved_file)
-    os.rename(os.path.join(CLUSTERFUZZ_BUILDS_DIR,
-                           os.path.splitext(filename)[0]), build_dir)
-    binary_location = os.path.join(build_dir, self.target)
+    # Requesters of the same build, in this process or others, wait here for
+    # the one fetching it, then find it complete. The build is checked again,
+    # since it may have been fetched again while waiting.
+    with cache.get_entry_lock(build_dir):
+      if (cache.is_complete(build_dir) and
+          manifest.is_intact(build_dir, self.extract_jobs, quiet=True)):
+        if not minimal:
+          with trace.span('extract_pending_build'):
+            self.extract_pending_build_data(build_dir)
+        cache.CacheIndex().add_build(self.testcase_id, self.build_url,
+                                     build_dir)
+      else:
+        self.fetch_build_data(build_dir, minimal)
+    return build_dir
+
+  def fetch_build_data(self, build_dir, minimal):
+    """Downloads and extracts a build to build_dir. The entry lock must be
+    held.
+
+    The build is extracted to a staging directory, which is renamed once it
+    holds its manifest and the completion marker, so an interrupted fetch is
+    never mistaken for a build."""
+
+    if http_client.is_offline() and not get_local_build_path(self.build_url):
+      raise common.OfflineError('the build %s' % self.build_url)
+    index = cache.CacheIndex()
+    index.evict(cache.get_quota())
+
+    print 'Downloading and extracting build data...'
+    common.make_directory(CLUSTERFUZZ_BUILDS_DIR)
+
+    # Left by a fetch that did not finish.
+    staging_dir = build_dir + '.partial'
+    for path in [staging_dir, staging_dir + '.extracted', build_dir]:
+      if os.path.exists(path):
+        shutil.rmtree(path)
+    if minimal:
+      with trace.span('download_build', minimal=True):
+        self.extract_runtime_files(staging_dir)
+    else:
+      with trace.span('download_build', minimal=False):
+        self.extract_build(staging_dir)
+
+      # Build archives hold a single directory named after the archive.
+      extracted_dir = os.path.join(
+          staging_dir, os.path.splitext(os.path.basename(self.build_url))[0])
+      if os.path.isdir(extracted_dir):
+        os.rename(extracted_dir, staging_dir + '.extracted')
+        shutil.rmtree(staging_dir)
+        os.rename(staging_dir + '.extracted', staging_dir)
+    binary_location = os.path.join(staging_dir, self.target)
     stats = os.stat(binary_location)
     os.chmod(binary_location, stats.st_mode | stat.S_IEXEC)
+    manifest.create(staging_dir, self.extract_jobs)
+    cache.mark_complete(staging_dir)
+    os.rename(staging_dir, build_dir)
+
+    index.add_build(self.testcase_id, self.build_url, build_dir,
+                    cache.get_directory_size(build_dir))
+    index.evict(cache.get_quota(), keep=[cache.build_key(self.build_url)])
+
+  def extract_build(self, destination):
+    """Downloads the build archive and extracts it to destination.
+
+    With few cores, the archive is extracted while it is being downloaded and
+    never stored on disk. With more cores inflating is the bottleneck, so the
+    archive is downloaded first and then extracted by a pool of workers.
+    Local archives are extracted in parallel without being copied."""
+
+    local_path = get_local_build_path(self.build_url)
+    if local_path:
+      archive.extract_parallel(local_path, destination, self.extract_jobs)
+    elif self.extract_jobs >= PARALLEL_EXTRACTION_MIN_JOBS:
+      archive_path = download_build_archive(self.build_url, CLUSTERFUZZ_DIR)
+      try:
+        archive.extract_parallel(archive_path, destination, self.extract_jobs)
+      finally:
+        os.remove(archive_path)
+    else:
+      stream = open_build_stream(self.build_url)
+      try:
+        archive.extract_stream(stream, destination)
+      except BaseException:
+        abort_build_stream(stream)
+        raise
+      stream.close()
+
+  def extract_runtime_files(self, destination):
+    """Extracts the target, its data files and the libraries it loads.
+
+    Libraries are found by following the DT_NEEDED entries of the target and
+    of every library extracted. The archive is kept in destination, and the
+    members left to extract are recorded in PENDING_EXTRACTION_FILE."""
+
+    os.makedirs(destination)
+    # Downloaded archives are recorded relative to the build directory, since
+    # destination is renamed once the extraction is done.
+    stored_archive_path = get_local_build_path(self.build_url)
+    if not stored_archive_path:
+      # Downloaded outside of destination, which is removed if the fetch is
+      # interrupted, so that the download can resume.
+      os.rename(download_build_archive(self.build_url, CLUSTERFUZZ_DIR),
+                os.path.join(destination, BUILD_ARCHIVE_NAME))
+      stored_archive_path = BUILD_ARCHIVE_NAME
+    archive_path = os.path.join(destination, stored_archive_path)
+
+    names = archive.list_members(archive_path)
+    prefix = archive.get_common_prefix(names)
+    libraries = dict((os.path.basename(name), name) for name in names
+                     if SHARED_LIBRARY_PATTERN.search(name))
+    extracted = [prefix + f for f in [self.target] + self.data_files
+                 if prefix + f in names]
+    archive.extract_members(archive_path, destination, extracted, prefix)
+
+    binaries = [os.path.join(destination, self.target)]
+    while binaries:
+      for library in elf.get_needed_libraries(binaries.pop()):
+        name = libraries.get(library)
+        if not name or name in extracted:
+          continue
+        archive.extract_members(archive_path, destination, [name], prefix)
+        extracted.append(name)
+        binaries.append(archive.member_path(destination, name[len(prefix):]))
+
+    with open(os.path.join(destination, PENDING_EXTRACTION_FILE), 'w') as f:
+      json.dump({'archive': stored_archive_path,
+                 'prefix': prefix,
+                 'extracted': extracted}, f)
+
+  def extract_pending_build_data(self, build_dir):
+    """Extracts what a minimal extraction left in the archive, if anything.
+
+    The manifest covering the whole build is written before the pending file
+    is removed, so that a build is never taken as fully extracted without
+    it."""
+
+    pending_file = os.path.join(build_dir, PENDING_EXTRACTION_FILE)
+    if not os.path.isfile(pending_file):
+      return
+
+    print 'Extracting the rest of the build...'
+    with open(pending_file, 'r') as f:
+      pending = json.load(f)
+    archive_path = os.path.join(build_dir, pending['archive'])
+    extracted = set(pending['extracted'])
+    names = [name for name in archive.list_members(archive_path)
+             if name not in extracted]
+    archive.extract_parallel(archive_path, build_dir, self.extract_jobs,
+                             names=names, strip_prefix=pending['prefix'])
+
+    stored_archive = archive_path == os.path.join(build_dir,
+                                                  BUILD_ARCHIVE_NAME)
+    manifest.create(
+        build_dir, self.extract_jobs,
+        exclude=[PENDING_EXTRACTION_FILE] + (
+            [BUILD_ARCHIVE_NAME] if stored_archive else []))
+    os.remove(pending_file)
+    if stored_archive:
+      os.remove(archive_path)
+    cache.CacheIndex().add_build(self.testcase_id, self.build_url, build_dir,
+                                 cache.get_directory_size(build_dir))
 
   def get_binary_path(self):
     return '%s/%s' % (self.get_build_directory(), self.target)
 
   def build_dir_name(self):
-    """Returns a build number's respective directory."""
+    """Returns the directory of the build, shared by all its testcases."""
     return os.path.join(CLUSTERFUZZ_BUILDS_DIR,
-                        str(self.testcase_id) + '_build')
+                        cache.build_key(self.build_url))
 
 
 class V8DownloadedBinary(BinaryProvider):
   """Uses a downloaded binary."""
 
+  def __init__(self, testcase_id, build_url):
+    super(V8DownloadedBinary, self).__init__(testcase_id, build_url)
+    self.data_files = V8_DATA_FILES
+
   def get_build_directory(self):
-    """Returns the location of the correct build to use for reproduction."""
+    """Returns the location of the correct build to use for reproduction.
+
+    Only d8 and what it needs at runtime are extracted, so that the
+    reproduction can start as early as possible."""
 
     if self.build_directory:
       return self.build_directory
 
-    self.download_build_data()
+    self.download_build_data(minimal=True)
     self.build_directory = self.build_dir_name()
     return self.build_directory
 
@@ -120,61 +404,131 @@ class V8Builder(BinaryProvider):
     self.goma_dir = goma_dir
     self.source_directory = source
     self.revision = revision
-    self.git_sha = sha_from_revision(self.revision, 'v8/v8')
+    self.source_sha = None
+    self._git_sha = None
+    self.worktree_pool = None
+    self.out_dir_lock = None
 
-  def out_dir_name(self):
-    return os.path.join(self.source_directory, 'out',
-                        'clusterfuzz_' + str(self.testcase_id))
+  @property
+  def git_sha(self):
+    """The sha of the revision, only looked up once a checkout needs it."""
+
+    if not self._git_sha:
+      self._git_sha = revisions.sha_from_revision(
+          self.revision, 'v8/v8', self.source_directory)
+    return self._git_sha
+
+  @git_sha.setter
+  def git_sha(self, value):
+    self._git_sha = value
+
+  def get_source_sha(self):
+    """Returns the sha checked out in the source directory."""
+
+    _, sha = common.execute('git rev-parse HEAD', self.source_directory,
+                            print_output=False)
+    return sha.strip()
 
   def checkout_source_by_sha(self):
     """Checks out the correct revision."""
 
-    _, current_sha = common.execute('git rev-parse HEAD',
-                                    self.source_directory,
-                                    print_output=False)
-    if current_sha.strip() == self.git_sha:
+    if self.get_source_sha() == self.git_sha:
       return
 
     command = 'git fetch && git checkout %s' % self.git_sha
+    if http_client.is_offline():
+      command = 'git checkout %s' % self.git_sha
     common.check_confirm('Proceed with the following command:\n%s in %s?' %
                          (command, self.source_directory))
-    common.execute(command, self.source_directory)
-
-  def setup_gn_args(self):
-    """Ensures that args.gn is sety up properly."""
-
-    args_gn_location = os.path.join(self.build_directory, 'args.gn')
-    if os.path.isfile(args_gn_location):
-      os.remove(args_gn_location)
+    with trace.span('checkout'):
+      common.execute(command, self.source_directory,
+                     hang_timeout=BUILD_HANG_TIMEOUT, interactive=True)
 
-    common.execute('gn gen %s' % self.build_directory, self.source_directory)
+  def get_gn_args(self):
+    """Returns the lines of the downloaded build's args.gn, using the local
+    goma directory."""
 
-    lines = []
     with open(os.path.join(self.build_dir_name(), 'args.gn'), 'r') as f:
       lines = [l.strip() for l in f.readlines()]
+    return [('goma_dir = ' + self.goma_dir) if 'goma_dir' in line else line
+            for line in lines]
+
+  def run_build_step(self, step, command, fingerprints, fingerprint):
+    """Runs a build step, unless it already ran with the same inputs."""
+
+    if fingerprints.is_current(step, fingerprint):
+      print 'Skipping %s, its inputs are unchanged' % step
+      return
+
+    with trace.span(step):
+      common.execute(command, self.source_directory,
+                     hang_timeout=BUILD_HANG_TIMEOUT)
+    fingerprints.update(step, fingerprint)
+
+  def setup_gn_args(self):
+    """Ensures that args.gn is sety up properly.
 
-    with open(args_gn_location, 'w') as f:
-      for line in lines:
-        if 'goma_dir' in line:
-          line = 'goma_dir = ' + self.goma_dir
-        f.write(line)
-        f.write('\n')
+    args.gn is only rewritten when it changed, so that reusing an out
+    directory doesn't make ninja regenerate it. gn gen is skipped when
+    neither args.gn nor the checked out sha changed."""
+
+    args_gn_location = os.path.join(self.build_directory, 'args.gn')
+    contents = ''.join(line + '\n' for line in self.get_gn_args())
+    current_contents = None
+    if os.path.isfile(args_gn_location):
+      with open(args_gn_location, 'r') as f:
+        current_contents = f.read()
+    if current_contents != contents:
+      common.make_directory(self.build_directory)
+      with open(args_gn_location, 'w') as f:
+        f.write(contents)
+
+    fingerprints = out_dirs.Fingerprints(self.build_directory)
+    if not os.path.isfile(os.path.join(self.build_directory, 'build.ninja')):
+      fingerprints.steps.clear()
+    self.run_build_step(
+        'gn_gen', 'gn gen %s' % self.build_directory, fingerprints,
+        out_dirs.get_fingerprint(contents, self.source_sha or ''))
 
   def build_target(self):
-    """Build the correct revision in the source directory."""
+    """Build the correct revision in the source directory.
+
+    gclient runhooks and gyp_v8 write to the source tree rather than to the
+    out directory, so their fingerprints are stored in the shared out/."""
 
     print 'Building revision %i in %s' % (
         self.revision,
         self.build_directory)
 
     self.setup_gn_args()
-    goma_cores = 10 * multiprocessing.cpu_count()
-    common.execute('GYP_DEFINES=asan=1 gclient runhooks', self.source_directory)
-    common.execute('GYP_DEFINES=asan=1 gypfiles/gyp_v8', self.source_directory)
-    common.execute(
-        ('ninja -C %s -j %i %s'
-         % (self.build_directory, goma_cores, self.target)),
-        self.source_directory)
+    deps = ''
+    deps_location = os.path.join(self.source_directory, 'DEPS')
+    if os.path.isfile(deps_location):
+      with open(deps_location, 'r') as f:
+        deps = f.read()
+
+    fingerprints = out_dirs.Fingerprints(
+        os.path.join(self.source_directory, 'out'))
+    self.run_build_step(
+        'gclient_runhooks', 'GYP_DEFINES=%s gclient runhooks' % GYP_DEFINES,
+        fingerprints, out_dirs.get_fingerprint(deps, GYP_DEFINES))
+    self.run_build_step(
+        'gyp_v8', 'GYP_DEFINES=%s gypfiles/gyp_v8' % GYP_DEFINES,
+        fingerprints,
+        out_dirs.get_fingerprint(deps, GYP_DEFINES, self.source_sha or ''))
+
+    jobs, state = build_jobs.get_jobs(self.goma_dir)
+    print 'Running ninja with %d jobs (goma %s, load %.1f)' % (
+        jobs, 'up' if state['goma_healthy'] else 'down', state['load'])
+    start = time.time()
+    with trace.span('ninja', jobs=jobs):
+      common.execute(
+          ('ninja -C %s -j %i %s'
+           % (self.build_directory, jobs, self.target)),
+          self.source_directory, hang_timeout=BUILD_HANG_TIMEOUT)
+    build_jobs.record_build(self.target, jobs, state, time.time() - start)
+    if os.environ.get('CLUSTERFUZZ_BUILD_SUMMARY'):
+      ninja_log.BuildSummary(self.build_directory).print_summary()
 
   def get_build_directory(self):
     """Returns the location of the correct build to use for reproduction."""
@@ -191,8 +545,58 @@ class V8Builder(BinaryProvider):
           common.ask(message, 'Please enter a valid directory',
                      lambda x: x and os.path.isdir(os.path.expanduser(x))))
     if not self.current:
-      self.checkout_source_by_sha()
-    self.build_directory = self.out_dir_name()
-    self.build_target()
+      pool_size = worktrees.get_pool_size()
+      if pool_size:
+        self.worktree_pool = worktrees.WorktreePool(self.source_directory,
+                                                    pool_size)
+        self.source_directory = self.worktree_pool.acquire(self.git_sha,
+                                                           self.revision)
+      else:
+        self.checkout_source_by_sha()
+      sha = self.git_sha
+    else:
+      sha = self.get_source_sha()
+    self.source_sha = sha
+
+    # Out directories are shared by every testcase with the same args.gn, and
+    # rebuilt incrementally from the nearest revision already built. One
+    # that another reproduction is building or running a binary in is left
+    # alone, and the testcase is built in an out directory of its own
+    # instead. The lock is held until the binary is released.
+    args_key = out_dirs.get_args_key(self.get_gn_args())
+    index = out_dirs.OutDirIndex(self.source_directory)
+    name = index.find(sha, self.revision, args_key)
+    out_dir_lock = index.get_lock(name)
+    if not out_dir_lock.acquire(blocking=False):
+      name = index.get_private_name(args_key, self.testcase_id)
+      print 'Another build uses the shared out directory, building in %s' % (
+          name)
+      out_dir_lock = index.get_lock(name)
+      out_dir_lock.acquire()
+
+    try:
+      previous = index.get(name)
+      if previous and previous['sha'] != sha:
+        print 'Reusing %s, last built at revision %s' % (
+            name, previous['revision'])
+      self.build_directory = index.out_dir_path(name)
+      index.remove(name)
+      self.build_target()
+      index.record(name, sha, self.revision, args_key)
+    except (Exception, SystemExit):
+      out_dir_lock.release()
+      raise
+    self.out_dir_lock = out_dir_lock
 
     return self.build_directory
+
+  def release(self):
+    """Unlocks the out directory the binary was built in, and returns its
+    worktree to the pool."""
+
+    if self.out_dir_lock:
+      self.out_dir_lock.release()
+      self.out_dir_lock = None
+    if self.worktree_pool:
+      self.worktree_pool.release(self.source_directory)
+      self.worktree_pool = None
@@ -0,0 +1,107 @@
+"""Module for choosing how many jobs ninja runs when building with goma."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import json
+import time
+import threading
+import multiprocessing
+
+from clusterfuzz import common
+
+CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
+BUILD_HISTORY_FILE = os.path.join(CLUSTERFUZZ_DIR, 'build_history.jsonl')
+GOMA_STATUS_PATTERN = re.compile(r'status:\s*ok', re.IGNORECASE)
+GOMA_JOBS_PER_CORE = 10
+MEMORY_PER_GOMA_JOB = 256 * 1024 ** 2
+MEMORY_PER_LOCAL_JOB = 1024 ** 3
+
+_lock = threading.Lock()
+
+
+def is_goma_healthy(goma_dir):
+  """Returns whether the goma compiler proxy is up and reports no errors."""
+
+  returncode, output = common.execute(
+      'python goma_ctl.py status', goma_dir, print_output=False,
+      exit_on_error=False)
+  return returncode == 0 and bool(GOMA_STATUS_PATTERN.search(output))
+
+
+def get_machine_state(goma_dir):
+  """Returns the goma health, cores, load and available memory, which ninja
+  parallelism is chosen from."""
+
+  return {'goma_healthy': is_goma_healthy(goma_dir),
+          'cpus': multiprocessing.cpu_count(),
+          'load': os.getloadavg()[0],
+          'available_memory': common.get_available_memory()}
+
+
+def choose_jobs(state):
+  """Returns the number of ninja jobs for a machine state.
+
+  With goma up, most compiles run remotely, so many more jobs than cores can
+  run. Without it they all run locally, so there is a job per core. Either
+  way, cores already busy and missing memory lower the number."""
+
+  cpus = state['cpus']
+  idle_fraction = max(0.0, cpus - state['load']) / cpus
+  if state['goma_healthy']:
+    jobs = int(GOMA_JOBS_PER_CORE * cpus * max(0.5, idle_fraction))
+    memory_per_job = MEMORY_PER_GOMA_JOB
+  else:
+    jobs = int(cpus * idle_fraction)
+    memory_per_job = MEMORY_PER_LOCAL_JOB
+
+  if state['available_memory'] is not None:
+    jobs = min(jobs, state['available_memory'] // memory_per_job)
+  return max(1, jobs)
+
+
+def get_jobs(goma_dir):
+  """Returns (jobs, state) for the next build.
+
+  It is called right before each build, so that builds in a batch adapt to
+  the current state. $CLUSTERFUZZ_NINJA_JOBS overrides the choice."""
+
+  state = get_machine_state(goma_dir)
+  if os.environ.get('CLUSTERFUZZ_NINJA_JOBS'):
+    jobs = int(os.environ['CLUSTERFUZZ_NINJA_JOBS'])
+  else:
+    jobs = choose_jobs(state)
+  return jobs, state
+
+
+def record_build(target, jobs, state, duration, path=BUILD_HISTORY_FILE):
+  """Appends the jobs a build ran with and how long it took to the build
+  history, so that choose_jobs can be tuned from it."""
+
+  entry = dict(state, target=target, jobs=jobs, duration=duration,
+               time=time.time())
+  with _lock:
+    common.make_directory(os.path.dirname(path))
+    with open(path, 'a') as f:
+      f.write(json.dumps(entry, sort_keys=True) + '\n')
+
+
+def read_build_history(path=BUILD_HISTORY_FILE):
+  """Returns the recorded builds, oldest first."""
+
+  if not os.path.isfile(path):
+    return []
+  with open(path, 'r') as f:
+    return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,274 @@
+"""Module for the index of the builds and testcases under ~/.clusterfuzz."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+
+from clusterfuzz import common
+from clusterfuzz import locks
+
+CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
+CLUSTERFUZZ_BUILDS_DIR = os.path.join(CLUSTERFUZZ_DIR, 'builds')
+CACHE_INDEX_FILE = os.path.join(CLUSTERFUZZ_DIR, 'cache_index.json')
+TESTCASE_INFO_DIR = os.path.join(CLUSTERFUZZ_DIR, 'testcase_info')
+DEFAULT_CACHE_QUOTA = '50G'
+DEFAULT_TESTCASE_INFO_TTL = 60 * 60
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+COMPLETE_MARKER = '.clusterfuzz_complete'
+
+
+def build_key(build_url):
+  """Returns the key a build is stored under.
+
+  The key only depends on the build URL, so every testcase that uses the same
+  build shares a single download."""
+
+  name = os.path.splitext(os.path.basename(build_url))[0]
+  return '%s_%s' % (name, hashlib.sha1(build_url).hexdigest()[:12])
+
+
+def parse_size(size):
+  """Converts a size like '500M' or '20G' to a number of bytes."""
+
+  size = str(size).strip().upper()
+  if size and size[-1] in SIZE_UNITS:
+    return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+  return int(size)
+
+
+def format_size(size):
+  """Converts a number of bytes to a human readable size."""
+
+  for unit in ['T', 'G', 'M', 'K']:
+    if size >= SIZE_UNITS[unit]:
+      return '%.1f%s' % (float(size) / SIZE_UNITS[unit], unit)
+  return '%dB' % size
+
+
+def get_quota():
+  """Returns the cache quota in bytes, set by $CLUSTERFUZZ_CACHE_QUOTA."""
+  return parse_size(os.environ.get('CLUSTERFUZZ_CACHE_QUOTA',
+                                   DEFAULT_CACHE_QUOTA))
+
+
+def get_testcase_info_ttl():
+  """Returns how many seconds cached testcase information is used without
+  revalidating it, set by $CLUSTERFUZZ_TESTCASE_INFO_TTL."""
+
+  return int(os.environ.get('CLUSTERFUZZ_TESTCASE_INFO_TTL',
+                            DEFAULT_TESTCASE_INFO_TTL))
+
+
+def is_complete(path):
+  """Returns whether the entry in path was fully fetched.
+
+  A directory without the marker may still be being written by another
+  process, or be left over from one that was killed."""
+
+  return os.path.isfile(os.path.join(path, COMPLETE_MARKER))
+
+
+def mark_complete(path):
+  with open(os.path.join(path, COMPLETE_MARKER), 'w'):
+    pass
+
+
+def get_entry_lock(path):
+  """Returns the lock held while the entry in path is fetched or removed."""
+  return locks.FileLock(os.path.basename(path))
+
+
+def get_directory_size(path):
+  """Returns the total size of the files under path."""
+
+  size = 0
+  for root, _, files in os.walk(path):
+    for name in files:
+      filename = os.path.join(root, name)
+      if not os.path.islink(filename):
+        size += os.path.getsize(filename)
+  return size
+
+
+class CacheIndex(object):
+  """Tracks the size and last access of the cached builds and testcases.
+
+  Builds are shared by every testcase with the same build URL, so the index
+  also maps each testcase ID to the key of the build it uses.
+
+  Builds and testcases may be fetched concurrently, by several threads and
+  processes, so every change reloads the index first and holds a file lock
+  until it is saved."""
+
+  def __init__(self, path=CACHE_INDEX_FILE):
+    self.path = path
+    self.builds = {}
+    self.testcases = {}
+    self.lock = locks.FileLock(os.path.basename(path))
+    self.load()
+
+  def load(self):
+    """Reads the index from disk, if it exists."""
+
+    if os.path.isfile(self.path):
+      with open(self.path, 'r') as f:
+        index = json.load(f)
+      self.builds = index['builds']
+      self.testcases = index['testcases']
+
+  def get_build_key(self, testcase_id):
+    """Returns the key of the build used by a testcase, or None."""
+    return self.testcases.get(str(testcase_id), {}).get('build')
+
+  def add_build(self, testcase_id, build_url, path, size=None):
+    """Records that a testcase uses the build at build_url, stored in path.
+
+    The size is only recomputed when given, as walking a build is slow."""
+
+    key = build_key(build_url)
+    with self.lock:
+      self.load()
+      build = self.builds.setdefault(
+          key, {'url': build_url, 'path': path, 'testcases': [], 'size': 0})
+      if str(testcase_id) not in build['testcases']:
+        build['testcases'].append(str(testcase_id))
+      if size is not None:
+        build['size'] = size
+      build['last_access'] = time.time()
+
+      self.testcases.setdefault(str(testcase_id), {})['build'] = key
+      self.save()
+    return key
+
+  def add_testcase(self, testcase_id, path, size=None):
+    """Records that the files of a testcase are stored in path."""
+
+    with self.lock:
+      self.load()
+      testcase = self.testcases.setdefault(str(testcase_id), {})
+      testcase['path'] = path
+      if size is not None:
+        testcase['size'] = size
+      testcase['last_access'] = time.time()
+      self.save()
+
+  def entries(self):
+    """Returns (kind, key, entry) for all builds and testcases on disk."""
+
+    result = [('build', k, v) for k, v in self.builds.iteritems()]
+    result += [('testcase', k, v) for k, v in self.testcases.iteritems()
+               if 'path' in v]
+    return sorted(result, key=lambda e: e[2].get('last_access', 0))
+
+  def get_total_size(self):
+    return sum(entry.get('size', 0) for _, _, entry in self.entries())
+
+  def evict(self, quota, keep=()):
+    """Removes the least recently used entries until the cache fits quota.
+
+    Entries whose key is in 'keep' are never removed, nor are entries that
+    another requester is fetching. Returns the list of evicted
+    (kind, key) pairs."""
+
+    evicted = []
+    with self.lock:
+      self.load()
+      total_size = self.get_total_size()
+      for kind, key, entry in self.entries():
+        if total_size <= quota:
+          break
+        if key in keep:
+          continue
+        entry_lock = get_entry_lock(entry['path'])
+        if not entry_lock.acquire(blocking=False):
+          continue
+
+        try:
+          if os.path.exists(entry['path']):
+            shutil.rmtree(entry['path'])
+        finally:
+          entry_lock.release()
+        total_size -= entry.get('size', 0)
+        evicted.append((kind, key))
+        if kind == 'build':
+          del self.builds[key]
+        else:
+          del self.testcases[key]['path']
+          self.testcases[key].pop('size', None)
+
+      if evicted:
+        self.save()
+    return evicted
+
+  def save(self):
+    """Writes the index to disk. The lock must be held."""
+
+    if not os.path.exists(os.path.dirname(self.path)):
+      os.makedirs(os.path.dirname(self.path))
+
+    # Other processes read the index without the lock, so it is replaced
+    # rather than rewritten in place.
+    with open(self.path + '.tmp', 'w') as f:
+      json.dump({'builds': self.builds, 'testcases': self.testcases}, f,
+                indent=2, sort_keys=True)
+    os.rename(self.path + '.tmp', self.path)
+
+
+class TestcaseInfoCache(object):
+  """Stores the testcase-detail JSON of each testcase, along with the ETag
+  and Last-Modified headers needed to revalidate it."""
+
+  def __init__(self, directory=TESTCASE_INFO_DIR):
+    self.directory = directory
+
+  def get_path(self, testcase_id):
+    return os.path.join(self.directory, '%s.json' % testcase_id)
+
+  def get(self, testcase_id):
+    """Returns the cached entry of a testcase, or None."""
+
+    path = self.get_path(testcase_id)
+    if not os.path.isfile(path):
+      return None
+    with open(path, 'r') as f:
+      return json.load(f)
+
+  def is_fresh(self, entry, ttl):
+    return time.time() - entry['validated'] < ttl
+
+  def set(self, testcase_id, info, etag=None, last_modified=None):
+    """Stores the information of a testcase, just fetched."""
+
+    self.save(testcase_id, {'info': info,
+                            'etag': etag,
+                            'last_modified': last_modified,
+                            'validated': time.time()})
+
+  def touch(self, testcase_id):
+    """Records that the cached information was found to be up to date."""
+
+    entry = self.get(testcase_id)
+    entry['validated'] = time.time()
+    self.save(testcase_id, entry)
+
+  def save(self, testcase_id, entry):
+    common.make_directory(self.directory)
+    path = self.get_path(testcase_id)
+    with open(path + '.tmp', 'w') as f:
+      json.dump(entry, f)
+    os.rename(path + '.tmp', path)
@@ -0,0 +1,50 @@
+"""Module for the 'build-log' command.
+
+Reports the slowest edges, the critical path and how much was reused in
+the last build of the clusterfuzz out directories."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from clusterfuzz import ninja_log
+from clusterfuzz import out_dirs
+
+
+def get_clusterfuzz_out_dirs(source_directory):
+  """Returns the out directories clusterfuzz built in source_directory."""
+
+  out_dir = os.path.join(source_directory, 'out')
+  if not os.path.isdir(out_dir):
+    return []
+  return [os.path.join(out_dir, name) for name in sorted(os.listdir(out_dir))
+          if name.startswith(out_dirs.OUT_DIR_PREFIX) and
+          os.path.isdir(os.path.join(out_dir, name))]
+
+
+def execute(build_directories, count):
+  """Execute the build-log command."""
+
+  if not build_directories:
+    source_directory = os.environ.get('V8_SRC')
+    if not source_directory:
+      print 'Please pass the out directories or define $V8_SRC.'
+      return
+    build_directories = get_clusterfuzz_out_dirs(
+        os.path.expanduser(source_directory))
+    if not build_directories:
+      print 'No clusterfuzz out directories in %s.' % source_directory
+
+  for build_directory in build_directories:
+    ninja_log.BuildSummary(build_directory).print_summary(count)
@@ -0,0 +1,77 @@
+"""Module for the 'cache' command.
+
+Lists, garbage collects and verifies the builds and testcases stored
+locally."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from clusterfuzz import cache
+
+
+def list_entries(index):
+  """Prints the cached entries, least recently used first."""
+
+  print '%-9s %-40s %9s  %-19s  %s' % (
+      'KIND', 'KEY', 'SIZE', 'LAST ACCESS', 'TESTCASES')
+  for kind, key, entry in index.entries():
+    last_access = time.strftime(
+        '%Y-%m-%d %H:%M:%S', time.localtime(entry.get('last_access', 0)))
+    print '%-9s %-40s %9s  %-19s  %s' % (
+        kind, key, cache.format_size(entry.get('size', 0)), last_access,
+        ','.join(entry.get('testcases', [])))
+  print 'Total: %s (quota: %s)' % (
+      cache.format_size(index.get_total_size()),
+      cache.format_size(cache.get_quota()))
+
+
+def collect_garbage(index, quota):
+  """Evicts the least recently used entries until the cache fits quota."""
+
+  evicted = index.evict(quota)
+  for kind, key in evicted:
+    print 'Evicted %s %s' % (kind, key)
+  print 'Evicted %d entries, %s left.' % (
+      len(evicted), cache.format_size(index.get_total_size()))
+
+
+def verify_entries(index):
+  """Hashes every cached entry, and removes the manifest of corrupt ones so
+  that they are fetched again when next used."""
+
+  from clusterfuzz import manifest
+  corrupt = 0
+  for kind, key, entry in index.entries():
+    with cache.get_entry_lock(entry['path']):
+      problems = manifest.verify(entry['path'], full=True)
+      if problems:
+        manifest.remove(entry['path'])
+    if problems:
+      corrupt += 1
+      print 'Corrupt %s %s: %s' % (kind, key, '; '.join(problems))
+  print 'Verified %d entries, %d corrupt.' % (len(index.entries()), corrupt)
+
+
+def execute(action, quota):
+  """Execute the cache command."""
+
+  index = cache.CacheIndex()
+  if action == 'ls':
+    list_entries(index)
+  elif action == 'gc':
+    collect_garbage(
+        index, cache.parse_size(quota) if quota else cache.get_quota())
+  elif action == 'verify':
+    verify_entries(index)
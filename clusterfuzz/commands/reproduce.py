@@ -15,55 +15,71 @@ Locally reproduces a testcase given a Clusterfuzz ID."""
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# Only what handing the reproduction to the daemon needs is imported here.
+# The rest is imported where it's used, so that scripts running this command
+# many times against a daemon don't pay for it.
 import os
-import json
-import urllib
-import webbrowser
-import urlfetch
+import sys
+import functools
 
 from clusterfuzz import common
-from clusterfuzz import testcase
-from clusterfuzz import binary_providers
+from clusterfuzz import daemon
+from clusterfuzz import trace
 
 CLUSTERFUZZ_AUTH_HEADER = 'x-clusterfuzz-authorization'
 CLUSTERFUZZ_TESTCASE_INFO_URL = ('https://cluster-fuzz.appspot.com/v2/'
                                  'testcase-detail/oauth?testcaseId=%s')
 GOMA_DIR = os.path.expanduser(os.path.join('~', 'goma'))
-GOOGLE_OAUTH_URL = 'https://accounts.google.com/o/oauth2/v2/auth?%s' % (
-    urllib.urlencode({
-        'scope': 'email profile',
-        'client_id': ('981641712411-sj50drhontt4m3gjc3hordjmp'
-                      'c7bn50f.apps.googleusercontent.com'),
-        'response_type': 'code',
-        'redirect_uri': 'urn:ietf:wg:oauth:2.0:oob'}))
+REPRODUCTION_HANG_TIMEOUT = 60
+GOOGLE_OAUTH_URL = 'https://accounts.google.com/o/oauth2/v2/auth?%s'
+GOOGLE_OAUTH_PARAMETERS = {
+    'scope': 'email profile',
+    'client_id': ('981641712411-sj50drhontt4m3gjc3hordjmp'
+                  'c7bn50f.apps.googleusercontent.com'),
+    'response_type': 'code',
+    'redirect_uri': 'urn:ietf:wg:oauth:2.0:oob'}
+
+
+def get_google_oauth_url():
+  import urllib
+  return GOOGLE_OAUTH_URL % urllib.urlencode(GOOGLE_OAUTH_PARAMETERS)
+
 
 def get_verification_header():
   """Prompts the user for & returns a verification token."""
 
-  webbrowser.open(GOOGLE_OAUTH_URL, new=1, autoraise=True)
+  import webbrowser
+  if not common.is_interactive():
+    raise common.NotInteractiveError('Please enter your verification code')
+  webbrowser.open(get_google_oauth_url(), new=1, autoraise=True)
   verification = common.ask('Please enter your verification code',
                             'Please enter a code', bool)
   return 'VerificationCode %s' % verification
 
 
-def send_request(url):
+def send_request(url, headers=None):
   """Get a clusterfuzz url that requires authentication.
 
   Attempts to authenticate and is guaranteed to either
-  return a valid, authorized response or throw an exception."""
+  return a valid, authorized response or throw an exception. 'headers' are
+  sent along with the authorization, and a 304 answer to a conditional
+  request counts as valid."""
 
+  from clusterfuzz import http_client
   header = common.get_stored_auth_header()
   response = None
   for _ in range(2):
     if not header or (response and response.status == 401):
       header = get_verification_header()
-    response = urlfetch.fetch(url=url, headers={'Authorization': header})
-    if response.status == 200:
+    response = http_client.fetch(
+        url=url, headers=dict(headers or {}, Authorization=header))
+    if response.status in (200, 304):
       break
 
-  if response.status != 200:
+  if response.status not in (200, 304):
     raise common.ClusterfuzzAuthError(response.body)
-  common.store_auth_header(response.headers[CLUSTERFUZZ_AUTH_HEADER])
+  if CLUSTERFUZZ_AUTH_HEADER in response.headers:
+    common.store_auth_header(response.headers[CLUSTERFUZZ_AUTH_HEADER])
 
   return response
 
@@ -72,10 +88,39 @@ def get_testcase_info(testcase_id):
 
   Returns a dictionary with the JSON response if the
   authentication is successful.
+
+  The information is cached locally. A cached copy younger than its TTL is
+  used as is, and an older one is revalidated with a conditional request.
+  When offline, the cached copy is used whatever its age.
   """
 
+  import json
+  from clusterfuzz import cache
+  from clusterfuzz import http_client
+  info_cache = cache.TestcaseInfoCache()
+  entry = info_cache.get(testcase_id)
+  if entry and (http_client.is_offline() or
+                info_cache.is_fresh(entry, cache.get_testcase_info_ttl())):
+    return entry['info']
+  if http_client.is_offline():
+    raise common.OfflineError('the information of testcase %s' % testcase_id)
+
+  headers = {}
+  if entry and entry.get('etag'):
+    headers['If-None-Match'] = entry['etag']
+  if entry and entry.get('last_modified'):
+    headers['If-Modified-Since'] = entry['last_modified']
+
   url = CLUSTERFUZZ_TESTCASE_INFO_URL % testcase_id
-  return json.loads(send_request(url).body)
+  response = send_request(url, headers)
+  if response.status == 304:
+    info_cache.touch(testcase_id)
+    return entry['info']
+
+  info = json.loads(response.body)
+  info_cache.set(testcase_id, info, response.headers.get('etag'),
+                 response.headers.get('last-modified'))
+  return info
 
 def ensure_goma():
   """Ensures GOMA is installed and ready for use, and starts it."""
@@ -88,31 +133,194 @@ def ensure_goma():
   return goma_dir
 
 
-def reproduce_crash(binary_path, current_testcase):
-  """Reproduces a crash by running the downloaded testcase against a binary."""
+def get_reproduction_command(binary_path, current_testcase):
+  return '%s %s %s' % (binary_path, current_testcase.reproduction_args,
+                       current_testcase.get_testcase_path())
 
-  command = '%s %s %s' % (binary_path, current_testcase.reproduction_args,
-                          current_testcase.get_testcase_path())
-  common.execute(command, os.path.dirname(binary_path),
-                 environment=current_testcase.environment)
 
+def measure_flakiness(binary_path, current_testcase, runs, parallel,
+                      timeout=None, cpu_timeout=None):
+  """Runs the testcase repeatedly and reports how often it crashes."""
 
-def execute(testcase_id, current, download):
-  """Execute the reproduce command."""
+  from clusterfuzz import flakiness
+  command = get_reproduction_command(binary_path, current_testcase)
+  print 'Running %s up to %d times, %d at a time...' % (
+      command, runs, parallel)
+  flakiness.print_report(flakiness.measure(
+      command, current_testcase.environment, runs, parallel,
+      current_testcase.get_crash_signature(),
+      {'timeout': timeout, 'cpu_timeout': cpu_timeout,
+       'hang_timeout': REPRODUCTION_HANG_TIMEOUT}))
+
+
+def reproduce_crash(binary_path, current_testcase, print_output=True,
+                    exit_on_error=True, stop_on_verdict=False, timeout=None,
+                    cpu_timeout=None):
+  """Reproduces a crash by running the downloaded testcase against a binary.
+
+  The crash report is compared to the original crash. With
+  'stop_on_verdict', the binary is killed as soon as the comparison is
+  decided, which skips symbolizing the rest of the report and the teardown.
+  Returns the return code, the output and the stack_analyzer verdict.
+  Raises common.CommandTimeoutError if the binary runs into a limit or
+  hangs."""
+
+  from clusterfuzz import stack_analyzer
+  command = get_reproduction_command(binary_path, current_testcase)
+  matcher = stack_analyzer.SignatureMatcher(
+      current_testcase.get_crash_signature())
+  returncode, output = common.execute(
+      command, os.path.dirname(binary_path), print_output=print_output,
+      exit_on_error=exit_on_error, environment=current_testcase.environment,
+      line_callback=matcher.feed if stop_on_verdict else None,
+      timeout=timeout, cpu_timeout=cpu_timeout,
+      hang_timeout=REPRODUCTION_HANG_TIMEOUT)
+  if not stop_on_verdict:
+    for line in output.splitlines():
+      if matcher.feed(line):
+        break
+  return returncode, output, matcher.get_verdict()
+
+
+def execute(testcase_id, current, download, trace_file=None, runs=1,
+            parallel=None, timeout=None, cpu_timeout=None, offline=False,
+            no_daemon=False):
+  """Execute the reproduce command.
+
+  If 'trace_file' is set, the time spent in each phase is written to it as
+  Chrome trace-event JSON and summarized at the end. With more than one run,
+  the testcase is run repeatedly to measure how reliably it crashes.
+  'timeout' and 'cpu_timeout' limit each run of the binary, in seconds.
+  With 'offline', only cached testcases and builds are used.
+
+  The reproduction runs in the daemon started by 'clusterfuzz serve', if
+  there is one, unless 'no_daemon' is set. Traced and offline reproductions
+  always run here, since tracing and offline mode apply to the whole
+  process, and so do those the daemon turns down, e.g. because they need to
+  ask the user something."""
+
+  import multiprocessing
+  parallel = parallel or multiprocessing.cpu_count()
+  if not (no_daemon or trace_file or offline) and daemon.is_running():
+    exit_code = daemon.submit('reproduce', {
+        'testcase_id': testcase_id, 'current': current, 'download': download,
+        'runs': runs, 'parallel': parallel, 'timeout': timeout,
+        'cpu_timeout': cpu_timeout})
+    if exit_code is not None:
+      if exit_code:
+        sys.exit(exit_code)
+      return
+
+  if offline:
+    from clusterfuzz import http_client
+    http_client.set_offline(True)
+  try:
+    reproduce(testcase_id, current, download, runs, parallel, timeout,
+              cpu_timeout)
+  finally:
+    if trace_file:
+      trace.write_chrome_trace(trace_file)
+      trace.print_summary()
+      print 'Trace written to %s' % trace_file
 
-  print 'Reproduce %s (current=%s)' % (testcase_id, current)
-  print 'Downloading testcase information...'
 
-  response = get_testcase_info(testcase_id)
-  goma_dir = ensure_goma()
-  current_testcase = testcase.Testcase(response)
+def get_testcase(testcase_id):
+  from clusterfuzz import testcase
+  with trace.span('get_testcase_info'):
+    return testcase.Testcase(get_testcase_info(testcase_id))
 
+
+def get_testcase_path(current_testcase):
+  with trace.span('get_testcase_path'):
+    return current_testcase.get_testcase_path()
+
+
+def get_goma_dir():
+  with trace.span('ensure_goma'):
+    return ensure_goma()
+
+
+def get_downloaded_binary(current_testcase, providers):
+  from clusterfuzz import binary_providers
+  binary_provider = binary_providers.V8DownloadedBinary(
+      current_testcase.id, current_testcase.build_url)
+  providers.append(binary_provider)
+  with trace.span('get_binary'):
+    return binary_provider.get_binary_path()
+
+
+def get_built_binary(current_testcase, goma_dir, current, providers):
+  from clusterfuzz import binary_providers
+  binary_provider = binary_providers.V8Builder(
+      current_testcase.id, current_testcase.build_url,
+      current_testcase.revision, current, goma_dir, os.environ.get('V8_SRC'))
+  providers.append(binary_provider)
+  with trace.span('get_binary'):
+    return binary_provider.get_binary_path()
+
+
+def get_reproduction_tasks(testcase_id, current, download, providers,
+                           goma_dir=None):
+  """Returns the steps needed before a testcase can be run.
+
+  Goma starts while the testcase information is fetched, and the testcase
+  file and the binary are fetched concurrently once it arrives. Goma is
+  only needed to build, so it isn't started for downloaded builds, nor when
+  'goma_dir' says it was already started. The binary provider is appended
+  to 'providers', to be released once the binary is no longer run."""
+
+  from clusterfuzz import scheduler
+  tasks = [
+      scheduler.Task('current_testcase', lambda: get_testcase(testcase_id)),
+      scheduler.Task('testcase_path', get_testcase_path, ['current_testcase'])]
   if download:
-    binary_provider = binary_providers.V8DownloadedBinary(
-        current_testcase.id, current_testcase.build_url)
+    tasks.append(scheduler.Task(
+        'binary_path',
+        functools.partial(get_downloaded_binary, providers=providers),
+        ['current_testcase']))
   else:
-    binary_provider = binary_providers.V8Builder( # pylint: disable=redefined-variable-type
-        current_testcase.id, current_testcase.build_url,
-        current_testcase.revision, current, goma_dir, os.environ.get('V8_SRC'))
+    tasks.append(scheduler.Task('goma_dir',
+                                lambda: goma_dir or get_goma_dir()))
+    tasks.append(scheduler.Task(
+        'binary_path',
+        functools.partial(get_built_binary, current=current,
+                          providers=providers),
+        ['current_testcase', 'goma_dir']))
+  return tasks
+
+
+def reproduce(testcase_id, current, download, runs=1, parallel=1,
+              timeout=None, cpu_timeout=None, goma_dir=None):
+  """Reproduces a testcase, timing each phase.
+
+  What was reserved for the binary, e.g. the worktree it was built in, is
+  released once the reproduction is over, rather than when the process
+  exits, which daemon jobs never see."""
+
+  from clusterfuzz import scheduler
+  print 'Reproduce %s (current=%s)' % (testcase_id, current)
+  print 'Downloading testcase information...'
+
+  providers = []
+  try:
+    results = scheduler.run(get_reproduction_tasks(
+        testcase_id, current, download, providers, goma_dir))
+    if runs > 1:
+      with trace.span('measure_flakiness'):
+        measure_flakiness(results['binary_path'], results['current_testcase'],
+                          runs, parallel, timeout, cpu_timeout)
+      return
+    with trace.span('reproduce_crash'):
+      try:
+        returncode, _, verdict = reproduce_crash(
+            results['binary_path'], results['current_testcase'],
+            exit_on_error=False, timeout=timeout, cpu_timeout=cpu_timeout)
+      except common.CommandTimeoutError as e:
+        returncode, verdict = 1, e.status
+  finally:
+    for binary_provider in providers:
+      binary_provider.release()
 
-  reproduce_crash(binary_provider.get_binary_path(), current_testcase)
+  print 'Crash signature: %s' % verdict
+  if returncode != 0:
+    sys.exit(returncode)
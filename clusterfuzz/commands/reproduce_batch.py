@@ -0,0 +1,276 @@
+"""Module for the 'reproduce-batch' command.
+
+Reproduces many testcases in one run. Testcase information and files are
+fetched concurrently, testcases that share a build only fetch or build it
+once, and the reproductions run on a bounded pool."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import collections
+import multiprocessing
+from multiprocessing import pool
+
+from clusterfuzz import binary_providers
+from clusterfuzz import common
+from clusterfuzz import scheduler
+from clusterfuzz import stack_analyzer
+from clusterfuzz import testcase
+from clusterfuzz import worktrees
+from clusterfuzz.commands import reproduce
+
+FETCH_JOBS = 8
+MEMORY_PER_REPRODUCTION = 2 * 1024 ** 3
+RESULT_OUTPUT_SIZE = 16 * 1024
+
+
+def read_testcase_ids(testcase_ids, ids_file=None):
+  """Returns the IDs given as arguments and listed in ids_file, in order and
+  without duplicates. The file holds whitespace-separated IDs, and '#'
+  starts a comment."""
+
+  ids = list(testcase_ids)
+  if ids_file:
+    with open(ids_file, 'r') as f:
+      for line in f:
+        ids.extend(line.split('#')[0].split())
+
+  seen = set()
+  unique_ids = []
+  for testcase_id in ids:
+    if testcase_id not in seen:
+      seen.add(testcase_id)
+      unique_ids.append(testcase_id)
+  return unique_ids
+
+
+def get_default_jobs():
+  """Returns how many reproductions can run at once.
+
+  ASan builds need a lot of memory, so this is bounded by the available
+  memory as well as by the number of cores."""
+
+  jobs = multiprocessing.cpu_count()
+  memory = common.get_available_memory()
+  if memory is not None:
+    jobs = min(jobs, memory // MEMORY_PER_REPRODUCTION)
+  return max(1, jobs)
+
+
+def call(function, *args):
+  """Returns (result, None), or (None, error) if function failed.
+
+  Commands exit on errors, so SystemExit is caught too: one broken testcase
+  must not stop the batch."""
+
+  try:
+    return function(*args), None
+  except (Exception, SystemExit) as e: # pylint: disable=broad-except
+    return None, '%s: %s' % (type(e).__name__, e)
+
+
+def map_concurrently(function, items, jobs):
+  """Returns call(function, item) for each item, using a pool of threads."""
+
+  if not items:
+    return []
+  thread_pool = pool.ThreadPool(min(jobs, len(items)))
+  try:
+    return thread_pool.map(lambda item: call(function, item), items)
+  finally:
+    thread_pool.close()
+
+
+def fetch_testcase(testcase_id):
+  return testcase.Testcase(reproduce.get_testcase_info(testcase_id))
+
+
+def fetch_testcases(testcase_ids):
+  """Returns {testcase_id: (testcase, error)}.
+
+  The first testcase is fetched alone, so that the user is asked to
+  authenticate at most once."""
+
+  results = {}
+  if testcase_ids:
+    results[testcase_ids[0]] = call(fetch_testcase, testcase_ids[0])
+  rest = testcase_ids[1:]
+  results.update(zip(rest, map_concurrently(fetch_testcase, rest, FETCH_JOBS)))
+  return results
+
+
+def get_binary_path(binary_provider):
+  return binary_provider.get_binary_path()
+
+
+def prepare_binaries(testcases, current, download, providers):
+  """Returns {build_url: (binary_path, error)}, fetching or building each
+  build once.
+
+  Downloads run concurrently. Local builds run one after another, unless
+  each revision is built in its own worktree. The binary providers are
+  appended to 'providers', to be released once the binaries are no longer
+  run."""
+
+  first_testcases = collections.OrderedDict()
+  for current_testcase in testcases:
+    first_testcases.setdefault(current_testcase.build_url, current_testcase)
+  if not first_testcases:
+    return {}
+
+  if download:
+    providers.extend(binary_providers.V8DownloadedBinary(t.id, t.build_url)
+                     for t in first_testcases.itervalues())
+    results = map_concurrently(get_binary_path, providers, FETCH_JOBS)
+  else:
+    goma_dir, error = call(reproduce.ensure_goma)
+    if error:
+      results = [(None, error)] * len(first_testcases)
+    else:
+      providers.extend(binary_providers.V8Builder(
+          t.id, t.build_url, t.revision, current, goma_dir,
+          os.environ.get('V8_SRC')) for t in first_testcases.itervalues())
+      build_jobs = 1
+      if not current and os.environ.get('V8_SRC'):
+        build_jobs = max(1, worktrees.get_pool_size())
+      results = map_concurrently(get_binary_path, providers, build_jobs)
+  return dict(zip(first_testcases.iterkeys(), results))
+
+
+def fetch_testcase_files(testcases):
+  """Returns {testcase_id: (testcase_path, error)}."""
+
+  def get_testcase_path(current_testcase):
+    return current_testcase.get_testcase_path()
+  results = map_concurrently(get_testcase_path, testcases, FETCH_JOBS)
+  return dict(zip([t.id for t in testcases], results))
+
+
+def run_reproduction(args):
+  """Runs a testcase and returns its result record.
+
+  A testcase stopped by a limit has the status of the CommandTimeoutError:
+  timeout, cpu_timeout or hang."""
+
+  binary_path, current_testcase, timeout, cpu_timeout = args
+  def run():
+    try:
+      return reproduce.reproduce_crash(
+          binary_path, current_testcase, print_output=False,
+          exit_on_error=False, stop_on_verdict=True, timeout=timeout,
+          cpu_timeout=cpu_timeout)
+    except common.CommandTimeoutError as e:
+      return None, e.output, e.status
+
+  start = time.time()
+  result, error = call(run)
+  record = make_record(current_testcase.id, current_testcase.build_url,
+                       error=error)
+  record['duration'] = time.time() - start
+  if result:
+    returncode, output, verdict = result
+    if returncode is None:
+      record['status'] = verdict
+    elif stack_analyzer.is_reproduced(verdict, returncode):
+      record['status'] = 'crashed'
+    else:
+      record['status'] = 'no_crash'
+    record['verdict'] = verdict
+    record['returncode'] = returncode
+    record['output'] = output[-RESULT_OUTPUT_SIZE:]
+  return record
+
+
+def make_record(testcase_id, build_url=None, error=None):
+  return {'testcase_id': str(testcase_id),
+          'build_url': build_url,
+          'status': 'error' if error else None,
+          'error': error}
+
+
+def write_record(record, output_file):
+  """Prints a one-line result and appends the record as JSON to the file."""
+
+  print '%-10s %-9s %s' % (record['testcase_id'], record['status'],
+                           record['error'] or '')
+  if output_file:
+    output_file.write(json.dumps(record, sort_keys=True) + '\n')
+    output_file.flush()
+
+
+def execute(testcase_ids, ids_file, current, download, jobs, output,
+            timeout=None, cpu_timeout=None):
+  """Execute the reproduce-batch command.
+
+  'timeout' and 'cpu_timeout' limit each reproduction, in seconds."""
+
+  testcase_ids = read_testcase_ids(testcase_ids, ids_file)
+  jobs = jobs or get_default_jobs()
+  print 'Reproducing %d testcases, %d at a time...' % (len(testcase_ids), jobs)
+
+  output_file = open(output, 'w') if output else None
+  providers = []
+  try:
+    fetched = fetch_testcases(testcase_ids)
+    testcases = []
+    for testcase_id in testcase_ids:
+      current_testcase, error = fetched[testcase_id]
+      if error:
+        write_record(make_record(testcase_id, error=error), output_file)
+      else:
+        testcases.append(current_testcase)
+
+    results = scheduler.run([
+        scheduler.Task('testcase_paths',
+                       lambda: fetch_testcase_files(testcases)),
+        scheduler.Task('binary_paths',
+                       lambda: prepare_binaries(testcases, current, download,
+                                                providers))])
+
+    runnable = []
+    for current_testcase in testcases:
+      _, error = results['testcase_paths'][current_testcase.id]
+      binary_path, build_error = (
+          results['binary_paths'][current_testcase.build_url])
+      error = error or build_error
+      if error:
+        write_record(make_record(current_testcase.id,
+                                 current_testcase.build_url, error),
+                     output_file)
+      else:
+        runnable.append((binary_path, current_testcase, timeout, cpu_timeout))
+
+    counts = collections.Counter()
+    if runnable:
+      reproduction_pool = pool.ThreadPool(min(jobs, len(runnable)))
+      try:
+        for record in reproduction_pool.imap_unordered(run_reproduction,
+                                                       runnable):
+          counts[record['status']] += 1
+          write_record(record, output_file)
+      finally:
+        reproduction_pool.close()
+    counts['error'] += len(testcase_ids) - len(runnable)
+
+    print 'Crashed: %d, did not crash: %d, timed out: %d, errors: %d' % (
+        counts['crashed'], counts['no_crash'],
+        counts['timeout'] + counts['cpu_timeout'] + counts['hang'],
+        counts['error'])
+  finally:
+    for binary_provider in providers:
+      binary_provider.release()
+    if output_file:
+      output_file.close()
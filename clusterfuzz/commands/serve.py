@@ -0,0 +1,94 @@
+"""Module for the 'serve' command.
+
+Runs a daemon that reproduces testcases for 'clusterfuzz reproduce'. The
+process stays up, so each reproduction skips the interpreter startup and
+imports, goma is started once and kept running, and connections to
+ClusterFuzz and Cloud Storage are kept alive between reproductions."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import threading
+
+from clusterfuzz import common
+from clusterfuzz import daemon
+from clusterfuzz.commands import reproduce
+from clusterfuzz.commands import reproduce_batch
+
+GOMA_CHECK_INTERVAL = 10 * 60
+
+
+class WarmGoma(object):
+  """Starts goma once, and checks every GOMA_CHECK_INTERVAL that it still
+  runs, rather than before every build."""
+
+  def __init__(self):
+    self.goma_dir = None
+    self.checked = 0
+    self._lock = threading.Lock()
+
+  def get_goma_dir(self):
+    """Returns the goma directory, starting goma if it wasn't checked
+    recently."""
+
+    with self._lock:
+      if not self.goma_dir or time.time() - self.checked > GOMA_CHECK_INTERVAL:
+        self.goma_dir = reproduce.ensure_goma()
+        self.checked = time.time()
+      return self.goma_dir
+
+  def keep_warm(self, stopped):
+    """Checks goma every GOMA_CHECK_INTERVAL until 'stopped' is set."""
+
+    while not stopped.wait(GOMA_CHECK_INTERVAL):
+      try:
+        self.get_goma_dir()
+      except (common.GomaNotInstalledError, SystemExit) as e:
+        print 'Goma is not running: %s' % e
+
+
+def make_reproduce_command(goma):
+  """Returns the function running a reproduce job."""
+
+  def run(testcase_id, current, download, runs, parallel, timeout,
+          cpu_timeout):
+    reproduce.reproduce(
+        testcase_id, current, download, runs, parallel, timeout, cpu_timeout,
+        goma_dir=None if download else goma.get_goma_dir())
+  return run
+
+
+def execute(jobs):
+  """Execute the serve command."""
+
+  jobs = jobs or reproduce_batch.get_default_jobs()
+  goma = WarmGoma()
+  server = daemon.Daemon({'reproduce': make_reproduce_command(goma)}, jobs)
+  server.listen()
+
+  try:
+    goma.get_goma_dir()
+  except common.GomaNotInstalledError as e:
+    print '%s Only --download reproductions will work.' % e
+  keeper = threading.Thread(target=goma.keep_warm, args=(server.stopped,))
+  keeper.daemon = True
+  keeper.start()
+
+  print 'Serving on %s, %d jobs at a time.' % (server.socket_path, jobs)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    print 'Stopped.'
+  finally:
+    server.stop()
@@ -15,11 +15,30 @@
 
 import os
 import sys
+import errno
+import atexit
 import stat
+import time
+import signal
+import resource
+import threading
+import collections
 import subprocess
 
+from clusterfuzz import trace
+
 CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
 AUTH_HEADER_FILE = os.path.join(CLUSTERFUZZ_DIR, 'auth_header')
+OUTPUT_READ_SIZE = 64 * 1024
+OUTPUT_HEAD_SIZE = 1024 * 1024
+OUTPUT_TAIL_SIZE = 4 * 1024 * 1024
+OUTPUT_TRUNCATION_MESSAGE = '\n[... %d bytes of output omitted ...]\n'
+WATCHDOG_INTERVAL = 1
+TERMINATION_GRACE_PERIOD = 5
+PROC_DIR = '/proc'
+MEMINFO_FILE = '/proc/meminfo'
+
+_interactive = True
 
 class ClusterfuzzAuthError(Exception):
   """An exception to deal with Clusterfuzz Authentication errors.
@@ -63,6 +82,87 @@ class GomaNotInstalledError(Exception):
     super(GomaNotInstalledError, self).__init__(message)
 
 
+class BadArchiveError(Exception):
+  """An exception to deal with corrupt or unsupported build archives."""
+
+  def __init__(self, reason):
+    message = 'Unable to extract the build archive: %s' % reason
+    super(BadArchiveError, self).__init__(message)
+    self.reason = reason
+
+
+class BuildDownloadError(Exception):
+  """An exception to deal with failed build downloads."""
+
+  def __init__(self, build_url, reason):
+    message = 'Error downloading the build from %s\n%s' % (build_url, reason)
+    super(BuildDownloadError, self).__init__(message)
+    self.build_url = build_url
+
+
+class HttpError(Exception):
+  """An exception to deal with unexpected HTTP responses."""
+
+  def __init__(self, url, status):
+    message = 'Request to %s failed with status %d' % (url, status)
+    super(HttpError, self).__init__(message)
+    self.url = url
+    self.status = status
+
+
+class OfflineError(Exception):
+  """An exception raised when something that isn't cached is needed
+  offline."""
+
+  def __init__(self, what):
+    message = '%s is not cached, and the network is not used offline' % what
+    super(OfflineError, self).__init__(message)
+    self.what = what
+
+
+class NotInteractiveError(Exception):
+  """An exception raised when a question is asked in a process that can't
+  prompt the user, such as the daemon."""
+
+  def __init__(self, question):
+    message = ('%s? This needs a terminal: run the command again with'
+               ' --no-daemon.' % question)
+    super(NotInteractiveError, self).__init__(message)
+    self.question = question
+
+
+class DaemonAlreadyRunningError(Exception):
+  """An exception raised when a daemon already listens on the socket."""
+
+  def __init__(self, socket_path):
+    super(DaemonAlreadyRunningError, self).__init__(
+        'A daemon is already running on %s' % socket_path)
+    self.socket_path = socket_path
+
+
+class NinjaLogError(Exception):
+  """An exception to deal with unreadable .ninja_log files."""
+
+  def __init__(self, path, reason):
+    message = 'Unable to read the ninja log %s: %s' % (path, reason)
+    super(NinjaLogError, self).__init__(message)
+    self.path = path
+
+
+class CommandTimeoutError(Exception):
+  """An exception raised when a command is stopped for running too long.
+
+  'status' is 'timeout' when it exceeded its wall-clock limit, 'cpu_timeout'
+  when it exceeded its CPU-time limit and 'hang' when it made no progress.
+  'output' holds what it printed until then."""
+
+  def __init__(self, command, status, output):
+    message = '%s was stopped: %s' % (get_command_name(command), status)
+    super(CommandTimeoutError, self).__init__(message)
+    self.status = status
+    self.output = output
+
+
 def store_auth_header(auth_header):
   """Stores 'auth_header' locally for future access."""
 
@@ -91,33 +191,382 @@ def get_stored_auth_header():
     return f.read()
 
 
+class OutputBuffer(object):
+  """Captures process output while keeping only its head and tail in memory.
+
+  The full output can additionally be spilled to a file, so that nothing is
+  lost when the in-memory copy is truncated."""
+
+  def __init__(self, head_size=OUTPUT_HEAD_SIZE, tail_size=OUTPUT_TAIL_SIZE,
+               spill_file=None):
+    self.head_size = head_size
+    self.tail_size = tail_size
+    self.head = []
+    self.head_length = 0
+    self.tail = collections.deque()
+    self.tail_length = 0
+    self.total_length = 0
+    self.spill_file = spill_file
+
+  def write(self, data):
+    """Appends a chunk of output."""
+
+    self.total_length += len(data)
+    if self.spill_file:
+      self.spill_file.write(data)
+
+    if self.head_length < self.head_size:
+      head_part = data[:self.head_size - self.head_length]
+      self.head.append(head_part)
+      self.head_length += len(head_part)
+      data = data[len(head_part):]
+    if not data:
+      return
+
+    self.tail.append(data)
+    self.tail_length += len(data)
+    while self.tail and self.tail_length - len(self.tail[0]) >= self.tail_size:
+      self.tail_length -= len(self.tail.popleft())
+
+  def getvalue(self):
+    """Returns the captured output, marking where bytes were dropped."""
+
+    head = ''.join(self.head)
+    tail = ''.join(self.tail)[-self.tail_size:] if self.tail_size else ''
+    omitted = self.total_length - len(head) - len(tail)
+    if omitted:
+      return head + OUTPUT_TRUNCATION_MESSAGE % omitted + tail
+    return head + tail
+
+
+def make_directory(path):
+  """Creates path, tolerating other workers creating it concurrently."""
+
+  try:
+    os.makedirs(path)
+  except OSError as e:
+    if e.errno != errno.EEXIST or not os.path.isdir(path):
+      raise
+
+
+def get_available_memory():
+  """Returns the memory available to new processes in bytes, or None."""
+
+  try:
+    with open(MEMINFO_FILE, 'r') as f:
+      for line in f:
+        if line.startswith('MemAvailable:'):
+          return int(line.split()[1]) * 1024
+  except IOError:
+    pass
+  return None
+
+
+def kill_process_group(pid, signal_number=signal.SIGKILL):
+  """Signals the process group led by pid, if it still exists."""
+
+  try:
+    os.killpg(pid, signal_number)
+  except OSError as e:
+    if e.errno != errno.ESRCH:
+      raise
+
+
+def read_process_stats():
+  """Returns the fields of /proc/<pid>/stat that follow the command name, by
+  pid, or None where /proc isn't available."""
+
+  try:
+    pids = [p for p in os.listdir(PROC_DIR) if p.isdigit()]
+  except OSError:
+    return None
+
+  stats = {}
+  for pid in pids:
+    try:
+      with open(os.path.join(PROC_DIR, pid, 'stat'), 'r') as f:
+        # The command name in parentheses may contain spaces.
+        stats[int(pid)] = f.read().rsplit(')', 1)[1].split()
+    except (IOError, IndexError):
+      continue
+  return stats
+
+
+def get_process_tree(pid, stats):
+  """Returns pid and the pids of all its descendants."""
+
+  children = collections.defaultdict(list)
+  for child, fields in stats.iteritems():
+    children[int(fields[1])].append(child)
+  tree = [pid]
+  for parent in tree:
+    tree.extend(children[parent])
+  return tree
+
+
+def kill_process_tree(pid, signal_number=signal.SIGKILL):
+  """Signals pid and all its descendants that still exist."""
+
+  stats = read_process_stats()
+  for child in get_process_tree(pid, stats) if stats else [pid]:
+    try:
+      os.kill(child, signal_number)
+    except OSError as e:
+      if e.errno != errno.ESRCH:
+        raise
+
+
+def kill_command(pid, process_group, signal_number=signal.SIGKILL):
+  """Signals a command started by execute, with all its processes."""
+
+  if process_group:
+    kill_process_group(pid, signal_number)
+  else:
+    kill_process_tree(pid, signal_number)
+
+
+_running_commands = {}
+_running_commands_lock = threading.Lock()
+
+
+def kill_running_commands():
+  """Kills every command still running, with all its processes.
+
+  Ctrl-C is only raised in the main thread, so commands run by other threads
+  are stopped from there, and when the process exits."""
+
+  with _running_commands_lock:
+    commands = _running_commands.items()
+  for pid, process_group in commands:
+    kill_command(pid, process_group)
+
+
+atexit.register(kill_running_commands)
+
+
+def forget_command(pid):
+  """Stops tracking a command that finished."""
+
+  with _running_commands_lock:
+    _running_commands.pop(pid, None)
+
+
+def get_process_group_cpu_time(pgid):
+  """Returns the CPU time in clock ticks used by the processes of a group,
+  including their reaped children, or None where /proc isn't available."""
+
+  stats = read_process_stats()
+  if stats is None:
+    return None
+  return sum(sum(int(f) for f in fields[11:15])
+             for fields in stats.itervalues() if int(fields[2]) == pgid)
+
+
+def get_process_tree_cpu_time(pid):
+  """Returns the CPU time in clock ticks used by pid and its descendants,
+  including their reaped children, or None where /proc isn't available."""
+
+  stats = read_process_stats()
+  if stats is None:
+    return None
+  return sum(sum(int(f) for f in stats[child][11:15])
+             for child in get_process_tree(pid, stats) if child in stats)
+
+
+class Watchdog(threading.Thread):
+  """Stops a command that runs too long or stops making progress.
+
+  A command is hung when it neither printed anything nor used any CPU time
+  for hang_timeout seconds. It is sent SIGTERM first, then SIGKILL if it is
+  still running after a grace period. The processes of the command are those
+  of its process group or, without one, those descending from pid."""
+
+  def __init__(self, pid, timeout=None, hang_timeout=None,
+               process_group=True):
+    super(Watchdog, self).__init__()
+    self.daemon = True
+    self.pid = pid
+    self.process_group = process_group
+    self.timeout = timeout
+    self.hang_timeout = hang_timeout
+    self.last_output = time.time()
+    self.status = None
+    self.finished = threading.Event()
+
+  def output_received(self):
+    self.last_output = time.time()
+
+  def get_status(self, start, last_progress):
+    now = time.time()
+    if self.timeout and now - start > self.timeout:
+      return 'timeout'
+    if self.hang_timeout and now - last_progress > self.hang_timeout:
+      return 'hang'
+    return None
+
+  def run(self):
+    start = last_progress = time.time()
+    cpu_time = None
+    while not self.finished.wait(WATCHDOG_INTERVAL):
+      if self.hang_timeout:
+        new_cpu_time = (get_process_group_cpu_time(self.pid)
+                        if self.process_group
+                        else get_process_tree_cpu_time(self.pid))
+        if new_cpu_time != cpu_time:
+          cpu_time = new_cpu_time
+          last_progress = time.time()
+        last_progress = max(last_progress, self.last_output)
+
+      self.status = self.get_status(start, last_progress)
+      if self.status:
+        kill_command(self.pid, self.process_group, signal.SIGTERM)
+        if not self.finished.wait(TERMINATION_GRACE_PERIOD):
+          kill_command(self.pid, self.process_group)
+        return
+
+  def stop(self):
+    """Stops watching, once the process has finished."""
+    self.finished.set()
+    self.join()
+
+
+def get_child_setup(cpu_timeout, process_group):
+  """Returns the function run in the child before the command starts.
+
+  With 'process_group', the command gets a process group of its own, so that
+  it can be stopped along with its children. The group is in the background
+  of the terminal, which stops it as soon as it reads from the terminal, so
+  commands that may prompt stay in the group of this process. The CPU-time
+  limit applies to each process."""
+
+  def setup_child():
+    if process_group:
+      os.setpgid(0, 0)
+    if cpu_timeout:
+      resource.setrlimit(resource.RLIMIT_CPU, (cpu_timeout, cpu_timeout + 1))
+  return setup_child
+
+
+def get_command_name(command):
+  """Returns the program a shell command runs, skipping leading variable
+  assignments. Used to label commands without recording their arguments,
+  which may hold credentials."""
+
+  for word in command.split():
+    if '=' not in word:
+      return os.path.basename(word)
+  return command
+
+
 def execute(command,
             cwd,
             print_output=True,
             exit_on_error=True,
-            environment=None):
-  """Execute a bash command."""
+            environment=None,
+            output_file=None,
+            line_callback=None,
+            timeout=None,
+            cpu_timeout=None,
+            hang_timeout=None,
+            interactive=False):
+  """Execute a bash command.
+
+  Output is read in chunks and only its head and tail are kept in memory. If
+  'output_file' is set, the complete output is also written to that path.
+
+  'line_callback' is called with each line of output as it arrives. Once it
+  returns True, the command and all its child processes are killed.
+
+  The command is stopped, and CommandTimeoutError raised, if it runs for
+  longer than 'timeout' seconds, uses more than 'cpu_timeout' seconds of CPU
+  in any one process, or prints nothing and uses no CPU for 'hang_timeout'
+  seconds.
+
+  'interactive' commands may prompt on the terminal, so they run in the
+  foreground process group of this process, and get its Ctrl-C, rather than
+  in a group of their own."""
   def _print(s):
     if print_output:
       print s
 
   _print('Running: %s' % command)
-  output = ''
+  spill_file = open(output_file, 'wb') if output_file else None
+  output = OutputBuffer(spill_file=spill_file)
 
+  start = time.time()
+  process_group = not interactive and bool(
+      line_callback or timeout or cpu_timeout or hang_timeout)
   proc = subprocess.Popen(
       command,
       shell=True,
       stdout=subprocess.PIPE,
       stderr=subprocess.STDOUT,
       cwd=cwd,
-      env=environment)
-
-  for byte in iter(lambda: proc.stdout.read(1), b''):
-    if print_output:
-      sys.stdout.write(byte)
-    output += byte
-
-  proc.wait()
+      env=environment,
+      preexec_fn=(get_child_setup(cpu_timeout, process_group)
+                  if process_group or cpu_timeout else None))
+  with _running_commands_lock:
+    _running_commands[proc.pid] = process_group
+  watchdog = None
+  try:
+    if timeout or hang_timeout:
+      watchdog = Watchdog(proc.pid, timeout, hang_timeout, process_group)
+      watchdog.start()
+
+    # os.read returns as soon as any output is available, so large outputs
+    # are consumed in big chunks without holding back interactive output.
+    stdout_fd = proc.stdout.fileno()
+    partial_line = ''
+    killed = False
+    for chunk in iter(lambda: os.read(stdout_fd, OUTPUT_READ_SIZE), b''):
+      if print_output:
+        sys.stdout.write(chunk)
+      output.write(chunk)
+      if watchdog:
+        watchdog.output_received()
+
+      if line_callback and not killed:
+        lines = (partial_line + chunk).split('\n')
+        partial_line = lines.pop()
+        if any(line_callback(line) for line in lines):
+          kill_command(proc.pid, process_group)
+          killed = True
+
+    if line_callback and partial_line and not killed:
+      line_callback(partial_line)
+
+    proc.wait()
+  except BaseException:
+    # A process group of its own doesn't get the Ctrl-C of the terminal, so
+    # it is stopped here rather than left running.
+    kill_command(proc.pid, process_group)
+    if proc.poll() is None:
+      proc.kill()
+    proc.wait()
+    forget_command(proc.pid)
+    if watchdog:
+      watchdog.stop()
+    if spill_file:
+      spill_file.close()
+    raise
+
+  forget_command(proc.pid)
+  if watchdog:
+    watchdog.stop()
+  trace.record(get_command_name(command), 'command', start,
+               time.time() - start, {'cwd': cwd, 'returncode': proc.returncode})
+  if spill_file:
+    spill_file.close()
+  output = output.getvalue()
+
+  status = watchdog and watchdog.status
+  # The shell reports a child killed by a signal as 128 + the signal.
+  if cpu_timeout and proc.returncode in (-signal.SIGXCPU,
+                                         128 + signal.SIGXCPU):
+    status = 'cpu_timeout'
+  if status:
+    _print('| Stopped: %s.' % status)
+    raise CommandTimeoutError(command, status, output)
   if proc.returncode != 0:
     _print('| Return code is non-zero (%d).' % proc.returncode)
     if exit_on_error:
@@ -130,6 +579,8 @@ def confirm(question, default='y'):
   default can either be 'y', 'n', or None. Answer
   is returned as either True or False."""
 
+  if not _interactive:
+    raise NotInteractiveError(question)
   accepts = ['y', 'n']
   defaults = '[y/n]'
   if default:
@@ -151,9 +602,22 @@ def check_confirm(question):
     sys.exit()
 
 
+def set_interactive(interactive):
+  """Makes questions raise NotInteractiveError rather than prompt."""
+
+  global _interactive
+  _interactive = interactive
+
+
+def is_interactive():
+  return _interactive
+
+
 def ask(question, error_message, validate_fn):
   """Asks question, and keeps asking error_message until validate_fn is True"""
 
+  if not _interactive:
+    raise NotInteractiveError(question)
   answer = ''
   while not validate_fn(answer):
     answer = raw_input('%s: ' % question)
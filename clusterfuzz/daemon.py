@@ -0,0 +1,287 @@
+"""Module for the daemon that runs jobs for the CLI, and for its client.
+
+The daemon listens on a Unix domain socket. A client sends one JSON line
+with the job, and gets back JSON lines with the job's output and, last, its
+exit code."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import json
+import stat
+import Queue
+import socket
+import threading
+import traceback
+
+from clusterfuzz import common
+from clusterfuzz import output
+
+CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
+DAEMON_SOCKET = os.path.join(CLUSTERFUZZ_DIR, 'daemon.sock')
+ACCEPT_INTERVAL = 0.5
+# Jobs are only sent to a daemon that has the same values for these.
+SHARED_ENVIRONMENT = ['V8_SRC', 'GOMA_DIR']
+SHARED_ENVIRONMENT_PREFIX = 'CLUSTERFUZZ_'
+
+
+def get_socket_path():
+  """Returns the socket of the daemon, set by $CLUSTERFUZZ_DAEMON_SOCKET."""
+  return os.environ.get('CLUSTERFUZZ_DAEMON_SOCKET', DAEMON_SOCKET)
+
+
+def get_shared_environment():
+  """Returns the variables that change what a job does."""
+
+  return {k: v for k, v in os.environ.iteritems()
+          if k in SHARED_ENVIRONMENT or (
+              k.startswith(SHARED_ENVIRONMENT_PREFIX) and
+              k != 'CLUSTERFUZZ_DAEMON_SOCKET')}
+
+
+def send_message(connection, message):
+  connection.sendall(json.dumps(message) + '\n')
+
+
+def connect(socket_path=None):
+  connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    connection.connect(socket_path or get_socket_path())
+  except socket.error:
+    connection.close()
+    raise
+  return connection
+
+
+def is_running(socket_path=None):
+  """Returns whether a daemon accepts connections on the socket."""
+
+  socket_path = socket_path or get_socket_path()
+  if not os.path.exists(socket_path):
+    return False
+  try:
+    connect(socket_path).close()
+  except socket.error:
+    return False
+  return True
+
+
+def submit(command, args, socket_path=None, stream=None):
+  """Runs a job in the daemon and writes its output to stream, stdout by
+  default, as it comes.
+
+  Returns the exit code of the job, or None if the daemon turned the job
+  down, before or while running it, in which case it should run in this
+  process."""
+
+  stream = stream or sys.stdout
+  connection = connect(socket_path)
+  try:
+    send_message(connection, {'command': command, 'args': args,
+                              'environment': get_shared_environment()})
+    for line in connection.makefile('r'):
+      message = json.loads(line)
+      if 'output' in message:
+        stream.write(message['output'])
+        stream.flush()
+      elif 'rejected' in message:
+        stream.write('Not using the daemon: %s\n' % message['rejected'])
+        return None
+      elif 'exit' in message:
+        return message['exit']
+  finally:
+    connection.close()
+  stream.write('The daemon stopped before the job finished.\n')
+  return 1
+
+
+class JobStream(object):
+  """What a job prints, sent to its client.
+
+  If the client goes away, the job still runs to completion, and its output
+  is dropped."""
+
+  def __init__(self, connection):
+    self.connection = connection
+    self.closed = False
+    self._lock = threading.Lock()
+
+  def send(self, message):
+    with self._lock:
+      if self.closed:
+        return
+      try:
+        send_message(self.connection, message)
+      except socket.error:
+        self.closed = True
+
+  def write(self, data):
+    if data:
+      self.send({'output': data})
+
+  def flush(self):
+    pass
+
+
+class Job(object):
+  """A job waiting in the queue, or running."""
+
+  def __init__(self, command, args, stream):
+    self.command = command
+    self.args = args
+    self.stream = stream
+    self.done = threading.Event()
+
+
+def get_exit_code(error):
+  """Returns the exit code of a job that raised SystemExit."""
+
+  if error.code is None:
+    return 0
+  if isinstance(error.code, int):
+    return error.code
+  print error.code
+  return 1
+
+
+class Daemon(object):
+  """Runs the jobs sent to a socket, 'jobs' at a time, in this process.
+
+  'commands' maps each command name to the function running it, which is
+  called with the job's arguments. Jobs share whatever the process keeps in
+  memory, and what they print is sent to their own client."""
+
+  def __init__(self, commands, jobs, socket_path=None):
+    self.commands = commands
+    self.jobs = jobs
+    self.socket_path = socket_path or get_socket_path()
+    self.queue = Queue.Queue()
+    self.running = 0
+    self.stopped = threading.Event()
+    self.listener = None
+    self._lock = threading.Lock()
+
+  def listen(self):
+    """Binds the socket, which only the user can connect to."""
+
+    if is_running(self.socket_path):
+      raise common.DaemonAlreadyRunningError(self.socket_path)
+    if os.path.exists(self.socket_path):
+      os.remove(self.socket_path)
+    common.make_directory(os.path.dirname(self.socket_path))
+
+    self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.listener.bind(self.socket_path)
+    os.chmod(self.socket_path, stat.S_IRUSR | stat.S_IWUSR)
+    self.listener.listen(64)
+    self.listener.settimeout(ACCEPT_INTERVAL)
+
+  def serve_forever(self):
+    """Accepts connections until stop is called."""
+
+    output.install()
+    common.set_interactive(False)
+    for _ in range(self.jobs):
+      worker = threading.Thread(target=self.work)
+      worker.daemon = True
+      worker.start()
+
+    try:
+      while not self.stopped.is_set():
+        try:
+          connection, _ = self.listener.accept()
+        except socket.timeout:
+          continue
+        connection.settimeout(None)
+        handler = threading.Thread(target=self.handle, args=(connection,))
+        handler.daemon = True
+        handler.start()
+    finally:
+      self.listener.close()
+      if os.path.exists(self.socket_path):
+        os.remove(self.socket_path)
+
+  def stop(self):
+    self.stopped.set()
+
+  def get_rejection(self, request):
+    """Returns why a request can't run here, or None."""
+
+    if request.get('command') not in self.commands:
+      return 'unknown command %s' % request.get('command')
+    environment = get_shared_environment()
+    client_environment = request.get('environment', {})
+    for name in sorted(set(environment) | set(client_environment)):
+      if environment.get(name) != client_environment.get(name):
+        return 'it was started with a different $%s' % name
+    return None
+
+  def handle(self, connection):
+    """Queues the job sent on a connection, and waits for it to finish."""
+
+    try:
+      request = json.loads(connection.makefile('r').readline())
+      rejection = self.get_rejection(request)
+      if rejection:
+        send_message(connection, {'rejected': rejection})
+        return
+
+      job = Job(request['command'], request['args'], JobStream(connection))
+      with self._lock:
+        ahead = self.queue.qsize() + self.running - self.jobs + 1
+      if ahead > 0:
+        job.stream.write('Waiting for %d jobs to finish...\n' % ahead)
+      self.queue.put(job)
+      job.done.wait()
+    except (ValueError, socket.error):
+      pass
+    finally:
+      connection.close()
+
+  def work(self):
+    """Runs queued jobs, one at a time."""
+
+    while True:
+      job = self.queue.get()
+      with self._lock:
+        self.running += 1
+      try:
+        result = self.run(job)
+      finally:
+        with self._lock:
+          self.running -= 1
+      job.stream.send(result)
+      job.done.set()
+
+  def run(self, job):
+    """Runs a job with its output sent to its client, and returns the last
+    message for the client: its exit code, or why it has to run in the
+    client instead."""
+
+    output.set_stream(job.stream)
+    try:
+      self.commands[job.command](**job.args)
+      return {'exit': 0}
+    except SystemExit as e:
+      return {'exit': get_exit_code(e)}
+    except common.NotInteractiveError as e:
+      # Jobs that need to ask the user something, e.g. to confirm a
+      # checkout, can only run where there is a terminal.
+      return {'rejected': 'it needs a terminal to ask "%s"' % e.question}
+    except Exception:  # pylint: disable=broad-except
+      traceback.print_exc(file=sys.stdout)
+      return {'exit': 1}
+    finally:
+      output.set_stream(None)
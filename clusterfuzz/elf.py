@@ -0,0 +1,81 @@
+"""Module for reading the dynamic dependencies of ELF binaries."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+
+ELF_MAGIC = '\x7fELF'
+ELF_CLASS_64 = '\x02'
+ELF_DATA_LITTLE_ENDIAN = '\x01'
+SHT_DYNAMIC = 6
+DT_NULL = 0
+DT_NEEDED = 1
+
+# Where the section header table is described in the ELF header, and the
+# layouts of a section header and of a dynamic entry.
+ELF32_LAYOUT = {'shoff': (0x20, 'I'), 'shentsize': 0x2E,
+                'section': 'IIIIIIIIII', 'dynamic': 'iI'}
+ELF64_LAYOUT = {'shoff': (0x28, 'Q'), 'shentsize': 0x3A,
+                'section': 'IIQQQQIIQQ', 'dynamic': 'qQ'}
+
+
+def read_struct(f, offset, fmt):
+  f.seek(offset)
+  return struct.unpack(fmt, f.read(struct.calcsize(fmt)))
+
+
+def get_needed_libraries(path):
+  """Returns the DT_NEEDED entries of an ELF binary.
+
+  Returns an empty list if path is not an ELF file or is statically
+  linked."""
+
+  with open(path, 'rb') as f:
+    ident = f.read(16)
+    if len(ident) < 16 or not ident.startswith(ELF_MAGIC):
+      return []
+
+    layout = ELF64_LAYOUT if ident[4] == ELF_CLASS_64 else ELF32_LAYOUT
+    endian = '<' if ident[5] == ELF_DATA_LITTLE_ENDIAN else '>'
+    section_format = endian + layout['section']
+    dynamic_format = endian + layout['dynamic']
+
+    shoff_offset, shoff_format = layout['shoff']
+    section_offset = read_struct(f, shoff_offset, endian + shoff_format)[0]
+    section_size, section_count = read_struct(f, layout['shentsize'],
+                                              endian + 'HH')
+    # (type, offset, size, link) of every section.
+    sections = []
+    for i in range(section_count):
+      header = read_struct(f, section_offset + i * section_size,
+                           section_format)
+      sections.append((header[1], header[4], header[5], header[6]))
+
+    libraries = []
+    for section_type, offset, size, link in sections:
+      if section_type != SHT_DYNAMIC:
+        continue
+
+      _, strings_offset, strings_size, _ = sections[link]
+      f.seek(strings_offset)
+      strings = f.read(strings_size)
+      entry_size = struct.calcsize(dynamic_format)
+      for entry in range(size / entry_size):
+        tag, value = read_struct(f, offset + entry * entry_size,
+                                 dynamic_format)
+        if tag == DT_NULL:
+          break
+        if tag == DT_NEEDED:
+          libraries.append(strings[value:strings.index('\x00', value)])
+    return libraries
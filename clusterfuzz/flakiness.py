@@ -0,0 +1,153 @@
+"""Module for measuring how reliably a testcase reproduces.
+
+A testcase is run repeatedly, each run in a working directory of its own,
+until the confidence interval of its crash rate is narrow enough or the
+maximum number of runs is reached."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import time
+import shutil
+import tempfile
+import threading
+import collections
+
+from clusterfuzz import common
+from clusterfuzz import output
+from clusterfuzz import stack_analyzer
+
+CONFIDENCE_Z = 1.96
+MAX_INTERVAL_WIDTH = 0.3
+
+Run = collections.namedtuple('Run', ['index', 'crashed', 'verdict',
+                                     'returncode', 'duration'])
+
+
+def wilson_interval(crashes, runs, z=CONFIDENCE_Z):
+  """Returns the (lower, upper) Wilson score interval of the crash rate.
+
+  Unlike the normal approximation, it stays within [0, 1] and is sensible
+  when every run, or no run, crashed."""
+
+  if not runs:
+    return 0.0, 1.0
+  rate = float(crashes) / runs
+  denominator = 1 + z * z / runs
+  center = (rate + z * z / (2 * runs)) / denominator
+  margin = (z * math.sqrt(rate * (1 - rate) / runs + z * z / (4 * runs * runs))
+            / denominator)
+  return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def is_decided(runs, max_interval_width=MAX_INTERVAL_WIDTH):
+  """Returns whether the crash rate of runs is known precisely enough.
+
+  The rule only depends on the width of the interval, so a testcase that
+  always crashes stops after a handful of runs while a flaky one needs more.
+  """
+
+  lower, upper = wilson_interval(sum(1 for r in runs if r.crashed), len(runs))
+  return upper - lower <= max_interval_width
+
+
+def run_once(index, command, environment, signature=None, limits=None):
+  """Runs command in a fresh working directory and returns a Run.
+
+  The run is stopped as soon as its crash is known to match signature or
+  not, and only a matching crash counts as reproduced. 'limits' holds the
+  timeout arguments of common.execute; a run stopped by one has the status
+  of the CommandTimeoutError as its verdict."""
+
+  working_directory = tempfile.mkdtemp(prefix='clusterfuzz_run_')
+  try:
+    matcher = stack_analyzer.SignatureMatcher(signature)
+    start = time.time()
+    try:
+      returncode, _ = common.execute(command, working_directory,
+                                     print_output=False, exit_on_error=False,
+                                     environment=environment,
+                                     line_callback=matcher.feed,
+                                     **(limits or {}))
+    except common.CommandTimeoutError as e:
+      return Run(index, False, e.status, None, time.time() - start)
+    verdict = matcher.get_verdict()
+    return Run(index, stack_analyzer.is_reproduced(verdict, returncode),
+               verdict, returncode, time.time() - start)
+  finally:
+    shutil.rmtree(working_directory, ignore_errors=True)
+
+
+def measure(command, environment, max_runs, parallel, signature=None,
+            limits=None):
+  """Runs command up to max_runs times, 'parallel' at a time.
+
+  No new run starts once the crash rate is decided; runs already started are
+  still counted. Returns the runs in the order they finished."""
+
+  runs = []
+  started = [0]
+  lock = threading.Lock()
+
+  def worker():
+    """Starts runs until enough were started or the rate is decided."""
+    while True:
+      with lock:
+        if started[0] >= max_runs or is_decided(runs):
+          return
+        started[0] += 1
+        index = started[0]
+      run = run_once(index, command, environment, signature, limits)
+      with lock:
+        runs.append(run)
+        print 'Run %d: %s (%s) in %.2fs' % (
+            run.index, 'crashed' if run.crashed else 'no crash', run.verdict,
+            run.duration)
+
+  threads = [threading.Thread(target=output.propagate(worker))
+             for _ in range(parallel)]
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+  for thread in threads:
+    # Joining with a timeout keeps Ctrl-C working.
+    while thread.is_alive():
+      thread.join(1)
+  return runs
+
+
+def get_percentile(values, percentile):
+  """Returns the nearest-rank percentile of values."""
+
+  values = sorted(values)
+  rank = int(math.ceil(percentile / 100.0 * len(values)))
+  return values[max(0, rank - 1)]
+
+
+def print_report(runs):
+  """Prints the crash rate with its confidence interval, and run latency."""
+
+  crashes = sum(1 for r in runs if r.crashed)
+  lower, upper = wilson_interval(crashes, len(runs))
+  print 'Crashed in %d of %d runs: %.0f%% (95%% confidence: %.0f%%-%.0f%%)' % (
+      crashes, len(runs), 100.0 * crashes / max(1, len(runs)), 100 * lower,
+      100 * upper)
+  verdicts = collections.Counter(r.verdict for r in runs)
+  print 'Crash signature: %s' % ', '.join(
+      '%s %d' % (verdict, count) for verdict, count in sorted(verdicts.items()))
+  if runs:
+    durations = [r.duration for r in runs]
+    print 'Run time: min %.2fs, median %.2fs, p90 %.2fs, max %.2fs' % (
+        min(durations), get_percentile(durations, 50),
+        get_percentile(durations, 90), max(durations))
@@ -0,0 +1,238 @@
+"""Module for the HTTP session shared by every request to ClusterFuzz,
+cr-rev and Cloud Storage."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import socket
+import httplib
+import urlparse
+import threading
+
+from clusterfuzz import common
+from clusterfuzz import trace
+
+READ_SIZE = 64 * 1024
+REQUEST_TIMEOUT = 60
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+MAX_IDLE_CONNECTIONS = 4
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+_session = None
+_session_lock = threading.Lock()
+_offline = False
+
+
+class Response(object):
+  """A response whose body has been read, or streamed to a file."""
+
+  def __init__(self, status, headers, body):
+    self.status = status
+    self.headers = headers
+    self.body = body
+
+
+class HttpSession(object):
+  """Sends requests over a pool of keep-alive connections per host.
+
+  Connection errors and 5xx responses are retried with exponential backoff.
+  Every request is recorded as an 'http' trace span, and counted with its
+  latency."""
+
+  def __init__(self, max_retries=MAX_RETRIES, backoff=RETRY_BACKOFF,
+               timeout=REQUEST_TIMEOUT):
+    self.max_retries = max_retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.request_count = 0
+    self.total_latency = 0.0
+    self._idle_connections = {}
+    self._lock = threading.Lock()
+
+  def get_connection(self, scheme, netloc):
+    """Returns an idle connection to netloc, or a new one."""
+
+    with self._lock:
+      idle = self._idle_connections.get((scheme, netloc))
+      if idle:
+        return idle.pop()
+    if scheme == 'https':
+      return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+    return httplib.HTTPConnection(netloc, timeout=self.timeout)
+
+  def release_connection(self, scheme, netloc, connection):
+    """Keeps a connection for the next request to netloc."""
+
+    with self._lock:
+      idle = self._idle_connections.setdefault((scheme, netloc), [])
+      if len(idle) < MAX_IDLE_CONNECTIONS:
+        idle.append(connection)
+        return
+    connection.close()
+
+  def close(self):
+    """Closes the idle connections."""
+
+    with self._lock:
+      for idle in self._idle_connections.itervalues():
+        for connection in idle:
+          connection.close()
+      self._idle_connections = {}
+
+  def send(self, method, url, headers, output_path, output_offset):
+    """Sends a single request and reads its response.
+
+    A body streamed to a file must be as long as its Content-Length, so that
+    a connection dropped midway is retried."""
+
+    parsed = urlparse.urlsplit(url)
+    path = parsed.path or '/'
+    if parsed.query:
+      path += '?' + parsed.query
+    connection = self.get_connection(parsed.scheme, parsed.netloc)
+    done = False
+    try:
+      connection.request(method, path, headers=headers)
+      response = connection.getresponse()
+      body = None
+      streamed_status = 200 if output_offset is None else 206
+      if output_path and response.status == streamed_status:
+        written = 0
+        with open(output_path, 'wb' if output_offset is None else 'r+b') as f:
+          f.seek(output_offset or 0)
+          while True:
+            data = response.read(READ_SIZE)
+            if not data:
+              break
+            f.write(data)
+            written += len(data)
+        length = response.getheader('content-length')
+        if length is not None and written != int(length):
+          raise httplib.IncompleteRead('', int(length) - written)
+      else:
+        body = response.read()
+      done = True
+    finally:
+      if not done:
+        connection.close()
+
+    if response.will_close:
+      connection.close()
+    else:
+      self.release_connection(parsed.scheme, parsed.netloc, connection)
+    return Response(response.status, dict(response.getheaders()), body)
+
+  def request(self, method, url, headers=None, output_path=None,
+              output_offset=None):
+    """Returns the response to a request.
+
+    With 'output_path', a successful response body is streamed to that file
+    rather than kept in memory. With 'output_offset' too, the request is
+    expected to be for a byte range, and a 206 response body is written at
+    that offset of the existing file.
+
+    Redirects are followed, up to MAX_REDIRECTS of them, and the
+    Authorization header is only sent on to the host it was meant for."""
+
+    if _offline:
+      raise common.OfflineError(url.split('?')[0])
+    headers = headers or {}
+    redirects = 0
+    while True:
+      response = self.send_with_retries(method, url, headers, output_path,
+                                        output_offset)
+      location = response.headers.get('location')
+      if (response.status not in REDIRECT_STATUSES or not location or
+          redirects == MAX_REDIRECTS):
+        return response
+      next_url = urlparse.urljoin(url, location)
+      if urlparse.urlsplit(next_url)[:2] != urlparse.urlsplit(url)[:2]:
+        headers = {name: value for name, value in headers.iteritems()
+                   if name.lower() != 'authorization'}
+      url = next_url
+      redirects += 1
+
+  def send_with_retries(self, method, url, headers, output_path,
+                        output_offset):
+    """Sends a request, retrying connection errors and 5xx responses."""
+
+    attempt = 0
+    while True:
+      last_attempt = attempt == self.max_retries
+      start = time.time()
+      try:
+        response = self.send(method, url, headers, output_path, output_offset)
+      except (socket.error, httplib.HTTPException) as e:
+        self.record_request(url, start, str(e))
+        if last_attempt:
+          raise
+      else:
+        self.record_request(url, start, response.status)
+        if response.status < 500 or last_attempt:
+          return response
+      time.sleep(self.backoff * 2 ** attempt)
+      attempt += 1
+
+  def record_request(self, url, start, status):
+    """Counts a request that started at 'start', and traces it."""
+
+    duration = time.time() - start
+    with self._lock:
+      self.request_count += 1
+      self.total_latency += duration
+    trace.record('http_request', 'http', start, duration,
+                 {'url': url.split('?')[0], 'status': status})
+
+
+def set_offline(offline):
+  """Makes every request fail rather than reach the network."""
+
+  global _offline
+  _offline = offline
+
+
+def is_offline():
+  return _offline
+
+
+def get_session():
+  """Returns the session shared by the whole process."""
+
+  global _session
+  with _session_lock:
+    if not _session:
+      _session = HttpSession()
+    return _session
+
+
+def fetch(url, headers=None):
+  """GETs url through the shared session."""
+  return get_session().request('GET', url, headers=headers)
+
+
+def download(url, path, headers=None):
+  """Streams url to path through the shared session.
+
+  The file is written next to path and only renamed once it is complete."""
+
+  partial_path = path + '.partial'
+  response = get_session().request('GET', url, headers=headers,
+                                   output_path=partial_path)
+  if response.status != 200:
+    raise common.HttpError(url, response.status)
+  os.rename(partial_path, path)
+  return response
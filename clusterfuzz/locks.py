@@ -0,0 +1,85 @@
+"""Module for the advisory locks that let processes share ~/.clusterfuzz."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import errno
+import fcntl
+import threading
+
+from clusterfuzz import common
+
+CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
+LOCKS_DIR = os.path.join(CLUSTERFUZZ_DIR, 'locks')
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+def get_thread_lock(path):
+  """Returns the lock threads of this process take before the file lock.
+
+  Record locks belong to the process, so they do not exclude its other
+  threads."""
+
+  with _thread_locks_lock:
+    return _thread_locks.setdefault(path, threading.Lock())
+
+
+class FileLock(object):
+  """An exclusive lock on a cache entry, shared by every process that uses
+  the same ~/.clusterfuzz.
+
+  It is a POSIX record lock (lockf) on LOCKS_DIR/<name>.lock, which unlike
+  flock also works over NFS. The lock file is never removed, as another
+  process may be waiting on it."""
+
+  def __init__(self, name, directory=LOCKS_DIR):
+    self.path = os.path.join(directory, name + '.lock')
+    self.thread_lock = get_thread_lock(self.path)
+    self.lock_file = None
+
+  def acquire(self, blocking=True):
+    """Takes the lock. Returns False if it is held and not 'blocking'."""
+
+    if not self.thread_lock.acquire(blocking):
+      return False
+    try:
+      common.make_directory(os.path.dirname(self.path))
+      self.lock_file = open(self.path, 'a')
+      flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+      fcntl.lockf(self.lock_file, flags)
+    except (IOError, OSError) as e:
+      self.close()
+      if blocking or e.errno not in (errno.EACCES, errno.EAGAIN):
+        raise
+      return False
+    return True
+
+  def release(self):
+    fcntl.lockf(self.lock_file, fcntl.LOCK_UN)
+    self.close()
+
+  def close(self):
+    if self.lock_file:
+      self.lock_file.close()
+      self.lock_file = None
+    self.thread_lock.release()
+
+  def __enter__(self):
+    self.acquire()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.release()
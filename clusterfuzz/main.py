@@ -32,9 +32,94 @@ def execute(argv=None):
       '-d', '--download', action='store_true', default=False,
       help=('Run the testcase against a build downloaded from Clusterfuzz '
             'rather than building locally.'))
+  reproduce.add_argument(
+      '--trace-file', default=None,
+      help=('Write the time spent in each phase to this file as Chrome '
+            'trace-event JSON (open it in chrome://tracing).'))
+  reproduce.add_argument(
+      '--runs', type=int, default=1,
+      help=('Run the testcase up to this many times and report how often it'
+            ' crashes. Stops early once the crash rate is known.'))
+  reproduce.add_argument(
+      '--parallel', type=int, default=None,
+      help='How many of the --runs to run at once. Defaults to the cores.')
+  reproduce.add_argument(
+      '--timeout', type=int, default=None,
+      help='Stop the binary after this many seconds.')
+  reproduce.add_argument(
+      '--cpu-timeout', type=int, default=None,
+      help='Stop the binary after it used this many seconds of CPU time.')
+  reproduce.add_argument(
+      '--offline', action='store_true', default=False,
+      help=('Only use the cached testcase information, testcase file and '
+            'build, without any network request.'))
+  reproduce.add_argument(
+      '--no-daemon', action='store_true', default=False,
+      help=('Reproduce in this process even if a daemon started by'
+            ' "clusterfuzz serve" is running.'))
+
+  reproduce_batch = subparsers.add_parser(
+      'reproduce-batch', help='Reproduce many crashes in one run.')
+  reproduce_batch.add_argument(
+      'testcase_ids', nargs='*', help='The testcase IDs.')
+  reproduce_batch.add_argument(
+      '-f', '--file', dest='ids_file', default=None,
+      help='Also reproduce the testcase IDs listed in this file.')
+  reproduce_batch.add_argument(
+      '-c', '--current', action='store_true', default=False,
+      help='Use the current tree rather than the commit of each testcase.')
+  reproduce_batch.add_argument(
+      '-d', '--download', action='store_true', default=False,
+      help=('Run the testcases against builds downloaded from Clusterfuzz '
+            'rather than building locally.'))
+  reproduce_batch.add_argument(
+      '-j', '--jobs', type=int, default=None,
+      help=('How many testcases to run at once. Defaults to the number of '
+            'cores, limited by the available memory.'))
+  reproduce_batch.add_argument(
+      '-o', '--output', default=None,
+      help='Write one JSON result record per line to this file.')
+  reproduce_batch.add_argument(
+      '--timeout', type=int, default=300,
+      help='Stop each testcase after this many seconds. Defaults to 300.')
+  reproduce_batch.add_argument(
+      '--cpu-timeout', type=int, default=None,
+      help='Stop each testcase after it used this many seconds of CPU time.')
+
+  cache = subparsers.add_parser(
+      'cache', help='List, clean up or verify the local builds and testcases.')
+  cache.add_argument(
+      'action', choices=['ls', 'gc', 'verify'],
+      help=('ls lists the cached entries, gc evicts the least recently used'
+            ' ones until the cache fits its quota, verify hashes them and'
+            ' marks corrupt ones to be fetched again.'))
+  cache.add_argument(
+      '-q', '--quota', default=None,
+      help=('The size to shrink the cache to with gc, e.g. 20G. Defaults to'
+            ' $CLUSTERFUZZ_CACHE_QUOTA or 50G.'))
+
+  serve = subparsers.add_parser(
+      'serve', help=('Run a daemon that reproduces testcases for the'
+                     ' reproduce command, keeping goma and connections'
+                     ' warm.'))
+  serve.add_argument(
+      '-j', '--jobs', type=int, default=None,
+      help=('How many testcases to reproduce at once. Defaults to the number'
+            ' of cores, limited by the available memory.'))
+
+  build_log = subparsers.add_parser(
+      'build-log', help='Show where the time of local builds went.')
+  build_log.add_argument(
+      'build_directories', nargs='*',
+      help=('The out directories to read the .ninja_log of. Defaults to the'
+            ' clusterfuzz out directories in $V8_SRC.'))
+  build_log.add_argument(
+      '-n', '--count', type=int, default=10,
+      help='How many of the slowest edges to show. Defaults to 10.')
 
   args = parser.parse_args(argv)
-  command = importlib.import_module('clusterfuzz.commands.%s' % args.command)
+  command = importlib.import_module(
+      'clusterfuzz.commands.%s' % args.command.replace('-', '_'))
 
   arg_dict = {k: v for k, v in vars(args).items()}
   del arg_dict['command']
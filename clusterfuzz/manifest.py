@@ -0,0 +1,167 @@
+"""Module for the manifests that let cached builds and testcases be checked
+for corruption."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import hashlib
+import multiprocessing
+from multiprocessing import pool
+
+from clusterfuzz import cache
+
+MANIFEST_FILE = '.clusterfuzz_manifest.json'
+# Written after the manifest.
+UNLISTED_FILES = [MANIFEST_FILE, cache.COMPLETE_MARKER]
+HASH_READ_SIZE = 1024 ** 2
+VERIFY_MODES = ['off', 'stat', 'hash']
+DEFAULT_VERIFY_MODE = 'stat'
+
+
+def get_verify_mode():
+  """Returns how entries are checked before they are used, set by
+  $CLUSTERFUZZ_VERIFY_CACHE: 'stat' compares sizes, 'hash' also compares
+  hashes, and 'off' does not check them."""
+
+  mode = os.environ.get('CLUSTERFUZZ_VERIFY_CACHE', DEFAULT_VERIFY_MODE)
+  if mode not in VERIFY_MODES:
+    raise ValueError('$CLUSTERFUZZ_VERIFY_CACHE must be one of %s, not %r' % (
+        ', '.join(VERIFY_MODES), mode))
+  return mode
+
+
+def get_hash(path):
+  """Returns the SHA-1 of a file. hashlib releases the GIL on large buffers,
+  so files are hashed in parallel by threads."""
+
+  sha = hashlib.sha1()
+  with open(path, 'rb') as f:
+    while True:
+      data = f.read(HASH_READ_SIZE)
+      if not data:
+        break
+      sha.update(data)
+  return sha.hexdigest()
+
+
+def map_files(function, paths, jobs):
+  """Returns function(path) for each path, on a pool of jobs threads."""
+
+  if jobs < 2 or len(paths) < 2:
+    return [function(path) for path in paths]
+  thread_pool = pool.ThreadPool(min(jobs, len(paths)))
+  try:
+    return thread_pool.map(function, paths)
+  finally:
+    thread_pool.close()
+
+
+def list_files(directory, exclude=()):
+  """Returns the paths of the files under directory, relative to it, but
+  those in exclude."""
+
+  names = []
+  for root, _, files in os.walk(directory):
+    for name in files:
+      path = os.path.relpath(os.path.join(root, name), directory)
+      if path in exclude:
+        continue
+      if path not in UNLISTED_FILES and not os.path.islink(
+          os.path.join(directory, path)):
+        names.append(path)
+  return sorted(names)
+
+
+def get_path(directory):
+  return os.path.join(directory, MANIFEST_FILE)
+
+
+def create(directory, jobs=None, exclude=()):
+  """Records the size and hash of every file under directory, but those in
+  exclude, which are about to be removed.
+
+  It is called right after extraction, while the files are still in the page
+  cache."""
+
+  jobs = jobs or multiprocessing.cpu_count()
+  names = list_files(directory, exclude)
+  hashes = map_files(lambda name: get_hash(os.path.join(directory, name)),
+                     names, jobs)
+  files = {}
+  for name, file_hash in zip(names, hashes):
+    files[name] = {'size': os.path.getsize(os.path.join(directory, name)),
+                   'sha1': file_hash}
+
+  path = get_path(directory)
+  with open(path + '.tmp', 'w') as f:
+    json.dump({'files': files}, f, indent=2, sort_keys=True)
+  os.rename(path + '.tmp', path)
+
+
+def remove(directory):
+  """Removes the manifest, so that the entry is fetched again."""
+
+  if os.path.exists(get_path(directory)):
+    os.remove(get_path(directory))
+
+
+def verify(directory, full=False, jobs=None):
+  """Returns the problems found with the files listed in the manifest, or an
+  empty list.
+
+  By default only the sizes are compared, which takes a stat per file. With
+  'full', the files are hashed too, on a pool of 'jobs' threads."""
+
+  path = get_path(directory)
+  if not os.path.isfile(path):
+    return ['no manifest']
+  try:
+    with open(path, 'r') as f:
+      files = json.load(f)['files']
+  except (ValueError, KeyError):
+    return ['unreadable manifest']
+
+  problems = []
+  for name, expected in sorted(files.iteritems()):
+    filename = os.path.join(directory, name)
+    if not os.path.isfile(filename):
+      problems.append('%s is missing' % name)
+    elif os.path.getsize(filename) != expected['size']:
+      problems.append('%s has %d bytes instead of %d' % (
+          name, os.path.getsize(filename), expected['size']))
+  if problems or not full:
+    return problems
+
+  names = sorted(files)
+  hashes = map_files(lambda name: get_hash(os.path.join(directory, name)),
+                     names, jobs or multiprocessing.cpu_count())
+  return ['%s has the wrong hash' % name
+          for name, file_hash in zip(names, hashes)
+          if file_hash != files[name]['sha1']]
+
+
+def is_intact(directory, jobs=None, quiet=False):
+  """Returns whether the entry in directory passes the check chosen by
+  get_verify_mode, and prints what is wrong with it otherwise, unless
+  'quiet'."""
+
+  mode = get_verify_mode()
+  if mode == 'off':
+    return True
+  problems = verify(directory, full=(mode == 'hash'), jobs=jobs)
+  if problems and not quiet:
+    print '%s is corrupt (%s), fetching it again.' % (
+        directory, '; '.join(problems[:3]))
+  return not problems
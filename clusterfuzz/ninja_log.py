@@ -0,0 +1,165 @@
+"""Module for reading the .ninja_log of an out directory."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import bisect
+import collections
+
+from clusterfuzz import common
+
+NINJA_LOG_FILE = '.ninja_log'
+NINJA_LOG_VERSIONS = ['# ninja log v5', '# ninja log v6']
+
+
+class Edge(collections.namedtuple('Edge', ['start', 'end', 'outputs'])):
+  """A build step, with its start and end in seconds since the build
+  started."""
+
+  @property
+  def duration(self):
+    return self.end - self.start
+
+
+def read_entries(path):
+  """Returns the (start, end, output, command hash) entries of a log, in
+  the order they were written."""
+
+  entries = []
+  with open(path, 'r') as f:
+    header = f.readline().strip()
+    if header not in NINJA_LOG_VERSIONS:
+      raise common.NinjaLogError(path, 'unsupported format %r' % header)
+    for line in f:
+      fields = line.rstrip('\n').split('\t')
+      if len(fields) != 5:
+        continue
+      start, end, _, output, command_hash = fields
+      entries.append((int(start), int(end), output, command_hash))
+  return entries
+
+
+def split_builds(entries):
+  """Returns the entries of each build, oldest first.
+
+  Entries are appended as steps finish, so their end times only go down
+  when a new build starts."""
+
+  builds = []
+  last_end = None
+  for entry in entries:
+    if last_end is None or entry[1] < last_end:
+      builds.append([])
+    builds[-1].append(entry)
+    last_end = entry[1]
+  return builds
+
+
+def get_edges(entries):
+  """Groups the outputs of the same step into edges."""
+
+  outputs = collections.OrderedDict()
+  for start, end, output, command_hash in entries:
+    outputs.setdefault((start, end, command_hash), []).append(output)
+  return [Edge(start / 1000.0, end / 1000.0, edge_outputs)
+          for (start, end, _), edge_outputs in outputs.iteritems()]
+
+
+def get_critical_path(edges):
+  """Returns the chain of edges that bounded the build time, first to last.
+
+  The log has no dependencies, so the chain is rebuilt from the timeline:
+  going back from the edge that finished last, each edge is preceded by the
+  one that finished last before it started."""
+
+  edges = sorted(edges, key=lambda e: e.end)
+  ends = [edge.end for edge in edges]
+  if not edges:
+    return []
+
+  index = len(edges) - 1
+  path = [edges[index]]
+  while True:
+    index = min(index, bisect.bisect_right(ends, path[-1].start)) - 1
+    if index < 0:
+      break
+    path.append(edges[index])
+  return path[::-1]
+
+
+class BuildSummary(object):
+  """Where the time of the last build in an out directory went."""
+
+  def __init__(self, build_directory):
+    self.build_directory = build_directory
+    path = os.path.join(build_directory, NINJA_LOG_FILE)
+    entries = read_entries(path) if os.path.isfile(path) else []
+    builds = split_builds(entries)
+    self.edges = get_edges(builds[-1]) if builds else []
+    self.known_outputs = len(set(entry[2] for entry in entries))
+    self.rebuilt_outputs = len(set(entry[2] for entry in builds[-1])) if (
+        builds) else 0
+
+  @property
+  def wall_time(self):
+    if not self.edges:
+      return 0.0
+    return (max(e.end for e in self.edges) -
+            min(e.start for e in self.edges))
+
+  @property
+  def total_time(self):
+    return sum(e.duration for e in self.edges)
+
+  @property
+  def reuse_ratio(self):
+    """The fraction of the outputs ever built that were up to date."""
+
+    if not self.known_outputs:
+      return 0.0
+    return 1 - float(self.rebuilt_outputs) / self.known_outputs
+
+  def get_slowest(self, count):
+    return sorted(self.edges, key=lambda e: e.duration, reverse=True)[:count]
+
+  def get_critical_path(self):
+    return get_critical_path(self.edges)
+
+  def print_summary(self, count=10):
+    """Prints the totals, the slowest edges and the critical path."""
+
+    print 'Last build in %s' % self.build_directory
+    if not self.edges:
+      print '  Nothing was built.'
+      return
+
+    wall_time = self.wall_time
+    print '  %d edges in %.1fs, %.1fs of work (parallelism %.1f)' % (
+        len(self.edges), wall_time, self.total_time,
+        self.total_time / wall_time if wall_time else 0)
+    print '  %d of %d known outputs up to date (%.0f%%)' % (
+        self.known_outputs - self.rebuilt_outputs, self.known_outputs,
+        100 * self.reuse_ratio)
+
+    print '  Slowest edges:'
+    for edge in self.get_slowest(count):
+      print '    %8.1fs  %s' % (edge.duration, edge.outputs[0])
+
+    critical_path = self.get_critical_path()
+    print '  Critical path (%d edges, %.1fs):' % (
+        len(critical_path), sum(e.duration for e in critical_path))
+    if len(critical_path) > count:
+      print '    ... %d earlier edges' % (len(critical_path) - count)
+    for edge in critical_path[-count:]:
+      print '    %8.1fs  %s' % (edge.duration, edge.outputs[0])
@@ -0,0 +1,138 @@
+"""Module for the index of the V8 out directories built by clusterfuzz."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import time
+import hashlib
+
+from clusterfuzz import locks
+from clusterfuzz import revisions
+
+CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
+OUT_DIRS_DIR = os.path.join(CLUSTERFUZZ_DIR, 'out_dirs')
+OUT_DIR_PREFIX = 'clusterfuzz_'
+FINGERPRINTS_FILE = '.clusterfuzz_fingerprints.json'
+ASSIGNMENT_PATTERN = re.compile(r'\s*=\s*')
+
+
+def normalize_args(lines):
+  """Returns the lines of an args.gn without comments, blank lines and
+  formatting differences, in a stable order."""
+
+  normalized = set()
+  for line in lines:
+    line = line.split('#', 1)[0].strip()
+    if line:
+      normalized.add(ASSIGNMENT_PATTERN.sub(' = ', line, count=1))
+  return sorted(normalized)
+
+
+def get_args_key(lines):
+  """Returns a short key identifying the configuration of an args.gn."""
+  return hashlib.sha1('\n'.join(normalize_args(lines))).hexdigest()[:12]
+
+
+def get_fingerprint(*inputs):
+  """Returns a hash of the inputs of a build step."""
+  return hashlib.sha1('\0'.join(inputs)).hexdigest()
+
+
+class Fingerprints(object):
+  """The fingerprints of the inputs each build step last ran with, stored in
+  the directory the step writes to."""
+
+  def __init__(self, directory):
+    self.path = os.path.join(directory, FINGERPRINTS_FILE)
+    self.steps = revisions.load_json(self.path, {})
+
+  def is_current(self, step, fingerprint):
+    return self.steps.get(step) == fingerprint
+
+  def update(self, step, fingerprint):
+    def set_fingerprint(steps):
+      steps[step] = fingerprint
+    self.steps = revisions.update_json(self.path, {}, set_fingerprint)
+
+
+class OutDirIndex(object):
+  """Records the sha and args.gn each out directory of a checkout was last
+  built with.
+
+  A testcase at an already built sha and configuration reuses its out
+  directory as is. Otherwise the out directory with the same configuration
+  and the nearest revision is rebuilt, so that ninja only rebuilds what
+  changed between the two revisions."""
+
+  def __init__(self, source_directory):
+    self.source_directory = source_directory
+    self.path = os.path.join(
+        OUT_DIRS_DIR,
+        hashlib.sha1(os.path.abspath(source_directory)).hexdigest() + '.json')
+    self.out_dirs = revisions.load_json(self.path, {})
+
+  def out_dir_path(self, name):
+    return os.path.join(self.source_directory, 'out', name)
+
+  def find(self, sha, revision, args_key):
+    """Returns the name of the out directory to build sha and args_key in.
+
+    Out directories that were deleted since they were built are ignored."""
+
+    candidates = [(name, entry) for name, entry in self.out_dirs.iteritems()
+                  if entry['args'] == args_key and
+                  os.path.isdir(self.out_dir_path(name))]
+    for name, entry in candidates:
+      if entry['sha'] == sha:
+        return name
+    if candidates:
+      return min(candidates,
+                 key=lambda c: abs(int(c[1]['revision']) - int(revision)))[0]
+    return OUT_DIR_PREFIX + args_key
+
+  def get_private_name(self, args_key, testcase_id):
+    """Returns the name of an out directory of the testcase's own, built in
+    when the shared one is busy."""
+    return '%s%s_%s' % (OUT_DIR_PREFIX, args_key, testcase_id)
+
+  def get_lock(self, name):
+    """Returns the lock held while an out directory is built and used.
+
+    Concurrent builds in one out directory would overwrite each other's
+    args.gn and outputs, and a build would replace the binary that another
+    reproduction still has to run."""
+
+    return locks.FileLock('out_dir_' + hashlib.sha1(
+        os.path.abspath(self.out_dir_path(name))).hexdigest()[:12])
+
+  def get(self, name):
+    return self.out_dirs.get(name)
+
+  def remove(self, name):
+    """Forgets what an out directory holds, e.g. before rebuilding it."""
+
+    if name in self.out_dirs:
+      self.out_dirs = revisions.update_json(
+          self.path, {}, lambda out_dirs: out_dirs.pop(name, None))
+
+  def record(self, name, sha, revision, args_key):
+    """Records that the out directory 'name' holds a build of sha."""
+
+    def set_entry(out_dirs):
+      out_dirs[name] = {'sha': sha,
+                        'revision': revision,
+                        'args': args_key,
+                        'last_built': time.time()}
+    self.out_dirs = revisions.update_json(self.path, {}, set_entry)
@@ -0,0 +1,70 @@
+"""Module for sending what each thread prints to its own stream.
+
+The daemon runs several jobs in one process, and each client must only see
+the output of its own job."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import threading
+
+_local = threading.local()
+
+
+class ThreadOutput(object):
+  """Stands in for sys.stdout, and writes to the stream set for the current
+  thread, or to the original stdout."""
+
+  def __init__(self, default):
+    self.default = default
+
+  def get_stream(self):
+    return getattr(_local, 'stream', None) or self.default
+
+  def write(self, data):
+    self.get_stream().write(data)
+
+  def flush(self):
+    self.get_stream().flush()
+
+  def __getattr__(self, name):
+    return getattr(self.default, name)
+
+
+def install():
+  """Makes print statements honor set_stream."""
+
+  if not isinstance(sys.stdout, ThreadOutput):
+    sys.stdout = ThreadOutput(sys.stdout)
+
+
+def get_stream():
+  """Returns the stream set for the current thread, or None."""
+  return getattr(_local, 'stream', None)
+
+
+def set_stream(stream):
+  _local.stream = stream
+
+
+def propagate(function):
+  """Returns function, made to write to the stream of the thread calling
+  propagate. Threads started for a job use it, so that their output goes to
+  the job's client."""
+
+  stream = get_stream()
+  def run(*args, **kwargs):
+    set_stream(stream)
+    return function(*args, **kwargs)
+  return run
@@ -0,0 +1,187 @@
+"""Module for converting commit positions to git shas."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import json
+import hashlib
+import threading
+import subprocess
+
+from clusterfuzz import common
+from clusterfuzz import locks
+
+CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
+REVISIONS_FILE = os.path.join(CLUSTERFUZZ_DIR, 'revisions.json')
+COMMIT_POSITIONS_DIR = os.path.join(CLUSTERFUZZ_DIR, 'commit_positions')
+COMMIT_POSITION_PATTERN = re.compile(
+    r'^Cr-Commit-Position: refs/heads/master@\{#(\d+)\}')
+COMMIT_MARKER = 'commit:'
+INDEXED_REF = 'origin/master'
+
+
+def build_revision_to_sha_url(revision, repo):
+  import urllib
+  return ('https://cr-rev.appspot.com/_ah/api/crrev/v1/get_numbering?%s' %
+          urllib.urlencode({
+              'number': revision,
+              'numbering_identifier': 'refs/heads/master',
+              'numbering_type': 'COMMIT_POSITION',
+              'project': 'chromium',
+              'repo': repo}))
+
+
+def fetch_sha_from_revision(revision, repo):
+  """Asks cr-rev for the git sha of a chrome revision number."""
+
+  # Only needed on a cache miss, and slow to import for the commands that
+  # only read the local state.
+  from clusterfuzz import http_client
+  response = http_client.fetch(build_revision_to_sha_url(revision, repo))
+  return json.loads(response.body)['git_sha']
+
+
+def load_json(path, default):
+  if not os.path.isfile(path):
+    return default
+  with open(path, 'r') as f:
+    return json.load(f)
+
+
+def save_json(path, data):
+  """Writes data to path. Other threads and processes read the file without
+  a lock, so it is replaced rather than rewritten in place."""
+
+  common.make_directory(os.path.dirname(path))
+  temp_path = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                threading.current_thread().ident)
+  with open(temp_path, 'w') as f:
+    json.dump(data, f)
+  os.rename(temp_path, path)
+
+
+def get_json_lock(path):
+  """Returns the lock held while the JSON file in path is changed."""
+  return locks.FileLock(
+      'json_' + hashlib.sha1(os.path.abspath(path)).hexdigest()[:12])
+
+
+def update_json(path, default, update):
+  """Reloads the JSON file in path, changes it with update and saves it,
+  without losing the changes made concurrently by other threads and
+  processes. Returns the new data."""
+
+  with get_json_lock(path):
+    data = load_json(path, default)
+    update(data)
+    save_json(path, data)
+  return data
+
+
+class RevisionCache(object):
+  """A persistent memo of the sha of each revision, per repository."""
+
+  def __init__(self, path=REVISIONS_FILE):
+    self.path = path
+    self.repos = load_json(self.path, {})
+
+  def get(self, repo, revision):
+    return self.repos.get(repo, {}).get(str(revision))
+
+  def set(self, repo, revision, sha):
+    def set_sha(repos):
+      repos.setdefault(repo, {})[str(revision)] = sha
+    self.repos = update_json(self.path, {}, set_sha)
+
+
+class CommitPositionIndex(object):
+  """Maps revisions to shas using the Cr-Commit-Position footers of a local
+  checkout.
+
+  The index is built once and then only updated with the commits added to
+  INDEXED_REF since it was last read."""
+
+  def __init__(self, source_directory):
+    self.source_directory = source_directory
+    self.path = os.path.join(
+        COMMIT_POSITIONS_DIR,
+        hashlib.sha1(os.path.abspath(source_directory)).hexdigest() + '.json')
+    index = load_json(self.path, {'head': None, 'positions': {}})
+    self.head = index['head']
+    self.positions = index['positions']
+
+  def get(self, revision):
+    return self.positions.get(str(revision))
+
+  def update(self):
+    """Indexes the commits added to INDEXED_REF since the last update."""
+
+    returncode, head = common.execute(
+        'git rev-parse %s' % INDEXED_REF, self.source_directory,
+        print_output=False, exit_on_error=False)
+    head = head.strip()
+    if returncode != 0 or head == self.head:
+      return
+
+    revision_range = '%s..%s' % (self.head, head) if self.head else head
+    if not self.read_log(revision_range):
+      # The last indexed commit is gone, so start again from scratch.
+      self.positions = {}
+      if not self.read_log(head):
+        return
+
+    self.head = head
+    save_json(self.path, {'head': self.head, 'positions': self.positions})
+
+  def read_log(self, revision_range):
+    """Adds the commit positions in revision_range. Returns False on error."""
+
+    proc = subprocess.Popen(
+        ['git', 'log', '--format=%s%%H%%n%%B' % COMMIT_MARKER,
+         revision_range],
+        cwd=self.source_directory, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    sha = None
+    for line in proc.stdout:
+      if line.startswith(COMMIT_MARKER):
+        sha = line[len(COMMIT_MARKER):].strip()
+        continue
+      match = COMMIT_POSITION_PATTERN.match(line)
+      if match and sha:
+        self.positions[match.group(1)] = sha
+    proc.stderr.read()
+    return proc.wait() == 0
+
+
+def sha_from_revision(revision, repo, source_directory=None):
+  """Converts a chrome revision number to it corresponding git sha.
+
+  Looks in the on-disk memo first, then in the commit positions of the local
+  checkout in source_directory, and only then asks cr-rev."""
+
+  revision_cache = RevisionCache()
+  sha = revision_cache.get(repo, revision)
+  if sha:
+    return sha
+
+  if source_directory and os.path.isdir(source_directory):
+    index = CommitPositionIndex(source_directory)
+    index.update()
+    sha = index.get(revision)
+  if not sha:
+    sha = fetch_sha_from_revision(revision, repo)
+
+  revision_cache.set(repo, revision, sha)
+  return sha
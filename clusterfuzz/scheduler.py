@@ -0,0 +1,96 @@
+"""Module for running steps that depend on each other concurrently."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import Queue
+import threading
+
+from clusterfuzz import common
+from clusterfuzz import output
+
+WAIT_INTERVAL = 0.5
+
+
+class Task(object):
+  """A step that runs once all the tasks it depends on have finished.
+
+  The function is called with the result of each dependency as a keyword
+  argument named after it."""
+
+  def __init__(self, name, function, dependencies=()):
+    self.name = name
+    self.function = function
+    self.dependencies = list(dependencies)
+
+
+def run_task(task, results, finished):
+  """Runs a task and reports its result, or the error it raised."""
+
+  try:
+    kwargs = {name: results[name] for name in task.dependencies}
+    finished.put((task.name, task.function(**kwargs), None))
+  except BaseException: # pylint: disable=broad-except
+    finished.put((task.name, None, sys.exc_info()))
+
+
+def wait(finished):
+  # Queue.get without a timeout can't be interrupted with Ctrl-C.
+  while True:
+    try:
+      return finished.get(True, WAIT_INTERVAL)
+    except Queue.Empty:
+      pass
+
+
+def run(tasks):
+  """Runs every task in its own thread as soon as its dependencies are done.
+
+  Returns a dict of results by task name. The first error raised by a task
+  is re-raised here and no further tasks are started. Threads are daemons,
+  so tasks still running don't keep the process alive after a failure."""
+
+  results = {}
+  pending = list(tasks)
+  finished = Queue.Queue()
+  running = 0
+  while pending or running:
+    ready = [task for task in pending
+             if all(name in results for name in task.dependencies)]
+    for task in ready:
+      pending.remove(task)
+      thread = threading.Thread(target=output.propagate(run_task),
+                                name=task.name,
+                                args=(task, dict(results), finished))
+      thread.daemon = True
+      thread.start()
+      running += 1
+
+    if not running:
+      raise ValueError('Tasks have unknown or cyclic dependencies: %s' %
+                       ', '.join(task.name for task in pending))
+
+    try:
+      name, result, error = wait(finished)
+    except KeyboardInterrupt:
+      # Tasks don't see the Ctrl-C, so the commands they run are stopped
+      # here.
+      common.kill_running_commands()
+      raise
+    running -= 1
+    if error:
+      # The three-argument form keeps the traceback of the failed task.
+      raise error[0], error[1], error[2]  # pylint: disable=old-raise-syntax
+    results[name] = result
+  return results
@@ -0,0 +1,170 @@
+"""Module for downloading large build archives in concurrent byte ranges."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import base64
+import hashlib
+import threading
+from multiprocessing import pool
+
+from clusterfuzz import common
+from clusterfuzz import http_client
+
+SLICE_SIZE = 32 * 1024 ** 2
+SLICED_DOWNLOAD_MIN_SIZE = 64 * 1024 ** 2
+DEFAULT_DOWNLOAD_JOBS = 8
+PARTIAL_SUFFIX = '.partial'
+STATE_SUFFIX = '.slices'
+HASH_READ_SIZE = 1024 ** 2
+
+
+def get_download_jobs():
+  """Returns how many slices are fetched at once, set by
+  $CLUSTERFUZZ_DOWNLOAD_JOBS."""
+
+  return int(os.environ.get('CLUSTERFUZZ_DOWNLOAD_JOBS',
+                            DEFAULT_DOWNLOAD_JOBS))
+
+
+def get_expected_md5(headers):
+  """Returns the hex MD5 announced by the x-goog-hash or Content-MD5 header,
+  or None. Composite Cloud Storage objects only have a CRC32C."""
+
+  values = [h.strip() for h in headers.get('x-goog-hash', '').split(',')]
+  digests = [v[len('md5='):] for v in values if v.startswith('md5=')]
+  if headers.get('content-md5'):
+    digests.append(headers['content-md5'])
+  if not digests:
+    return None
+  return base64.b64decode(digests[0]).encode('hex')
+
+
+def get_md5(path):
+  md5 = hashlib.md5()
+  with open(path, 'rb') as f:
+    while True:
+      data = f.read(HASH_READ_SIZE)
+      if not data:
+        break
+      md5.update(data)
+  return md5.hexdigest()
+
+
+def get_slices(size, slice_size):
+  """Returns the (first, last) byte of each slice of an object."""
+  return [(start, min(start + slice_size, size) - 1)
+          for start in range(0, size, slice_size)]
+
+
+class SliceState(object):
+  """Records which slices of a download are on disk, so that an interrupted
+  download resumes where it stopped.
+
+  The slices are only reused for the same size and ETag, as another version
+  of the object may have been uploaded since."""
+
+  def __init__(self, path, url, size, etag):
+    self.path = path
+    self.identity = {'url': url, 'size': size, 'etag': etag}
+    self.done = set()
+    self._lock = threading.Lock()
+
+  def load(self):
+    """Reads the finished slices, and returns whether there are any."""
+
+    if not os.path.isfile(self.path):
+      return False
+    with open(self.path, 'r') as f:
+      try:
+        state = json.load(f)
+      except ValueError:
+        return False
+    if state.get('identity') != self.identity:
+      return False
+    self.done = set(state['done'])
+    return True
+
+  def add(self, index):
+    with self._lock:
+      self.done.add(index)
+      with open(self.path + '.tmp', 'w') as f:
+        json.dump({'identity': self.identity, 'done': sorted(self.done)}, f)
+      os.rename(self.path + '.tmp', self.path)
+
+  def remove(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+
+def verify(url, path, expected_md5):
+  """Raises a BuildDownloadError and removes path if its MD5 is wrong."""
+
+  if expected_md5 and get_md5(path) != expected_md5:
+    os.remove(path)
+    raise common.BuildDownloadError(url, 'checksum mismatch')
+
+
+def download(url, path, jobs=None, headers=None, slice_size=SLICE_SIZE,
+             min_size=SLICED_DOWNLOAD_MIN_SIZE):
+  """Downloads url to path and verifies it against the announced MD5.
+
+  Objects of at least 'min_size' bytes on servers that accept byte ranges
+  are fetched in slices by 'jobs' threads. Each slice is written at its
+  offset of a file preallocated next to path, which is renamed once every
+  slice is there."""
+
+  jobs = jobs or get_download_jobs()
+  session = http_client.get_session()
+  head = session.request('HEAD', url, headers=headers)
+  if head.status != 200:
+    raise common.HttpError(url, head.status)
+  size = int(head.headers.get('content-length', 0))
+  expected_md5 = get_expected_md5(head.headers)
+
+  if (jobs < 2 or size < min_size or
+      head.headers.get('accept-ranges') != 'bytes'):
+    http_client.download(url, path, headers=headers)
+    verify(url, path, expected_md5)
+    return path
+
+  partial_path = path + PARTIAL_SUFFIX
+  state = SliceState(path + STATE_SUFFIX, url, size, head.headers.get('etag'))
+  if not (os.path.isfile(partial_path) and state.load()):
+    with open(partial_path, 'wb') as f:
+      f.truncate(size)
+
+  def fetch_slice(index_and_slice):
+    index, (first, last) = index_and_slice
+    slice_headers = dict(headers or {}, Range='bytes=%d-%d' % (first, last))
+    response = session.request('GET', url, headers=slice_headers,
+                               output_path=partial_path, output_offset=first)
+    if response.status != 206:
+      raise common.HttpError(url, response.status)
+    state.add(index)
+
+  missing = [(i, s) for i, s in enumerate(get_slices(size, slice_size))
+             if i not in state.done]
+  if missing:
+    thread_pool = pool.ThreadPool(min(jobs, len(missing)))
+    try:
+      thread_pool.map(fetch_slice, missing)
+    finally:
+      thread_pool.close()
+
+  state.remove()
+  verify(url, partial_path, expected_md5)
+  os.rename(partial_path, path)
+  return path
@@ -0,0 +1,163 @@
+"""Module for comparing sanitizer crash reports.
+
+A signature is the crash type and the top frames of the first stack of a
+report. The matcher reads a report line by line, so a run can be stopped as
+soon as it is known whether it crashed the same way as the original."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import collections
+
+SIGNATURE_FRAME_COUNT = 3
+CRASH_TYPE_REGEX = re.compile(r'ERROR: \w+Sanitizer: ([\w-]+)')
+FRAME_REGEX = re.compile(r'^\s*#\d+ 0x[0-9a-fA-F]+ in (.+)$')
+LOCATION_REGEX = re.compile(r'\s+(\S+:\d+(:\d+)?|\(\S+\+0x[0-9a-fA-F]+\))$')
+# Frames of the sanitizer runtime and libc say nothing about the bug.
+IGNORED_FRAME_PREFIXES = ('__asan', '__interceptor', '__sanitizer', '__ubsan',
+                          '__libc', '__GI_', 'operator new', 'operator delete',
+                          'malloc', 'calloc', 'realloc', 'free', 'abort',
+                          'raise', 'memcpy', 'memmove', 'memset')
+
+MATCH = 'match'
+MISMATCH = 'mismatch'
+NO_CRASH = 'no_crash'
+UNKNOWN = 'unknown'
+
+Signature = collections.namedtuple('Signature', ['crash_type', 'frames'])
+
+
+def get_crash_type(line):
+  match = CRASH_TYPE_REGEX.search(line)
+  return match.group(1) if match else None
+
+
+def get_frame_function(frame):
+  """Returns the function name of a stack frame match, without its
+  arguments and location, or None if the frame isn't symbolized."""
+
+  function = LOCATION_REGEX.sub('', frame.group(1))
+  if function.startswith('('):
+    return None
+
+  function = function.replace('(anonymous namespace)', '{anonymous}')
+  return function.split('(')[0].strip()
+
+
+def is_ignored_frame(function):
+  return function.startswith(IGNORED_FRAME_PREFIXES)
+
+
+class SignatureMatcher(object):
+  """Compares a crash report, fed one line at a time, to a signature.
+
+  feed returns True once the verdict is known. With no expected signature,
+  the verdict is UNKNOWN, and the signature of the report is still kept.
+  An expected signature without frames, e.g. from an unsymbolized stack, is
+  compared on the crash type alone."""
+
+  def __init__(self, expected=None, frame_count=SIGNATURE_FRAME_COUNT):
+    self.expected = expected
+    if expected:
+      frame_count = min(frame_count, len(expected.frames))
+    self.frame_count = frame_count
+    self.crash_type = None
+    self.frames = []
+    self.in_stack = False
+    self.stack_done = False
+    self.verdict = None
+
+  def feed(self, line):
+    """Processes one line of output and returns whether the verdict is
+    known."""
+
+    if self.verdict or self.stack_done:
+      return bool(self.verdict)
+
+    if self.crash_type is None:
+      self.crash_type = get_crash_type(line)
+      if self.crash_type and self.expected:
+        if self.crash_type != self.expected.crash_type:
+          self.verdict = MISMATCH
+        elif not self.frame_count:
+          self.verdict = MATCH
+      return bool(self.verdict)
+
+    frame = FRAME_REGEX.match(line.rstrip())
+    if not frame:
+      # The first stack ends with the first line after it that isn't a frame.
+      if self.in_stack:
+        self.stack_done = True
+        if self.expected:
+          self.verdict = self.compare_frames()
+      return bool(self.verdict)
+
+    self.in_stack = True
+    function = get_frame_function(frame)
+    if not function or is_ignored_frame(function):
+      return False
+
+    self.frames.append(function)
+    if self.expected:
+      index = len(self.frames) - 1
+      if function != self.expected.frames[index]:
+        self.verdict = MISMATCH
+      elif len(self.frames) >= self.frame_count:
+        self.verdict = MATCH
+    elif len(self.frames) >= self.frame_count:
+      self.stack_done = True
+    return bool(self.verdict)
+
+  def compare_frames(self):
+    """Compares a stack that ended with fewer frames than frame_count."""
+
+    if tuple(self.frames) == self.expected.frames[:len(self.frames)]:
+      return MATCH
+    return MISMATCH
+
+  def get_signature(self):
+    """Returns the signature of the report read so far, or None."""
+
+    if not self.crash_type:
+      return None
+    return Signature(self.crash_type, tuple(self.frames[:self.frame_count]))
+
+  def get_verdict(self):
+    """Returns the verdict once all the output has been fed."""
+
+    if self.verdict:
+      return self.verdict
+    if not self.expected:
+      return UNKNOWN
+    if not self.crash_type:
+      return NO_CRASH
+    return self.compare_frames()
+
+
+def is_reproduced(verdict, returncode):
+  """Returns whether a run reproduced the crash. Without a signature to
+  compare to, any failing run counts."""
+
+  if verdict == UNKNOWN:
+    return returncode != 0
+  return verdict == MATCH
+
+
+def get_signature(lines, frame_count=SIGNATURE_FRAME_COUNT):
+  """Returns the signature of the crash report in lines, or None."""
+
+  matcher = SignatureMatcher(frame_count=frame_count)
+  for line in lines:
+    matcher.feed(line)
+  return matcher.get_signature()
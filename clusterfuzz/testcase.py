@@ -14,8 +14,14 @@
 # limitations under the License.
 
 import os
+import shutil
 
+from clusterfuzz import cache
 from clusterfuzz import common
+from clusterfuzz import http_client
+from clusterfuzz import manifest
+from clusterfuzz import stack_analyzer
+from clusterfuzz import trace
 
 CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
 CLUSTERFUZZ_TESTCASES_DIR = os.path.join(CLUSTERFUZZ_DIR, 'testcases')
@@ -50,29 +56,55 @@ class Testcase(object):
         '%s %s' %(testcase_json['testcase']['window_argument'],
                   testcase_json['testcase']['minimized_arguments']))
 
+  def get_crash_signature(self):
+    """Returns the signature of the original crash, or None."""
+    return stack_analyzer.get_signature(
+        [l['content'] for l in self.stacktrace_lines])
+
   def testcase_dir_name(self):
     """Returns a testcases' respective directory."""
     return os.path.join(CLUSTERFUZZ_TESTCASES_DIR,
                         str(self.id) + '_testcase')
 
   def get_testcase_path(self):
-    """Downloads & returns the location of the testcase file."""
+    """Downloads & returns the location of the testcase file.
+
+    The file is downloaded to a staging directory, which is renamed into
+    place once it holds the manifest, and requesters of the same testcase
+    wait for the one downloading it. A file that no longer matches its
+    manifest is downloaded again."""
 
     testcase_dir = self.testcase_dir_name()
     #TODO: Filename testcase.js is d8-specific
     filename = os.path.join(testcase_dir, 'testcase.js')
-    if os.path.isfile(filename):
+    if os.path.isfile(filename) and manifest.is_intact(testcase_dir):
+      cache.CacheIndex().add_testcase(self.id, testcase_dir)
       return filename
 
-    print 'Downloading testcase data...'
-
-    if not os.path.exists(CLUSTERFUZZ_TESTCASES_DIR):
-      os.makedirs(CLUSTERFUZZ_TESTCASES_DIR)
-    os.makedirs(testcase_dir)
-
-    auth_header = common.get_stored_auth_header()
-    command = 'wget --header="Authorization: %s" "%s" -O ./testcase.js' % (
-        auth_header, CLUSTERFUZZ_TESTCASE_URL % self.id)
-    common.execute(command, testcase_dir)
+    with cache.get_entry_lock(testcase_dir):
+      # Checked again, since it may have been downloaded while waiting.
+      if (os.path.isfile(filename) and
+          manifest.is_intact(testcase_dir, quiet=True)):
+        cache.CacheIndex().add_testcase(self.id, testcase_dir)
+        return filename
+
+      print 'Downloading testcase data...'
+
+      staging_dir = testcase_dir + '.partial'
+      if os.path.exists(staging_dir):
+        shutil.rmtree(staging_dir)
+      common.make_directory(staging_dir)
+
+      auth_header = common.get_stored_auth_header()
+      with trace.span('download_testcase'):
+        http_client.download(CLUSTERFUZZ_TESTCASE_URL % self.id,
+                             os.path.join(staging_dir, 'testcase.js'),
+                             headers={'Authorization': auth_header})
+      manifest.create(staging_dir)
+      if os.path.exists(testcase_dir):
+        shutil.rmtree(testcase_dir)
+      os.rename(staging_dir, testcase_dir)
+      cache.CacheIndex().add_testcase(self.id, testcase_dir,
+                                      cache.get_directory_size(testcase_dir))
 
     return filename
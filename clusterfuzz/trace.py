@@ -0,0 +1,99 @@
+"""Module for timing the phases of a command.
+
+Spans are recorded for the whole process and can be written as Chrome
+trace-event JSON, which chrome://tracing and Perfetto can open."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import threading
+import contextlib
+import collections
+
+Span = collections.namedtuple(
+    'Span', ['name', 'category', 'start', 'duration', 'thread', 'args'])
+
+_spans = []
+_lock = threading.Lock()
+
+
+def reset():
+  """Forgets all recorded spans."""
+  with _lock:
+    del _spans[:]
+
+
+def get_spans():
+  with _lock:
+    return list(_spans)
+
+
+def record(name, category, start, duration, args=None):
+  """Records a span that has already finished."""
+
+  with _lock:
+    _spans.append(Span(name, category, start, duration,
+                       threading.current_thread().ident, args or {}))
+
+
+@contextlib.contextmanager
+def span(name, category='phase', **args):
+  """Records how long the body of the with statement takes."""
+
+  start = time.time()
+  try:
+    yield
+  finally:
+    record(name, category, start, time.time() - start, args)
+
+
+def write_chrome_trace(path):
+  """Writes the recorded spans as Chrome trace-event JSON."""
+
+  import json
+  pid = os.getpid()
+  events = [{'name': s.name,
+             'cat': s.category,
+             'ph': 'X',
+             'ts': int(s.start * 1000000),
+             'dur': int(s.duration * 1000000),
+             'pid': pid,
+             'tid': s.thread,
+             'args': s.args} for s in get_spans()]
+  with open(path, 'w') as f:
+    json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def get_summary(category='phase'):
+  """Returns (name, count, total, longest) for the spans of a category,
+  slowest first."""
+
+  totals = collections.OrderedDict()
+  for s in get_spans():
+    if s.category != category:
+      continue
+    count, total, longest = totals.get(s.name, (0, 0.0, 0.0))
+    totals[s.name] = (count + 1, total + s.duration,
+                      max(longest, s.duration))
+  summary = [(name,) + values for name, values in totals.iteritems()]
+  return sorted(summary, key=lambda row: row[2], reverse=True)
+
+
+def print_summary():
+  """Prints how long each phase took."""
+
+  print '%-24s %6s %10s %10s' % ('PHASE', 'COUNT', 'TOTAL (s)', 'MAX (s)')
+  for name, count, total, longest in get_summary():
+    print '%-24s %6d %10.2f %10.2f' % (name, count, total, longest)
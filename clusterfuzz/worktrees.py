@@ -0,0 +1,221 @@
+"""Module for the pool of git worktrees V8 revisions are built in."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import errno
+import shutil
+import hashlib
+import threading
+
+from clusterfuzz import common
+from clusterfuzz import http_client
+from clusterfuzz import out_dirs
+from clusterfuzz import revisions
+
+CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
+WORKTREES_DIR = os.path.join(CLUSTERFUZZ_DIR, 'worktrees')
+WORKTREES_INDEX_FILE = 'index.json'
+WORKTREE_PREFIX = 'worktree_'
+GIT_HANG_TIMEOUT = 30 * 60
+
+_lock = threading.Lock()
+_git_lock = threading.Lock()
+_in_use = set()
+
+
+def get_pool_size():
+  """Returns how many worktrees to keep per checkout, set by
+  $CLUSTERFUZZ_WORKTREES. The pool is disabled when this is 0, the
+  default."""
+
+  return int(os.environ.get('CLUSTERFUZZ_WORKTREES', 0))
+
+
+def is_process_running(pid):
+  try:
+    os.kill(pid, 0)
+  except OSError as e:
+    return e.errno != errno.ESRCH
+  return True
+
+
+def has_commit(source_directory, sha):
+  """Returns whether the object database of the checkout holds sha."""
+
+  returncode, _ = common.execute(
+      'git cat-file -e %s^{commit}' % sha, source_directory,
+      print_output=False, exit_on_error=False)
+  return returncode == 0
+
+
+class WorktreePool(object):
+  """A pool of worktrees of a V8 checkout, each at a single revision.
+
+  Building in a worktree leaves the user's checkout, and the ninja state of
+  its out directories, untouched. A worktree already at the wanted sha is
+  reused as is, and the least recently used one is recycled once the pool
+  is full.
+
+  Worktrees stay reserved until they are released, once the binaries built
+  in them are no longer run, or the process exits. The index records the
+  process holding each worktree, so that other processes leave it alone. If
+  all of them are reserved, the pool grows, and is trimmed back to its size
+  by later runs.
+
+  Each worktree lives in its own gclient root, with a copy of the .gclient
+  of the checkout, so that its dependencies are synced independently."""
+
+  def __init__(self, source_directory, size):
+    self.source_directory = os.path.abspath(source_directory)
+    self.size = size
+    self.directory = os.path.join(
+        WORKTREES_DIR, hashlib.sha1(self.source_directory).hexdigest()[:12])
+    self.index_path = os.path.join(self.directory, WORKTREES_INDEX_FILE)
+    self.solution = os.path.basename(self.source_directory)
+
+  def worktree_path(self, name):
+    return os.path.join(self.directory, name, self.solution)
+
+  def is_reserved(self, name, entry):
+    """Returns whether a worktree is held by this or another process."""
+
+    owner = entry.get('owner')
+    if owner == os.getpid():
+      return self.worktree_path(name) in _in_use
+    return bool(owner) and is_process_running(owner)
+
+  def acquire(self, sha, revision):
+    """Returns the path of a worktree checked out at sha."""
+
+    with _lock, revisions.get_json_lock(self.index_path):
+      worktrees = revisions.load_json(self.index_path, {})
+      for name in worktrees.keys():
+        if not os.path.isdir(self.worktree_path(name)):
+          del worktrees[name]
+      free = sorted([name for name in worktrees
+                     if not self.is_reserved(name, worktrees[name])],
+                    key=lambda name: worktrees[name]['last_access'])
+
+      matching = [name for name in free if worktrees[name]['sha'] == sha]
+      if matching:
+        name, action = matching[0], None
+      elif free and len(worktrees) >= self.size:
+        name, action = free[0], self.checkout
+      else:
+        name, action = self.get_new_name(worktrees), self.create
+
+      removed = []
+      for old_name in free:
+        if len(worktrees) <= self.size:
+          break
+        if old_name != name:
+          removed.append(old_name)
+          del worktrees[old_name]
+
+      path = self.worktree_path(name)
+      _in_use.add(path)
+      worktrees[name] = {'sha': None if action else sha,
+                         'revision': revision,
+                         'last_access': time.time(),
+                         'owner': os.getpid()}
+      revisions.save_json(self.index_path, worktrees)
+
+    try:
+      if removed:
+        self.remove(removed)
+      if action:
+        action(path, sha)
+    except (Exception, SystemExit):
+      self.release(path)
+      raise
+
+    def set_sha(worktrees):
+      worktrees[name]['sha'] = sha
+    revisions.update_json(self.index_path, {}, set_sha)
+    return path
+
+  def release(self, path):
+    with _lock:
+      _in_use.discard(path)
+
+  def get_new_name(self, worktrees):
+    index = 0
+    while WORKTREE_PREFIX + str(index) in worktrees:
+      index += 1
+    return WORKTREE_PREFIX + str(index)
+
+  def ensure_commit(self, sha):
+    """Fetches, unless sha is already in the object database."""
+
+    with _git_lock:
+      if not has_commit(self.source_directory, sha):
+        if http_client.is_offline():
+          raise common.OfflineError('commit %s' % sha)
+        common.execute('git fetch', self.source_directory,
+                       hang_timeout=GIT_HANG_TIMEOUT, interactive=True)
+
+  def create(self, path, sha):
+    """Adds a worktree at sha in path."""
+
+    self.ensure_commit(sha)
+    common.make_directory(os.path.dirname(path))
+    gclient_file = os.path.join(os.path.dirname(self.source_directory),
+                                '.gclient')
+    if os.path.isfile(gclient_file):
+      shutil.copy(gclient_file, os.path.dirname(path))
+    print 'Creating a worktree at %s' % path
+    with _git_lock:
+      common.execute('git worktree add --detach %s %s' % (path, sha),
+                     self.source_directory, hang_timeout=GIT_HANG_TIMEOUT,
+                     interactive=True)
+    self.sync_dependencies(path, sha)
+
+  def checkout(self, path, sha):
+    """Moves the worktree in path to sha."""
+
+    self.ensure_commit(sha)
+    print 'Recycling the worktree at %s' % path
+    common.execute('git checkout --detach %s' % sha, path,
+                   hang_timeout=GIT_HANG_TIMEOUT, interactive=True)
+    self.sync_dependencies(path, sha)
+
+  def sync_dependencies(self, path, sha):
+    """Syncs the dependencies of a worktree, if DEPS changed."""
+
+    root = os.path.dirname(path)
+    if not os.path.isfile(os.path.join(root, '.gclient')):
+      return
+
+    with open(os.path.join(path, 'DEPS'), 'r') as f:
+      fingerprint = out_dirs.get_fingerprint(f.read())
+    fingerprints = out_dirs.Fingerprints(root)
+    if fingerprints.is_current('gclient_sync', fingerprint):
+      print 'Skipping gclient_sync, its inputs are unchanged'
+      return
+    common.execute(
+        'gclient sync --nohooks --revision %s@%s' % (self.solution, sha),
+        path, hang_timeout=GIT_HANG_TIMEOUT, interactive=True)
+    fingerprints.update('gclient_sync', fingerprint)
+
+  def remove(self, names):
+    """Deletes worktrees recycled out of the pool."""
+
+    for name in names:
+      print 'Removing the worktree at %s' % self.worktree_path(name)
+      shutil.rmtree(os.path.join(self.directory, name))
+    with _git_lock:
+      common.execute('git worktree prune', self.source_directory,
+                     print_output=False)
@@ -28,6 +28,5 @@ setup(
             'clusterfuzz = clusterfuzz.main:execute'
         ]
     },
-    install_requires=['urlfetch==1.0.2'],
     classifiers=[
         'Programming Language :: Python :: 2.7'])
@@ -0,0 +1,188 @@
+"""Test the 'archive' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cStringIO
+import os
+import shutil
+import tempfile
+import struct
+import zipfile
+import zlib
+
+from clusterfuzz import archive
+from clusterfuzz import common
+from test import helpers
+
+
+def build_zip(members, compression=zipfile.ZIP_DEFLATED):
+  """Returns the bytes of a zip archive holding (name, data, mode) members."""
+
+  output = cStringIO.StringIO()
+  zipped = zipfile.ZipFile(output, 'w', compression)
+  for name, data, mode in members:
+    info = zipfile.ZipInfo(name)
+    info.compress_type = compression
+    info.create_system = archive.UNIX_SYSTEM
+    info.external_attr = mode << 16
+    zipped.writestr(info, data)
+  zipped.close()
+  return output.getvalue()
+
+
+def build_streamed_zip(name, data):
+  """Returns a zip whose member sizes are only given in a data descriptor.
+
+  This is what zip tools produce when writing to a pipe."""
+
+  compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+  compressed = compressor.compress(data) + compressor.flush()
+  crc = zlib.crc32(data) & 0xFFFFFFFF
+  local_header = struct.pack(
+      archive.LOCAL_HEADER_FORMAT, archive.LOCAL_HEADER_SIGNATURE, 20,
+      archive.FLAG_DATA_DESCRIPTOR, archive.ZIP_DEFLATED, 0, 0, 0, 0, 0,
+      len(name), 0)
+  descriptor = archive.DATA_DESCRIPTOR_SIGNATURE + struct.pack(
+      '<III', crc, len(compressed), len(data))
+  central_header = struct.pack(
+      archive.CENTRAL_HEADER_FORMAT, archive.CENTRAL_HEADER_SIGNATURE,
+      archive.UNIX_SYSTEM << 8, 20, archive.FLAG_DATA_DESCRIPTOR,
+      archive.ZIP_DEFLATED, 0, 0, crc, len(compressed), len(data), len(name),
+      0, 0, 0, 0, 0755 << 16, 0)
+  members = local_header + name + compressed + descriptor
+  end_record = struct.pack('<4s4H2LH', 'PK\x05\x06', 0, 0, 1, 1,
+                           len(central_header) + len(name), len(members), 0)
+  return members + central_header + name + end_record
+
+
+class ExtractStreamTest(helpers.ExtendedTestCase):
+  """Tests the extract_stream method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.destination = os.path.join(self.clusterfuzz_dir, 'builds', 'abc')
+
+  def extract(self, data):
+    return archive.extract_stream(cStringIO.StringIO(data), self.destination)
+
+  def assert_file(self, name, data, mode=None):
+    """Asserts that an extracted file exists with the given data and mode."""
+
+    path = os.path.join(self.destination, name)
+    with open(path, 'rb') as f:
+      self.assertEqual(f.read(), data)
+    if mode is not None:
+      self.assertEqual(os.stat(path).st_mode & 0777, mode)
+
+  def test_deflated(self):
+    """Tests extracting deflated members and their modes."""
+
+    big_data = os.urandom(3 * archive.READ_SIZE)
+    names = self.extract(build_zip([
+        ('abc/d8', big_data, 0755),
+        ('abc/lib/', '', 0755),
+        ('abc/lib/icudtl.dat', 'icu' * 1000, 0644)]))
+
+    self.assertEqual(names, ['abc/d8', 'abc/lib/', 'abc/lib/icudtl.dat'])
+    self.assert_file('abc/d8', big_data, 0755)
+    self.assert_file('abc/lib/icudtl.dat', 'icu' * 1000, 0644)
+
+  def test_stored(self):
+    """Tests extracting members that are not compressed."""
+
+    self.extract(build_zip([('abc/args.gn', 'is_asan = true', 0600)],
+                           zipfile.ZIP_STORED))
+    self.assert_file('abc/args.gn', 'is_asan = true', 0600)
+
+  def test_data_descriptor(self):
+    """Tests extracting members whose sizes follow their data."""
+
+    self.extract(build_streamed_zip('abc/d8', 'fake d8' * 1000))
+    self.assert_file('abc/d8', 'fake d8' * 1000, 0755)
+
+  def test_unsafe_names(self):
+    """Tests that members cannot be written outside the destination."""
+
+    self.extract(build_zip([('../../evil', 'evil', 0644),
+                            ('/abc//d8', 'fake d8', 0755)]))
+    self.assert_file('evil', 'evil')
+    self.assert_file('abc/d8', 'fake d8')
+
+  def test_crc_mismatch(self):
+    """Tests that corrupt data is detected."""
+
+    data = build_zip([('abc/d8', 'fake d8', 0755)], zipfile.ZIP_STORED)
+    with self.assertRaises(common.BadArchiveError):
+      self.extract(data.replace('fake d8', 'evil d8'))
+
+  def test_truncated(self):
+    """Tests that a truncated archive is detected."""
+
+    data = build_zip([('abc/d8', os.urandom(1000), 0755)])
+    with self.assertRaises(common.BadArchiveError):
+      self.extract(data[:500])
+
+
+class ShardMembersTest(helpers.ExtendedTestCase):
+  """Tests the shard_members method."""
+
+  def test_balanced(self):
+    """Tests that shards hold a similar amount of data."""
+
+    infos = []
+    for name, size in [('a', 100), ('b', 60), ('c', 50), ('d', 40)]:
+      info = zipfile.ZipInfo(name)
+      info.file_size = size
+      infos.append(info)
+
+    self.assertEqual(archive.shard_members(infos, 2), [['a', 'd'], ['b', 'c']])
+    self.assertEqual(archive.shard_members(infos[:1], 4), [['a']])
+
+
+class ExtractParallelTest(helpers.ExtendedTestCase):
+  """Tests the extract_parallel method."""
+
+  def setUp(self):
+    # Workers are separate processes, so a real filesystem is needed.
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.archive_path = os.path.join(self.temp_dir, 'abc.zip')
+    self.destination = os.path.join(self.temp_dir, 'builds')
+    self.members = [('abc/d8', os.urandom(100000), 0755),
+                    ('abc/lib/', '', 0755),
+                    ('abc/lib/libc++.so', 'lib' * 10000, 0644),
+                    ('abc/args.gn', 'is_asan = true', 0600)]
+    with open(self.archive_path, 'wb') as f:
+      f.write(build_zip(self.members))
+
+  def run_and_assert(self, jobs):
+    """Extracts the archive with 'jobs' workers and checks the result."""
+
+    names = archive.extract_parallel(self.archive_path, self.destination, jobs)
+
+    self.assertEqual(names, [name for name, _, _ in self.members])
+    for name, data, mode in self.members:
+      path = os.path.join(self.destination, name)
+      self.assertEqual(os.stat(path).st_mode & 0777, mode)
+      if not name.endswith('/'):
+        with open(path, 'rb') as f:
+          self.assertEqual(f.read(), data)
+
+  def test_single_job(self):
+    """Tests extracting in the current process."""
+    self.run_and_assert(1)
+
+  def test_multiple_jobs(self):
+    """Tests extracting with a pool of workers."""
+    self.run_and_assert(3)
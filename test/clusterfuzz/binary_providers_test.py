@@ -13,107 +13,469 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import cStringIO
 import os
-import json
+import stat
+import subprocess
 import zipfile
 import mock
 
 from clusterfuzz import binary_providers
+from clusterfuzz import build_jobs
+from clusterfuzz import cache
+from clusterfuzz import common
+from clusterfuzz import http_client
+from clusterfuzz import manifest
+from clusterfuzz import out_dirs
 from test import helpers
 
-class BuildRevisionToShaUrlTest(helpers.ExtendedTestCase):
-  """Tests the build_revision_to_sha_url method."""
+class DownloadBuildDataTest(helpers.ExtendedTestCase):
+  """Tests the download_build_data test."""
 
   def setUp(self):
     helpers.patch(self, [
-        'urlfetch.fetch'])
+        'clusterfuzz.common.execute',
+        'clusterfuzz.binary_providers.open_build_stream'])
 
-  def test_correct_url_building(self):
-    """Tests if the SHA url is built correctly"""
+    self.setup_fake_filesystem()
+    self.build_url = 'https://storage.cloud.google.com/abc.zip'
+    self.build_key = cache.build_key(self.build_url)
+    self.provider = binary_providers.BinaryProvider(1234, self.build_url)
+    self.provider.extract_jobs = 1
 
-    result = binary_providers.build_revision_to_sha_url(12345, 'v8/v8')
-    self.assertEqual(result, ('https://cr-rev.appspot.com/_ah/api/crrev/v1'
-                              '/get_numbering?project=chromium&repo=v8%2Fv8'
-                              '&number=12345&numbering_type='
-                              'COMMIT_POSITION&numbering_identifier=refs'
-                              '%2Fheads%2Fmaster'))
+  def test_build_data_already_downloaded(self):
+    """Tests the exit when build data is already returned."""
 
+    build_dir = os.path.join(self.clusterfuzz_dir, 'builds', self.build_key)
+    self.fs.CreateFile(os.path.join(build_dir, 'd8'), contents='d8')
+    manifest.create(build_dir)
+    cache.mark_complete(build_dir)
+    result = self.provider.download_build_data()
+    self.assert_n_calls(0, [self.mock.execute])
+    self.assertEqual(result, build_dir)
+    self.assertEqual(cache.CacheIndex().get_build_key(1234), self.build_key)
 
-class ShaFromRevisionTest(helpers.ExtendedTestCase):
-  """Tests the sha_from_revision method."""
+  def test_build_shared_between_testcases(self):
+    """Tests that a second testcase reuses the same build."""
 
-  def setUp(self):
-    helpers.patch(self, ['urlfetch.fetch'])
+    build_dir = os.path.join(self.clusterfuzz_dir, 'builds', self.build_key)
+    self.fs.CreateFile(os.path.join(build_dir, 'd8'), contents='d8')
+    manifest.create(build_dir)
+    cache.mark_complete(build_dir)
+    other_provider = binary_providers.BinaryProvider(5678, self.build_url)
 
-  def test_get_sha_from_response_body(self):
-    """Tests to ensure that the sha is grabbed from the response correctly"""
+    self.assertEqual(self.provider.download_build_data(), build_dir)
+    self.assertEqual(other_provider.download_build_data(), build_dir)
+    self.assert_n_calls(0, [self.mock.execute])
+    self.assertEqual(cache.CacheIndex().builds[self.build_key]['testcases'],
+                     ['1234', '5678'])
 
-    self.mock.fetch.return_value = mock.Mock(body=json.dumps({
-        'id': 12345,
-        'git_sha': '1a2s3d4f',
-        'crash_type': 'Bad Crash'}))
+  def test_incomplete_build_fetched_again(self):
+    """Tests that a build left without its completion marker is replaced."""
 
-    result = binary_providers.sha_from_revision(123456, 'v8/v8')
-    self.assertEqual(result, '1a2s3d4f')
+    build_dir = os.path.join(self.clusterfuzz_dir, 'builds', self.build_key)
+    self.fs.CreateFile(os.path.join(build_dir, 'args.gn'), contents='partial')
+    self.fs.CreateFile(build_dir + '.partial/d8', contents='stale d8')
+    self.create_build_zip()
 
+    self.provider.download_build_data()
 
-class DownloadBuildDataTest(helpers.ExtendedTestCase):
-  """Tests the download_build_data test."""
+    with open(os.path.join(build_dir, 'd8'), 'r') as f:
+      self.assertEqual('fake d8', f.read())
+    self.assertTrue(cache.is_complete(build_dir))
+    self.assertFalse(os.path.exists(build_dir + '.partial'))
 
-  def setUp(self):
-    helpers.patch(self, ['clusterfuzz.common.execute'])
+  def test_corrupt_build_fetched_again(self):
+    """Tests that a build that does not match its manifest is replaced."""
 
-    self.setup_fake_filesystem()
-    self.build_url = 'https://storage.cloud.google.com/abc.zip'
-    self.provider = binary_providers.BinaryProvider(1234, self.build_url)
+    build_dir = os.path.join(self.clusterfuzz_dir, 'builds', self.build_key)
+    self.fs.CreateFile(os.path.join(build_dir, 'd8'), contents='fake d8')
+    manifest.create(build_dir)
+    cache.mark_complete(build_dir)
+    with open(os.path.join(build_dir, 'd8'), 'w') as f:
+      f.write('fake')
+    self.create_build_zip()
 
-  def test_build_data_already_downloaded(self):
-    """Tests the exit when build data is already returned."""
+    self.provider.download_build_data()
 
-    build_dir = os.path.join(self.clusterfuzz_dir, 'builds', '1234_build')
-    os.makedirs(build_dir)
-    self.provider.build_dir = build_dir
-    result = self.provider.download_build_data()
-    self.assert_n_calls(0, [self.mock.execute])
-    self.assertEqual(result, build_dir)
+    self.assert_n_calls(1, [self.mock.open_build_stream])
+    with open(os.path.join(build_dir, 'd8'), 'r') as f:
+      self.assertEqual('fake d8', f.read())
+    self.assertEqual(manifest.verify(build_dir, full=True), [])
+
+  def test_fetched_while_waiting(self):
+    """Tests that a requester waiting on the entry lock uses the build that
+    the one holding it fetched."""
+
+    build_dir = os.path.join(self.clusterfuzz_dir, 'builds', self.build_key)
+    def fetched_by_other_requester():
+      self.fs.CreateFile(os.path.join(build_dir, 'd8'))
+      manifest.create(build_dir)
+      cache.mark_complete(build_dir)
+    helpers.patch(self, ['clusterfuzz.cache.get_entry_lock'])
+    self.mock.get_entry_lock.return_value.__enter__.side_effect = (
+        fetched_by_other_requester)
+
+    self.assertEqual(self.provider.download_build_data(), build_dir)
+    self.assert_n_calls(0, [self.mock.open_build_stream])
+
+  def test_corrupt_fetched_while_waiting(self):
+    """Tests that a requester that found the build corrupt uses the one
+    fetched again while it waited on the entry lock."""
+
+    build_dir = os.path.join(self.clusterfuzz_dir, 'builds', self.build_key)
+    self.fs.CreateFile(os.path.join(build_dir, 'd8'), contents='fake d8')
+    manifest.create(build_dir)
+    cache.mark_complete(build_dir)
+    with open(os.path.join(build_dir, 'd8'), 'w') as f:
+      f.write('fake')
+    def fetched_by_other_requester():
+      with open(os.path.join(build_dir, 'd8'), 'w') as f:
+        f.write('fake d8')
+    helpers.patch(self, ['clusterfuzz.cache.get_entry_lock'])
+    self.mock.get_entry_lock.return_value.__enter__.side_effect = (
+        fetched_by_other_requester)
+
+    self.assertEqual(self.provider.download_build_data(), build_dir)
+    self.assert_n_calls(0, [self.mock.open_build_stream])
+
+  def test_offline(self):
+    """Tests that builds are not downloaded offline."""
+
+    http_client.set_offline(True)
+    self.addCleanup(http_client.set_offline, False)
+    with self.assertRaises(common.OfflineError):
+      self.provider.download_build_data()
+    self.assert_n_calls(0, [self.mock.open_build_stream])
+
+  def test_evict_before_download(self):
+    """Tests that old builds are evicted when the cache is over quota."""
+
+    self.mock_os_environment({'CLUSTERFUZZ_CACHE_QUOTA': '0'})
+    old_build_dir = os.path.join(self.clusterfuzz_dir, 'builds', 'old')
+    self.fs.CreateFile(os.path.join(old_build_dir, 'd8'), contents='old d8')
+    cache.CacheIndex().add_build(1, 'https://old.zip', old_build_dir, 6)
+    self.create_build_zip()
+
+    self.provider.download_build_data()
+
+    self.assertFalse(os.path.exists(old_build_dir))
+    self.assertEqual(cache.CacheIndex().builds.keys(), [self.build_key])
+
+  def create_build_zip(self):
+    """Makes the build stream return a zip of a fake build."""
+
+    output = cStringIO.StringIO()
+    fakezip = zipfile.ZipFile(output, 'w')
+    fakezip.writestr('abc//args.gn', 'use_goma = True', zipfile.ZIP_DEFLATED)
+    fakezip.writestr('abc//d8', 'fake d8', zipfile.ZIP_DEFLATED)
+    fakezip.close()
+    self.mock.open_build_stream.return_value = cStringIO.StringIO(
+        output.getvalue())
 
   def test_get_build_data(self):
     """Tests extracting, moving and renaming the build data.."""
 
-    os.makedirs(self.clusterfuzz_dir)
     cf_builds_dir = os.path.join(self.clusterfuzz_dir, 'builds')
+    self.create_build_zip()
 
-    with open(os.path.join(self.clusterfuzz_dir, 'args.gn'), 'w') as f:
-      f.write('use_goma = True')
-    with open(os.path.join(self.clusterfuzz_dir, 'd8'), 'w') as f:
-      f.write('fake d8')
-    fakezip = zipfile.ZipFile(
-        os.path.join(self.clusterfuzz_dir, 'abc.zip'), 'w')
-    fakezip.write(os.path.join(self.clusterfuzz_dir, 'args.gn'),
-                  'abc//args.gn', zipfile.ZIP_DEFLATED)
-    fakezip.write(os.path.join(self.clusterfuzz_dir, 'd8'),
-                  'abc//d8', zipfile.ZIP_DEFLATED)
-    fakezip.close()
-    self.assertTrue(
-        os.path.isfile(os.path.join(self.clusterfuzz_dir, 'abc.zip')))
-
-    self.provider.download_build_data()
+    result = self.provider.download_build_data()
 
-    self.assert_exact_calls(self.mock.execute, [mock.call(
-        'gsutil cp gs://abc.zip .',
-        self.clusterfuzz_dir)])
-    self.assertFalse(
-        os.path.isfile(os.path.join(self.clusterfuzz_dir, 'abc.zip')))
-    self.assertTrue(os.path.isdir(
-        os.path.join(cf_builds_dir, '1234_build')))
-    self.assertTrue(os.path.isfile(os.path.join(
-        cf_builds_dir,
-        '1234_build',
-        'args.gn')))
-    with open(os.path.join(cf_builds_dir, '1234_build', 'args.gn'), 'r') as f:
+    build_dir = os.path.join(cf_builds_dir, self.build_key)
+    self.assertEqual(result, build_dir)
+    self.assert_exact_calls(self.mock.open_build_stream, [
+        mock.call(self.build_url)])
+    self.assertEqual(os.listdir(cf_builds_dir), [self.build_key])
+    with open(os.path.join(build_dir, 'args.gn'), 'r') as f:
       self.assertEqual('use_goma = True', f.read())
-    with open(os.path.join(cf_builds_dir, '1234_build', 'd8'), 'r') as f:
+    with open(os.path.join(build_dir, 'd8'), 'r') as f:
       self.assertEqual('fake d8', f.read())
+    self.assertTrue(os.stat(os.path.join(build_dir, 'd8')).st_mode &
+                    stat.S_IEXEC)
+    self.assertEqual(cache.CacheIndex().get_build_key(1234), self.build_key)
+
+
+class DownloadBuildArchiveTest(helpers.ExtendedTestCase):
+  """Tests the download_build_archive method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute',
+                         'clusterfuzz.sliced_download.download'])
+
+  def test_http(self):
+    """Tests that HTTP archives are downloaded natively in slices."""
+
+    self.mock.download.return_value = '/builds/abc.zip'
+    self.assertEqual(binary_providers.download_build_archive(
+        'https://example.com/abc.zip', '/builds'), '/builds/abc.zip')
+    self.assert_exact_calls(self.mock.download, [
+        mock.call('https://example.com/abc.zip', '/builds/abc.zip')])
+    self.assert_n_calls(0, [self.mock.execute])
+
+  def test_cloud_storage(self):
+    """Tests that gsutil is asked for as many slices as download jobs."""
+
+    self.mock_os_environment({'CLUSTERFUZZ_DOWNLOAD_JOBS': '16'})
+    binary_providers.download_build_archive('gs://bucket/abc.zip', '/builds')
+    self.assert_exact_calls(self.mock.execute, [mock.call(
+        'gsutil -o GSUtil:sliced_object_download_max_components=16 '
+        'cp gs://bucket/abc.zip .', '/builds')])
+    self.assert_n_calls(0, [self.mock.download])
+
+
+class OpenBuildStreamTest(helpers.ExtendedTestCase):
+  """Tests the open_build_stream method."""
+
+  def setUp(self):
+    helpers.patch(self, ['subprocess.Popen'])
+
+  def test_cloud_storage(self):
+    """Tests that Cloud Storage objects are read through gsutil."""
+
+    self.mock.Popen.return_value = mock.Mock(
+        stdout=cStringIO.StringIO('data'), returncode=0)
+
+    stream = binary_providers.open_build_stream(
+        'https://storage.cloud.google.com/bucket/abc.zip')
+    self.assertEqual(stream.read(4), 'data')
+    stream.close()
+
+    self.assert_exact_calls(self.mock.Popen, [mock.call(
+        ['gsutil', 'cat', 'gs://bucket/abc.zip'], stdout=subprocess.PIPE)])
+
+  def test_gsutil_failure(self):
+    """Tests that a failed gsutil download raises an error."""
+
+    self.mock.Popen.return_value = mock.Mock(
+        stdout=cStringIO.StringIO(''), returncode=1)
+    stream = binary_providers.open_build_stream('gs://bucket/abc.zip')
+    with self.assertRaises(common.BuildDownloadError):
+      stream.close()
+
+  def test_local_file(self):
+    """Tests reading a local file standing in for Cloud Storage."""
+
+    self.setup_fake_filesystem()
+    self.fs.CreateFile('/builds/abc.zip', contents='zip data')
+
+    for url in ['/builds/abc.zip', 'file:///builds/abc.zip']:
+      stream = binary_providers.open_build_stream(url)
+      self.assertEqual(stream.read(100), 'zip data')
+      stream.close()
+
+  def test_http_server(self):
+    """Tests downloading and extracting from a local HTTP server."""
+
+    archive = cStringIO.StringIO()
+    fakezip = zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED)
+    fakezip.writestr('abc/d8', 'fake d8' * 10000)
+    fakezip.close()
+    server = helpers.start_http_server({'/abc.zip': archive.getvalue()})
+    self.addCleanup(server.shutdown)
+    self.setup_fake_filesystem()
+
+    provider = binary_providers.BinaryProvider(
+        1234, 'http://localhost:%d/abc.zip' % server.server_port)
+    provider.extract_jobs = 1
+    build_dir = provider.download_build_data()
+
+    with open(os.path.join(build_dir, 'd8'), 'r') as f:
+      self.assertEqual('fake d8' * 10000, f.read())
+
+
+class ExtractBuildTest(helpers.ExtendedTestCase):
+  """Tests the extract_build method."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.common.execute',
+        'clusterfuzz.archive.extract_parallel',
+        'clusterfuzz.archive.extract_stream',
+        'clusterfuzz.binary_providers.open_build_stream'])
+    self.setup_fake_filesystem()
+    self.destination = os.path.join(self.clusterfuzz_dir, 'builds', 'abc')
+
+  def test_stream_with_few_cores(self):
+    """Tests that the archive is streamed when there are few cores."""
+
+    provider = binary_providers.BinaryProvider(
+        1234, 'https://storage.cloud.google.com/abc.zip')
+    provider.extract_jobs = 2
+    provider.extract_build(self.destination)
+
+    self.assert_exact_calls(self.mock.extract_stream, [mock.call(
+        self.mock.open_build_stream.return_value, self.destination)])
+    self.assert_n_calls(0, [self.mock.extract_parallel, self.mock.execute])
+
+  def test_stream_error(self):
+    """Tests that an extraction error isn't hidden by gsutil failing once
+    its output is closed."""
+
+    helpers.patch(self, ['subprocess.Popen'])
+    self.mock.Popen.return_value = mock.Mock(
+        stdout=cStringIO.StringIO('data'), returncode=-9)
+    self.mock.Popen.return_value.poll.return_value = None
+    self.mock.open_build_stream.return_value = binary_providers.GsutilStream(
+        'gs://abc.zip')
+    self.mock.extract_stream.side_effect = common.BadArchiveError(
+        'truncated')
+
+    provider = binary_providers.BinaryProvider(
+        1234, 'https://storage.cloud.google.com/abc.zip')
+    provider.extract_jobs = 2
+    with self.assertRaises(common.BadArchiveError):
+      provider.extract_build(self.destination)
+    self.assert_n_calls(1, [self.mock.Popen.return_value.kill])
+
+  def test_parallel_with_many_cores(self):
+    """Tests downloading first and extracting in parallel on many cores."""
+
+    archive_path = os.path.join(self.clusterfuzz_dir, 'abc.zip')
+    self.mock.execute.side_effect = (
+        lambda *_: self.fs.CreateFile(archive_path))
+    provider = binary_providers.BinaryProvider(
+        1234, 'https://storage.cloud.google.com/abc.zip')
+    provider.extract_jobs = 32
+    provider.extract_build(self.destination)
+
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('gsutil -o GSUtil:sliced_object_download_max_components=8 '
+                  'cp gs://abc.zip .', self.clusterfuzz_dir)])
+    self.assert_exact_calls(self.mock.extract_parallel, [
+        mock.call(archive_path, self.destination, 32)])
+    self.assertFalse(os.path.exists(archive_path))
+    self.assert_n_calls(0, [self.mock.extract_stream])
+
+  def test_local_archive(self):
+    """Tests that local archives are extracted without being copied."""
+
+    provider = binary_providers.BinaryProvider(1234, 'file:///builds/abc.zip')
+    provider.extract_jobs = 1
+    provider.extract_build(self.destination)
+
+    self.assert_exact_calls(self.mock.extract_parallel, [
+        mock.call('/builds/abc.zip', self.destination, 1)])
+    self.assert_n_calls(0, [self.mock.execute, self.mock.extract_stream])
+
+
+class MinimalExtractionTest(helpers.ExtendedTestCase):
+  """Tests extracting only what the target needs at runtime."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.download_build_archive'])
+    self.setup_fake_filesystem()
+
+    output = cStringIO.StringIO()
+    fakezip = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED)
+    fakezip.writestr('abc/d8', helpers.build_elf(['libv8.so', 'libc.so.6']))
+    fakezip.writestr('abc/lib/libv8.so', helpers.build_elf(['libicu.so.57']))
+    fakezip.writestr('abc/lib/libicu.so.57', helpers.build_elf([]))
+    fakezip.writestr('abc/lib/libunused.so', helpers.build_elf([]))
+    fakezip.writestr('abc/snapshot_blob.bin', 'snapshot')
+    fakezip.writestr('abc/args.gn', 'is_asan = true')
+    fakezip.writestr('abc/gen/big.js', 'big' * 1000)
+    fakezip.close()
+    self.archive_data = output.getvalue()
+    self.fs.CreateFile('/archives/abc.zip', contents=self.archive_data)
+
+  def assert_extracted(self, build_dir, names, extracted):
+    for name in names:
+      self.assertEqual(os.path.isfile(os.path.join(build_dir, name)),
+                       extracted, name)
+
+  def test_local_archive(self):
+    """Tests minimal and then full extraction of a local archive."""
+
+    provider = binary_providers.V8DownloadedBinary(
+        1234, 'file:///archives/abc.zip')
+    provider.extract_jobs = 1
+    build_dir = provider.download_build_data(minimal=True)
+
+    self.assert_extracted(build_dir, [
+        'd8', 'lib/libv8.so', 'lib/libicu.so.57', 'snapshot_blob.bin'], True)
+    self.assert_extracted(build_dir, [
+        'lib/libunused.so', 'args.gn', 'gen/big.js', 'icudtl.dat'], False)
+    self.assertTrue(os.stat(os.path.join(build_dir, 'd8')).st_mode &
+                    stat.S_IEXEC)
+    self.assert_n_calls(0, [self.mock.download_build_archive])
+
+    provider.download_build_data()
+    self.assert_extracted(build_dir, [
+        'd8', 'lib/libunused.so', 'args.gn', 'gen/big.js'], True)
+    self.assertFalse(os.path.exists(
+        os.path.join(build_dir, binary_providers.PENDING_EXTRACTION_FILE)))
+    self.assertTrue(os.path.isfile('/archives/abc.zip'))
+
+  def test_manifest_before_pending_removed(self):
+    """Tests that the manifest of the full build is written while the build
+    is still marked as pending, and leaves out what is about to be
+    removed."""
+
+    provider = binary_providers.V8DownloadedBinary(
+        1234, 'file:///archives/abc.zip')
+    provider.extract_jobs = 1
+    build_dir = provider.download_build_data(minimal=True)
+    pending_file = os.path.join(build_dir,
+                                binary_providers.PENDING_EXTRACTION_FILE)
+    pending = []
+    manifest_create = manifest.create
+    def create(directory, jobs=None, exclude=()):
+      pending.append(os.path.isfile(pending_file))
+      manifest_create(directory, jobs, exclude)
+    helpers.patch(self, ['clusterfuzz.manifest.create'])
+    self.mock.create.side_effect = create
+
+    provider.download_build_data()
+
+    self.assertEqual(pending, [True])
+    self.assertEqual(manifest.verify(build_dir, full=True), [])
+
+  def test_downloaded_archive(self):
+    """Tests that a downloaded archive is kept until fully extracted."""
+
+    def download(_, directory):
+      self.fs.CreateFile(os.path.join(directory, 'abc.zip'),
+                         contents=self.archive_data)
+      return os.path.join(directory, 'abc.zip')
+    self.mock.download_build_archive.side_effect = download
+
+    provider = binary_providers.V8DownloadedBinary(
+        1234, 'https://storage.cloud.google.com/abc.zip')
+    provider.extract_jobs = 1
+    build_dir = provider.download_build_data(minimal=True)
+    archive_path = os.path.join(build_dir, binary_providers.BUILD_ARCHIVE_NAME)
+
+    self.assert_extracted(build_dir, ['d8', 'lib/libv8.so'], True)
+    self.assert_extracted(build_dir, ['args.gn'], False)
+    self.assertTrue(os.path.isfile(archive_path))
+
+    self.assertEqual(provider.download_build_data(minimal=True), build_dir)
+    self.assert_extracted(build_dir, ['args.gn'], False)
+
+    provider.download_build_data()
+    self.assert_extracted(build_dir, ['args.gn', 'gen/big.js'], True)
+    self.assertFalse(os.path.exists(archive_path))
+    self.assertEqual(manifest.verify(build_dir, full=True), [])
+    self.assert_n_calls(1, [self.mock.download_build_archive])
+
+
+class GetExtractJobsTest(helpers.ExtendedTestCase):
+  """Tests the get_extract_jobs method."""
+
+  def setUp(self):
+    helpers.patch(self, ['multiprocessing.cpu_count'])
+    self.mock.cpu_count.return_value = 32
+
+  def test_default(self):
+    """Tests that all cores are used by default."""
+    self.assertEqual(binary_providers.get_extract_jobs(), 32)
+
+  def test_environment(self):
+    """Tests setting the number of jobs in the environment."""
+
+    self.mock_os_environment({'CLUSTERFUZZ_EXTRACT_JOBS': '3'})
+    self.assertEqual(binary_providers.get_extract_jobs(), 3)
 
 
 class GetBinaryPathTest(helpers.ExtendedTestCase):
@@ -141,13 +503,23 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
   def setUp(self):
     helpers.patch(self, [
         'clusterfuzz.binary_providers.V8Builder.download_build_data',
-        'clusterfuzz.binary_providers.sha_from_revision',
+        'clusterfuzz.revisions.sha_from_revision',
         'clusterfuzz.binary_providers.V8Builder.checkout_source_by_sha',
         'clusterfuzz.binary_providers.V8Builder.build_target',
+        'clusterfuzz.binary_providers.V8Builder.get_source_sha',
         'clusterfuzz.common.ask'])
 
     self.setup_fake_filesystem()
     self.build_url = 'https://storage.cloud.google.com/abc.zip'
+    self.fs.CreateFile(
+        os.path.join(self.clusterfuzz_dir, 'builds',
+                     cache.build_key(self.build_url), 'args.gn'),
+        contents='is_asan = true\ngoma_dir = /remote/goma\n')
+    self.args_key = out_dirs.get_args_key(['is_asan = true', 'goma_dir = '])
+    self.mock.sha_from_revision.return_value = '1a2s3d4f'
+    self.mock.get_source_sha.return_value = '5g6h7j8k'
+    self.mock.build_target.side_effect = (
+        lambda builder: common.make_directory(builder.build_directory))
 
   def test_parameter_not_set_valid_source(self):
     """Tests functionality when build has never been downloaded."""
@@ -158,13 +530,17 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
 
     result = provider.get_build_directory()
     self.assertEqual(result, os.path.join(chrome_source, 'out',
-                                          'clusterfuzz_12345'))
+                                          'clusterfuzz_' + self.args_key))
     self.assert_exact_calls(self.mock.download_build_data,
                             [mock.call(provider)])
     self.assert_exact_calls(self.mock.build_target, [mock.call(provider)])
     self.assert_exact_calls(self.mock.checkout_source_by_sha,
                             [mock.call(provider)])
     self.assert_n_calls(0, [self.mock.ask])
+    self.assertEqual(
+        out_dirs.OutDirIndex(chrome_source).get('clusterfuzz_' +
+                                                self.args_key)['sha'],
+        '1a2s3d4f')
 
   def test_parameter_not_set_invalid_source(self):
     """Tests when build is not downloaded & no valid source passed."""
@@ -176,7 +552,7 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
 
     result = provider.get_build_directory()
     self.assertEqual(result, os.path.join(chrome_source, 'out',
-                                          'clusterfuzz_12345'))
+                                          'clusterfuzz_' + self.args_key))
     self.assert_exact_calls(self.mock.download_build_data,
                             [mock.call(provider)])
     self.assert_exact_calls(self.mock.build_target, [mock.call(provider)])
@@ -188,6 +564,144 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
                   'Please enter a valid directory',
                   mock.ANY)])
 
+  def test_out_dir_shared_between_testcases(self):
+    """Tests that testcases at the same revision share an out directory."""
+
+    first = binary_providers.V8Builder(1, self.build_url, 54321, False, '',
+                                       '/v8/src')
+    second = binary_providers.V8Builder(2, self.build_url, 54321, False, '',
+                                        '/v8/src')
+    build_directory = first.get_build_directory()
+    first.release()
+    self.assertEqual(build_directory, second.get_build_directory())
+
+  def test_out_dir_locked_until_released(self):
+    """Tests that a testcase isn't built in an out directory whose binary
+    hasn't been released yet."""
+
+    index = out_dirs.OutDirIndex('/v8/src')
+    shared = 'clusterfuzz_' + self.args_key
+    first = binary_providers.V8Builder(1, self.build_url, 54321, False, '',
+                                       '/v8/src')
+    second = binary_providers.V8Builder(2, self.build_url, 54321, False, '',
+                                        '/v8/src')
+
+    self.assertEqual(first.get_build_directory(), index.out_dir_path(shared))
+    self.assertEqual(second.get_build_directory(),
+                     index.out_dir_path(shared + '_2'))
+    first.release()
+    second.release()
+    shared_lock = index.get_lock(shared)
+    self.assertTrue(shared_lock.acquire(blocking=False))
+    shared_lock.release()
+
+  def test_out_dir_unlocked_on_failure(self):
+    """Tests that the out directory is unlocked when the build fails."""
+
+    index = out_dirs.OutDirIndex('/v8/src')
+    self.mock.build_target.side_effect = SystemExit(1)
+    provider = binary_providers.V8Builder(1, self.build_url, 54321, False, '',
+                                          '/v8/src')
+    with self.assertRaises(SystemExit):
+      provider.get_build_directory()
+
+    shared_lock = index.get_lock('clusterfuzz_' + self.args_key)
+    self.assertTrue(shared_lock.acquire(blocking=False))
+    shared_lock.release()
+
+  def test_busy_out_dir_not_shared(self):
+    """Tests that a testcase is built in an out directory of its own while
+    another build holds the shared one."""
+
+    index = out_dirs.OutDirIndex('/v8/src')
+    shared = 'clusterfuzz_' + self.args_key
+    provider = binary_providers.V8Builder(1, self.build_url, 54321, False, '',
+                                          '/v8/src')
+    with index.get_lock(shared):
+      result = provider.get_build_directory()
+
+    self.assertEqual(result, index.out_dir_path(shared + '_1'))
+    self.assertEqual(
+        out_dirs.OutDirIndex('/v8/src').get(shared + '_1')['sha'], '1a2s3d4f')
+    private_lock = index.get_lock(shared + '_1')
+    self.assertFalse(private_lock.acquire(blocking=False))
+    provider.release()
+    self.assertTrue(private_lock.acquire(blocking=False))
+    private_lock.release()
+
+  def test_nearest_revision_reused(self):
+    """Tests that a new revision is built in the nearest out directory."""
+
+    index = out_dirs.OutDirIndex('/v8/src')
+    for name, revision in [('far', 100), ('near', 54000)]:
+      os.makedirs(index.out_dir_path(name))
+      index.record(name, 'sha%d' % revision, revision, self.args_key)
+
+    provider = binary_providers.V8Builder(1, self.build_url, 54321, False, '',
+                                          '/v8/src')
+    self.assertEqual(provider.get_build_directory(),
+                     index.out_dir_path('near'))
+    self.assertEqual(out_dirs.OutDirIndex('/v8/src').get('near')['revision'],
+                     54321)
+
+  def test_worktree_pool(self):
+    """Tests that the revision is built in a worktree when the pool is on."""
+
+    self.mock_os_environment({'CLUSTERFUZZ_WORKTREES': '2'})
+    provider = binary_providers.V8Builder(12345, self.build_url, 54321,
+                                          False, '', '/v8/src')
+    with mock.patch('clusterfuzz.worktrees.WorktreePool.acquire',
+                    autospec=True) as acquire:
+      acquire.return_value = '/worktrees/worktree_0/src'
+      result = provider.get_build_directory()
+
+    self.assertEqual(result, os.path.join('/worktrees/worktree_0/src', 'out',
+                                          'clusterfuzz_' + self.args_key))
+    self.assert_exact_calls(acquire, [mock.call(mock.ANY, '1a2s3d4f', 54321)])
+    self.assert_n_calls(0, [self.mock.checkout_source_by_sha])
+
+  def test_worktree_released(self):
+    """Tests that the worktree goes back to the pool once released."""
+
+    self.mock_os_environment({'CLUSTERFUZZ_WORKTREES': '2'})
+    provider = binary_providers.V8Builder(12345, self.build_url, 54321,
+                                          False, '', '/v8/src')
+    with mock.patch('clusterfuzz.worktrees.WorktreePool.acquire',
+                    autospec=True) as acquire, \
+         mock.patch('clusterfuzz.worktrees.WorktreePool.release',
+                    autospec=True) as release:
+      acquire.return_value = '/worktrees/worktree_0/src'
+      provider.get_build_directory()
+      provider.release()
+      provider.release()
+
+    self.assert_exact_calls(release, [
+        mock.call(mock.ANY, '/worktrees/worktree_0/src')])
+
+  def test_current_does_not_resolve_sha(self):
+    """Tests that the sha is never looked up when using the current tree."""
+
+    chrome_source = os.path.join('chrome', 'src', 'dir')
+    provider = binary_providers.V8Builder(12345, self.build_url, 54321,
+                                          True, '', chrome_source)
+    provider.get_build_directory()
+
+    self.assert_n_calls(0, [self.mock.sha_from_revision,
+                            self.mock.checkout_source_by_sha])
+
+  def test_sha_resolved_lazily(self):
+    """Tests that the sha is looked up once, when first needed."""
+
+    self.mock.sha_from_revision.return_value = '1a2s3d4f'
+    provider = binary_providers.V8Builder(12345, self.build_url, 54321,
+                                          False, '', '/v8/src')
+    self.assert_n_calls(0, [self.mock.sha_from_revision])
+
+    self.assertEqual(provider.git_sha, '1a2s3d4f')
+    self.assertEqual(provider.git_sha, '1a2s3d4f')
+    self.assert_exact_calls(self.mock.sha_from_revision, [
+        mock.call(54321, 'v8/v8', '/v8/src')])
+
   def test_parameter_already_set(self):
     """Tests functionality when build_directory parameter is already set."""
 
@@ -213,12 +727,13 @@ class V8DownloadedBuildGetBinaryDirectoryTest(helpers.ExtendedTestCase):
     """Tests functionality when build has never been downloaded."""
 
     provider = binary_providers.V8DownloadedBinary(12345, self.build_url)
-    build_dir = os.path.join(self.clusterfuzz_dir, 'builds', '12345_build')
+    build_dir = os.path.join(self.clusterfuzz_dir, 'builds',
+                             cache.build_key(self.build_url))
 
     result = provider.get_build_directory()
     self.assertEqual(result, build_dir)
     self.assert_exact_calls(self.mock.download_build_data,
-                            [mock.call(provider)])
+                            [mock.call(provider, minimal=True)])
 
   def test_parameter_already_set(self):
     """Tests functionality when the build_directory parameter is already set."""
@@ -235,32 +750,89 @@ class BuildTargetTest(helpers.ExtendedTestCase):
   """Tests the build_chrome method."""
 
   def setUp(self):
+    self.setup_fake_filesystem()
     helpers.patch(self, [
         'clusterfuzz.binary_providers.V8Builder.setup_gn_args',
-        'multiprocessing.cpu_count',
+        'clusterfuzz.build_jobs.get_machine_state',
         'clusterfuzz.common.execute',
-        'clusterfuzz.binary_providers.sha_from_revision'])
-    self.mock.cpu_count.return_value = 12
+        'clusterfuzz.revisions.sha_from_revision'])
+    self.mock.get_machine_state.return_value = {
+        'goma_healthy': True, 'cpus': 12, 'load': 0.0,
+        'available_memory': None}
+    self.chrome_source = '/chrome/source'
+    self.fs.CreateFile(os.path.join(self.chrome_source, 'DEPS'),
+                       contents='deps = {}')
+    self.builder = binary_providers.V8Builder(
+        54321, 'build_url', 12345, False, '/goma/dir/location',
+        self.chrome_source)
+    self.builder.build_directory = '/chrome/source/out/clusterfuzz_54321'
+    self.builder.source_sha = '1a2s3d4f'
+    self.runhooks_call = mock.call(
+        'GYP_DEFINES=asan=1 gclient runhooks', self.chrome_source,
+        hang_timeout=binary_providers.BUILD_HANG_TIMEOUT)
+    self.gyp_call = mock.call(
+        'GYP_DEFINES=asan=1 gypfiles/gyp_v8', self.chrome_source,
+        hang_timeout=binary_providers.BUILD_HANG_TIMEOUT)
+    self.ninja_call = mock.call(
+        'ninja -C /chrome/source/out/clusterfuzz_54321 -j 120 d8',
+        self.chrome_source, hang_timeout=binary_providers.BUILD_HANG_TIMEOUT)
 
   def test_correct_calls(self):
     """Tests the correct checks and commands are run to build."""
 
-    revision_num = 12345
-    testcase_id = 54321
-    chrome_source = '/chrome/source'
-    goma_dir = '/goma/dir/location'
-    builder = binary_providers.V8Builder(
-        testcase_id, 'build_url', revision_num, False, goma_dir, chrome_source)
-    builder.build_directory = '/chrome/source/out/clusterfuzz_54321'
-    builder.build_target()
+    self.builder.build_target()
+
+    self.assert_exact_calls(self.mock.execute, [
+        self.runhooks_call, self.gyp_call, self.ninja_call])
+    self.assert_exact_calls(self.mock.setup_gn_args,
+                            [mock.call(self.builder)])
+    self.assert_exact_calls(self.mock.get_machine_state,
+                            [mock.call('/goma/dir/location')])
+    history = build_jobs.read_build_history()
+    self.assertEqual(len(history), 1)
+    self.assertEqual(history[0]['jobs'], 120)
+    self.assertEqual(history[0]['target'], 'd8')
+
+  def test_build_summary(self):
+    """Tests that the build summary is printed when asked for."""
+
+    self.mock_os_environment({'CLUSTERFUZZ_BUILD_SUMMARY': '1'})
+    with mock.patch('clusterfuzz.ninja_log.BuildSummary.print_summary',
+                    autospec=True) as print_summary:
+      self.builder.build_target()
+    self.assert_n_calls(1, [print_summary])
+
+  def test_unchanged_inputs(self):
+    """Tests that runhooks and gyp_v8 are skipped when nothing changed."""
+
+    self.builder.build_target()
+    self.builder.build_target()
+
+    self.assert_exact_calls(self.mock.execute, [
+        self.runhooks_call, self.gyp_call, self.ninja_call, self.ninja_call])
+
+  def test_new_revision(self):
+    """Tests that only gyp_v8 runs again when DEPS didn't change."""
+
+    self.builder.build_target()
+    self.builder.source_sha = '5g6h7j8k'
+    self.builder.build_target()
 
     self.assert_exact_calls(self.mock.execute, [
-        mock.call('GYP_DEFINES=asan=1 gclient runhooks', chrome_source),
-        mock.call('GYP_DEFINES=asan=1 gypfiles/gyp_v8', chrome_source),
-        mock.call(
-            'ninja -C /chrome/source/out/clusterfuzz_54321 -j 120 d8',
-            chrome_source)])
-    self.assert_exact_calls(self.mock.setup_gn_args, [mock.call(builder)])
+        self.runhooks_call, self.gyp_call, self.ninja_call, self.gyp_call,
+        self.ninja_call])
+
+  def test_new_deps(self):
+    """Tests that runhooks runs again when DEPS changed."""
+
+    self.builder.build_target()
+    with open(os.path.join(self.chrome_source, 'DEPS'), 'w') as f:
+      f.write('deps = {"a": "b"}')
+    self.builder.build_target()
+
+    self.assert_exact_calls(self.mock.execute, [
+        self.runhooks_call, self.gyp_call, self.ninja_call,
+        self.runhooks_call, self.gyp_call, self.ninja_call])
 
 
 class SetupGnArgsTest(helpers.ExtendedTestCase):
@@ -270,10 +842,16 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
     self.setup_fake_filesystem()
     helpers.patch(self, [
         'clusterfuzz.common.execute',
-        'clusterfuzz.binary_providers.sha_from_revision'])
+        'clusterfuzz.revisions.sha_from_revision'])
     self.testcase_dir = os.path.expanduser(os.path.join('~', 'test_dir'))
     self.builder = binary_providers.V8Builder(
         1234, '', '', False, '/goma/dir', '/chrome/source/dir')
+    build_dir = os.path.join(self.clusterfuzz_dir, 'builds',
+                             cache.build_key(''))
+    os.makedirs(build_dir)
+    with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
+      f.write('goma_dir = /not/correct/dir')
+    self.builder.build_directory = self.testcase_dir
 
   def test_args_setup(self):
     """Tests to ensure that the args.gn is setup correctly."""
@@ -281,19 +859,46 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
     os.makedirs(self.testcase_dir)
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'w') as f:
       f.write('Not correct args.gn')
-    build_dir = os.path.join(self.clusterfuzz_dir, 'builds', '1234_build')
-    os.makedirs(build_dir)
-    with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
-      f.write('goma_dir = /not/correct/dir')
 
-    self.builder.build_directory = self.testcase_dir
     self.builder.setup_gn_args()
 
     self.assert_exact_calls(self.mock.execute, [
-        mock.call('gn gen %s' % self.testcase_dir, '/chrome/source/dir')])
+        mock.call('gn gen %s' % self.testcase_dir, '/chrome/source/dir',
+                  hang_timeout=binary_providers.BUILD_HANG_TIMEOUT)])
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'r') as f:
       self.assertEqual(f.read(), 'goma_dir = /goma/dir\n')
 
+  def test_args_unchanged(self):
+    """Tests that an up to date args.gn is not rewritten."""
+
+    self.fs.CreateFile(os.path.join(self.testcase_dir, 'args.gn'),
+                       contents='goma_dir = /goma/dir\n')
+    os.utime(os.path.join(self.testcase_dir, 'args.gn'), (1, 1))
+
+    self.builder.setup_gn_args()
+
+    self.assertEqual(
+        os.stat(os.path.join(self.testcase_dir, 'args.gn')).st_mtime, 1)
+
+  def test_gn_gen_skipped(self):
+    """Tests that gn gen is skipped when args.gn and the sha are unchanged."""
+
+    self.builder.source_sha = '1a2s3d4f'
+    self.builder.setup_gn_args()
+    self.fs.CreateFile(os.path.join(self.testcase_dir, 'build.ninja'))
+    self.builder.setup_gn_args()
+    self.builder.source_sha = '5g6h7j8k'
+    self.builder.setup_gn_args()
+
+    self.assert_n_calls(2, [self.mock.execute])
+
+  def test_gn_gen_without_build_ninja(self):
+    """Tests that gn gen runs again if build.ninja is missing."""
+
+    self.builder.setup_gn_args()
+    self.builder.setup_gn_args()
+
+    self.assert_n_calls(2, [self.mock.execute])
 
 
 class CheckoutSourceByShaTest(helpers.ExtendedTestCase):
@@ -303,7 +908,7 @@ class CheckoutSourceByShaTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.common.execute',
         'clusterfuzz.common.check_confirm',
-        'clusterfuzz.binary_providers.sha_from_revision'])
+        'clusterfuzz.revisions.sha_from_revision'])
     self.chrome_source = '/usr/local/google/home/user/repos/chromium/src'
     self.command = ('git fetch && git checkout 1a2s3d4f'
                     ' in %s' % self.chrome_source)
@@ -322,7 +927,9 @@ class CheckoutSourceByShaTest(helpers.ExtendedTestCase):
         [mock.call('git rev-parse HEAD',
                    self.chrome_source,
                    print_output=False),
-         mock.call('git fetch && git checkout 1a2s3d4f', self.chrome_source)])
+         mock.call('git fetch && git checkout 1a2s3d4f', self.chrome_source,
+                   hang_timeout=binary_providers.BUILD_HANG_TIMEOUT,
+                   interactive=True)])
     self.assert_exact_calls(self.mock.check_confirm,
                             [mock.call(
                                 'Proceed with the following command:\n%s?' %
@@ -0,0 +1,116 @@
+"""Test the 'build_jobs' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from clusterfuzz import build_jobs
+from test import helpers
+
+
+class IsGomaHealthyTest(helpers.ExtendedTestCase):
+  """Tests the is_goma_healthy method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute'])
+
+  def test_healthy(self):
+    """Tests a compiler proxy that reports ok."""
+
+    self.mock.execute.return_value = (
+        0, 'compiler proxy (pid=1234) status: ok\n')
+    self.assertTrue(build_jobs.is_goma_healthy('/goma'))
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('python goma_ctl.py status', '/goma', print_output=False,
+                  exit_on_error=False)])
+
+  def test_unhealthy(self):
+    """Tests a compiler proxy that is down or reports errors."""
+
+    self.mock.execute.return_value = (1, 'compiler proxy status: error\n')
+    self.assertFalse(build_jobs.is_goma_healthy('/goma'))
+    self.mock.execute.return_value = (0, 'compiler proxy status: error\n')
+    self.assertFalse(build_jobs.is_goma_healthy('/goma'))
+
+
+class ChooseJobsTest(helpers.ExtendedTestCase):
+  """Tests the choose_jobs method."""
+
+  def get_jobs(self, goma_healthy=True, load=0.0, available_memory=None):
+    return build_jobs.choose_jobs({'goma_healthy': goma_healthy, 'cpus': 8,
+                                   'load': load,
+                                   'available_memory': available_memory})
+
+  def test_goma_healthy(self):
+    """Tests that an idle machine with goma runs 10 jobs per core."""
+    self.assertEqual(self.get_jobs(), 80)
+
+  def test_goma_down(self):
+    """Tests that without goma there is one job per core."""
+    self.assertEqual(self.get_jobs(goma_healthy=False), 8)
+
+  def test_loaded(self):
+    """Tests that busy cores lower the number of jobs."""
+
+    self.assertEqual(self.get_jobs(goma_healthy=False, load=6.0), 2)
+    self.assertEqual(self.get_jobs(goma_healthy=False, load=20.0), 1)
+    self.assertEqual(self.get_jobs(load=20.0), 40)
+
+  def test_memory(self):
+    """Tests that jobs are bounded by the available memory."""
+
+    self.assertEqual(self.get_jobs(available_memory=2 * 1024 ** 3), 8)
+    self.assertEqual(
+        self.get_jobs(goma_healthy=False, available_memory=2 * 1024 ** 3), 2)
+
+
+class GetJobsTest(helpers.ExtendedTestCase):
+  """Tests the get_jobs method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.build_jobs.get_machine_state'])
+    self.state = {'goma_healthy': True, 'cpus': 8, 'load': 0.0,
+                  'available_memory': None}
+    self.mock.get_machine_state.return_value = self.state
+
+  def test_chosen(self):
+    """Tests that jobs are chosen from the machine state."""
+    self.assertEqual(build_jobs.get_jobs('/goma'), (80, self.state))
+
+  def test_override(self):
+    """Tests that $CLUSTERFUZZ_NINJA_JOBS overrides the choice."""
+
+    self.mock_os_environment({'CLUSTERFUZZ_NINJA_JOBS': '30'})
+    self.assertEqual(build_jobs.get_jobs('/goma'), (30, self.state))
+
+
+class BuildHistoryTest(helpers.ExtendedTestCase):
+  """Tests the record_build and read_build_history methods."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_record(self):
+    """Tests that builds are appended to the history."""
+
+    state = {'goma_healthy': False, 'cpus': 8, 'load': 1.0,
+             'available_memory': 1024}
+    build_jobs.record_build('d8', 7, state, 12.5)
+    build_jobs.record_build('d8', 80, dict(state, goma_healthy=True), 3.0)
+
+    history = build_jobs.read_build_history()
+    self.assertEqual([(b['jobs'], b['duration'], b['goma_healthy'])
+                      for b in history],
+                     [(7, 12.5, False), (80, 3.0, True)])
+    self.assertEqual(history[0]['target'], 'd8')
@@ -0,0 +1,180 @@
+"""Test the 'cache' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from clusterfuzz import cache
+from test import helpers
+
+
+class BuildKeyTest(helpers.ExtendedTestCase):
+  """Tests the build_key method."""
+
+  def test_same_url(self):
+    """Tests that the key only depends on the build URL."""
+
+    url = 'https://storage.cloud.google.com/bucket/d8-asan-1234.zip'
+    self.assertEqual(cache.build_key(url), cache.build_key(url))
+    self.assertTrue(cache.build_key(url).startswith('d8-asan-1234_'))
+
+  def test_different_urls(self):
+    """Tests that builds with the same name in other buckets differ."""
+
+    self.assertNotEqual(
+        cache.build_key('https://storage.cloud.google.com/a/d8.zip'),
+        cache.build_key('https://storage.cloud.google.com/b/d8.zip'))
+
+
+class ParseSizeTest(helpers.ExtendedTestCase):
+  """Tests the parse_size and format_size methods."""
+
+  def test_parse_size(self):
+    """Tests parsing sizes with and without units."""
+
+    self.assertEqual(cache.parse_size('1234'), 1234)
+    self.assertEqual(cache.parse_size('2k'), 2048)
+    self.assertEqual(cache.parse_size('1.5G'), 1536 * 1024 * 1024)
+
+  def test_format_size(self):
+    """Tests formatting sizes."""
+
+    self.assertEqual(cache.format_size(12), '12B')
+    self.assertEqual(cache.format_size(1536 * 1024 * 1024), '1.5G')
+
+  def test_get_quota(self):
+    """Tests reading the quota from the environment."""
+
+    self.mock_os_environment({'CLUSTERFUZZ_CACHE_QUOTA': '10M'})
+    self.assertEqual(cache.get_quota(), 10 * 1024 * 1024)
+
+
+class CacheIndexTest(helpers.ExtendedTestCase):
+  """Tests the CacheIndex class."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['time.time'])
+    self.mock.time.return_value = 100
+    self.build_url = 'https://storage.cloud.google.com/abc.zip'
+    self.builds_dir = os.path.join(self.clusterfuzz_dir, 'builds')
+
+  def create_entry(self, path, size):
+    """Creates a directory holding a single file of 'size' bytes."""
+
+    os.makedirs(path)
+    with open(os.path.join(path, 'file'), 'w') as f:
+      f.write('x' * size)
+    return path
+
+  def test_empty_index(self):
+    """Tests reading an index that does not exist yet."""
+
+    index = cache.CacheIndex()
+    self.assertEqual(index.get_build_key(1234), None)
+    self.assertEqual(index.get_total_size(), 0)
+    self.assertFalse(os.path.exists(cache.CACHE_INDEX_FILE))
+
+  def test_add_build(self):
+    """Tests that testcases are mapped to a shared build and persisted."""
+
+    path = os.path.join(self.builds_dir, 'abc')
+    key = cache.CacheIndex().add_build(1234, self.build_url, path, 10)
+    self.mock.time.return_value = 200
+    cache.CacheIndex().add_build(5678, self.build_url, path)
+    cache.CacheIndex().add_build(5678, self.build_url, path)
+
+    index = cache.CacheIndex()
+    self.assertEqual(key, cache.build_key(self.build_url))
+    self.assertEqual(index.get_build_key(1234), key)
+    self.assertEqual(index.get_build_key('5678'), key)
+    self.assertEqual(index.builds, {key: {
+        'url': self.build_url, 'path': path, 'size': 10,
+        'last_access': 200, 'testcases': ['1234', '5678']}})
+
+  def test_add_testcase(self):
+    """Tests recording a testcase's files."""
+
+    path = os.path.join(self.clusterfuzz_dir, 'testcases', '1234_testcase')
+    cache.CacheIndex().add_build(1234, self.build_url, 'build_path', 10)
+    cache.CacheIndex().add_testcase(1234, path, 5)
+
+    index = cache.CacheIndex()
+    self.assertEqual(index.testcases['1234'], {
+        'build': cache.build_key(self.build_url), 'path': path, 'size': 5,
+        'last_access': 100})
+    self.assertEqual(index.get_total_size(), 15)
+
+  def test_concurrent_changes(self):
+    """Tests that changes made through another index are not lost."""
+
+    path = os.path.join(self.clusterfuzz_dir, 'testcases', '1234_testcase')
+    build_index = cache.CacheIndex()
+    cache.CacheIndex().add_testcase(1234, path, 5)
+    build_index.add_build(1234, self.build_url, 'build_path', 10)
+
+    self.assertEqual(cache.CacheIndex().get_total_size(), 15)
+
+  def test_evict(self):
+    """Tests that the least recently used entries are evicted first."""
+
+    old_build = self.create_entry(os.path.join(self.builds_dir, 'old'), 10)
+    new_build = self.create_entry(os.path.join(self.builds_dir, 'new'), 10)
+    testcase_dir = self.create_entry(
+        os.path.join(self.clusterfuzz_dir, 'testcases', '1_testcase'), 5)
+
+    index = cache.CacheIndex()
+    index.add_build(1, 'https://storage/old.zip', old_build, 10)
+    self.mock.time.return_value = 200
+    index.add_testcase(1, testcase_dir, 5)
+    self.mock.time.return_value = 300
+    index.add_build(2, 'https://storage/new.zip', new_build, 10)
+
+    evicted = index.evict(12)
+
+    self.assertEqual(evicted, [
+        ('build', cache.build_key('https://storage/old.zip')),
+        ('testcase', '1')])
+    self.assertFalse(os.path.exists(old_build))
+    self.assertFalse(os.path.exists(testcase_dir))
+    self.assertTrue(os.path.exists(new_build))
+    self.assertEqual(cache.CacheIndex().get_total_size(), 10)
+
+  def test_evict_skips_locked(self):
+    """Tests that an entry being fetched by another requester is kept."""
+
+    build = self.create_entry(os.path.join(self.builds_dir, 'abc'), 10)
+    cache.CacheIndex().add_build(1, self.build_url, build, 10)
+
+    with cache.get_entry_lock(build):
+      self.assertEqual(cache.CacheIndex().evict(0), [])
+    self.assertTrue(os.path.exists(build))
+    self.assertEqual(len(cache.CacheIndex().evict(0)), 1)
+
+  def test_is_complete(self):
+    """Tests the completion marker."""
+
+    path = self.create_entry(os.path.join(self.builds_dir, 'abc'), 10)
+    self.assertFalse(cache.is_complete(path))
+    cache.mark_complete(path)
+    self.assertTrue(cache.is_complete(path))
+
+  def test_evict_keep(self):
+    """Tests that kept entries survive even when over quota."""
+
+    build = self.create_entry(os.path.join(self.builds_dir, 'abc'), 10)
+    key = cache.CacheIndex().add_build(1, self.build_url, build, 10)
+
+    self.assertEqual(cache.CacheIndex().evict(0, keep=[key]), [])
+    self.assertTrue(os.path.exists(build))
@@ -0,0 +1,47 @@
+"""Test the 'build_log' command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from clusterfuzz.commands import build_log
+from test import helpers
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Test execute."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.ninja_log.BuildSummary.print_summary'])
+
+  def test_given_directories(self):
+    """Tests summarizing the given out directories."""
+
+    build_log.execute(['/out/a', '/out/b'], 5)
+    self.assert_exact_calls(self.mock.print_summary, [
+        mock.call(mock.ANY, 5), mock.call(mock.ANY, 5)])
+
+  def test_clusterfuzz_out_dirs(self):
+    """Tests that only clusterfuzz out directories are summarized."""
+
+    self.mock_os_environment({'V8_SRC': '/v8/src'})
+    for name in ['clusterfuzz_b', 'clusterfuzz_a', 'Release']:
+      self.fs.CreateDirectory('/v8/src/out/' + name)
+
+    self.assertEqual(build_log.get_clusterfuzz_out_dirs('/v8/src'),
+                     ['/v8/src/out/clusterfuzz_a', '/v8/src/out/clusterfuzz_b'])
+    build_log.execute([], 10)
+    self.assert_n_calls(2, [self.mock.print_summary])
@@ -0,0 +1,106 @@
+"""Test the module for the 'cache' command"""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cStringIO
+import os
+import mock
+
+from clusterfuzz import cache
+from clusterfuzz import manifest
+from clusterfuzz.commands import cache as cache_command
+from test import helpers
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Test execute."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.cache.CacheIndex.evict',
+        'clusterfuzz.commands.cache.list_entries'])
+    self.mock.evict.return_value = []
+    self.mock_os_environment({'CLUSTERFUZZ_CACHE_QUOTA': '1G'})
+
+  def test_ls(self):
+    """Tests listing the cache."""
+
+    cache_command.execute('ls', None)
+    self.assert_exact_calls(self.mock.list_entries, [mock.call(mock.ANY)])
+    self.assert_n_calls(0, [self.mock.evict])
+
+  def test_gc_default_quota(self):
+    """Tests collecting garbage down to the configured quota."""
+
+    cache_command.execute('gc', None)
+    self.assert_exact_calls(self.mock.evict, [
+        mock.call(mock.ANY, 1024 ** 3)])
+
+  def test_gc_quota(self):
+    """Tests collecting garbage down to an explicit quota."""
+
+    cache_command.execute('gc', '20M')
+    self.assert_exact_calls(self.mock.evict, [
+        mock.call(mock.ANY, 20 * 1024 ** 2)])
+
+
+class VerifyEntriesTest(helpers.ExtendedTestCase):
+  """Tests the verify_entries method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_verify(self):
+    """Tests that corrupt entries lose their manifest."""
+
+    index = cache.CacheIndex()
+    for name in ['good', 'bad']:
+      path = os.path.join(self.clusterfuzz_dir, 'builds', name)
+      self.fs.CreateFile(os.path.join(path, 'd8'), contents='d8')
+      manifest.create(path)
+      index.add_build(1, 'https://storage/%s.zip' % name, path, 2)
+    bad_path = os.path.join(self.clusterfuzz_dir, 'builds', 'bad')
+    with open(os.path.join(bad_path, 'd8'), 'w') as f:
+      f.write('d9')
+
+    with mock.patch('sys.stdout', new_callable=cStringIO.StringIO) as stdout:
+      cache_command.verify_entries(index)
+
+    self.assertIn('Verified 2 entries, 1 corrupt.', stdout.getvalue())
+    self.assertFalse(os.path.exists(manifest.get_path(bad_path)))
+    self.assertEqual(manifest.verify(
+        os.path.join(self.clusterfuzz_dir, 'builds', 'good')), [])
+
+
+class ListEntriesTest(helpers.ExtendedTestCase):
+  """Tests the list_entries method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_list(self):
+    """Tests that entries are read from the index, not the tree."""
+
+    index = cache.CacheIndex()
+    key = index.add_build(1234, 'https://storage/abc.zip',
+                          os.path.join(self.clusterfuzz_dir, 'builds', 'abc'),
+                          2048)
+    self.assertFalse(os.path.exists(
+        os.path.join(self.clusterfuzz_dir, 'builds')))
+
+    with mock.patch('sys.stdout', new_callable=cStringIO.StringIO) as stdout:
+      cache_command.list_entries(index)
+    self.assertIn(key, stdout.getvalue())
+    self.assertIn('2.0K', stdout.getvalue())
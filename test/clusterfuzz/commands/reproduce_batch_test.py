@@ -0,0 +1,214 @@
+"""Test the module for the 'reproduce-batch' command"""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import mock
+
+from clusterfuzz import common
+from clusterfuzz import out_dirs
+from clusterfuzz.commands import reproduce_batch
+from test import helpers
+
+
+class ReadTestcaseIdsTest(helpers.ExtendedTestCase):
+  """Tests the read_testcase_ids method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_read(self):
+    """Tests that IDs from the file are appended without duplicates."""
+
+    with open('/ids', 'w') as f:
+      f.write('5678 1234\n# A comment\n\n9012 # trailing comment\n')
+
+    self.assertEqual(['1234', '5678', '9012'],
+                     reproduce_batch.read_testcase_ids(['1234'], '/ids'))
+
+
+class GetDefaultJobsTest(helpers.ExtendedTestCase):
+  """Tests the get_default_jobs method."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'multiprocessing.cpu_count',
+        'clusterfuzz.common.get_available_memory'])
+    self.mock.cpu_count.return_value = 8
+
+  def test_memory_bound(self):
+    """Tests that jobs are limited by the available memory."""
+
+    self.mock.get_available_memory.return_value = 5 * 1024 ** 3
+    self.assertEqual(2, reproduce_batch.get_default_jobs())
+
+  def test_cpu_bound(self):
+    """Tests that jobs are limited by the cores."""
+
+    self.mock.get_available_memory.return_value = 64 * 1024 ** 3
+    self.assertEqual(8, reproduce_batch.get_default_jobs())
+
+  def test_low_memory(self):
+    """Tests that at least one job runs."""
+
+    self.mock.get_available_memory.return_value = 1024
+    self.assertEqual(1, reproduce_batch.get_default_jobs())
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Tests the execute method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.get_testcase_info',
+        'clusterfuzz.commands.reproduce.ensure_goma',
+        'clusterfuzz.commands.reproduce.reproduce_crash',
+        'clusterfuzz.testcase.Testcase',
+        'clusterfuzz.binary_providers.V8DownloadedBinary'])
+    self.testcases = {
+        '1': mock.Mock(id=1, build_url='build_a'),
+        '2': mock.Mock(id=2, build_url='build_a'),
+        '3': mock.Mock(id=3, build_url='build_b')}
+    self.mock.get_testcase_info.side_effect = lambda i: i
+    self.mock.Testcase.side_effect = self.testcases.get
+    self.providers = []
+    def make_provider(_, build_url):
+      self.providers.append(mock.Mock(**{
+          'get_binary_path.return_value': '/%s/d8' % build_url}))
+      return self.providers[-1]
+    self.mock.V8DownloadedBinary.side_effect = make_provider
+    self.mock.reproduce_crash.side_effect = (
+        lambda binary_path, current_testcase, **_:
+        (current_testcase.id - 1, 'output %d' % current_testcase.id,
+         'unknown'))
+
+  def read_records(self):
+    with open('/results', 'r') as f:
+      return sorted([json.loads(l) for l in f],
+                    key=lambda r: r['testcase_id'])
+
+  def test_execute(self):
+    """Tests that shared builds are fetched once and all testcases run."""
+
+    reproduce_batch.execute(['1', '2', '3', '2'], None, False, True, 2,
+                            '/results')
+
+    self.assertEqual(
+        ['build_a', 'build_b'],
+        sorted(c[0][1] for c in self.mock.V8DownloadedBinary.call_args_list))
+    self.assert_n_calls(0, [self.mock.ensure_goma])
+    records = self.read_records()
+    self.assertEqual([('1', 'no_crash', '/build_a/d8'),
+                      ('2', 'crashed', '/build_a/d8'),
+                      ('3', 'crashed', '/build_b/d8')],
+                     [(r['testcase_id'], r['status'], r['build_url'] and
+                       '/%s/d8' % r['build_url']) for r in records])
+    self.assertEqual('output 3', records[2]['output'])
+    self.assertEqual(1, self.testcases['1'].get_testcase_path.call_count)
+    for provider in self.providers:
+      self.assert_exact_calls(provider.release, [mock.call()])
+
+  def test_errors(self):
+    """Tests that failing testcases are recorded without stopping others."""
+
+    def get_testcase_info(testcase_id):
+      if testcase_id == '1':
+        raise SystemExit(1)
+      return testcase_id
+    self.mock.get_testcase_info.side_effect = get_testcase_info
+    self.testcases['3'].get_testcase_path.side_effect = IOError('missing')
+
+    reproduce_batch.execute(['1', '2', '3'], None, False, True, 2, '/results')
+
+    self.assertEqual(
+        [('1', 'error', 'SystemExit: 1'), ('2', 'crashed', None),
+         ('3', 'error', 'IOError: missing')],
+        [(r['testcase_id'], r['status'], r['error'])
+         for r in self.read_records()])
+
+  def test_timeout(self):
+    """Tests that testcases stopped by a limit are recorded as such."""
+
+    def reproduce_crash(_, current_testcase, **kwargs):
+      self.assertEqual((10, None), (kwargs['timeout'], kwargs['cpu_timeout']))
+      if current_testcase.id == 3:
+        raise common.CommandTimeoutError('d8', 'hang', 'partial output')
+      return 1, 'output', 'match'
+    self.mock.reproduce_crash.side_effect = reproduce_crash
+
+    reproduce_batch.execute(['1', '3'], None, False, True, 2, '/results',
+                            timeout=10)
+
+    self.assertEqual(
+        [('1', 'crashed', 'match'), ('3', 'hang', 'hang')],
+        [(r['testcase_id'], r['status'], r['verdict'])
+         for r in self.read_records()])
+
+
+class SharedArgsTest(helpers.ExtendedTestCase):
+  """Tests building revisions whose builds have the same args.gn."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.mock_os_environment({'V8_SRC': '/v8/src',
+                              'CLUSTERFUZZ_WORKTREES': '0'})
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.get_testcase_info',
+        'clusterfuzz.commands.reproduce.ensure_goma',
+        'clusterfuzz.commands.reproduce.reproduce_crash',
+        'clusterfuzz.testcase.Testcase',
+        'clusterfuzz.binary_providers.V8Builder.download_build_data',
+        'clusterfuzz.binary_providers.V8Builder.checkout_source_by_sha',
+        'clusterfuzz.binary_providers.V8Builder.build_target',
+        'clusterfuzz.binary_providers.V8Builder.get_gn_args',
+        'clusterfuzz.revisions.sha_from_revision'])
+    self.testcases = {
+        '1': mock.Mock(id=1, build_url='https://builds/v8_100.zip',
+                       revision=100),
+        '2': mock.Mock(id=2, build_url='https://builds/v8_200.zip',
+                       revision=200)}
+    self.mock.get_testcase_info.side_effect = lambda i: i
+    self.mock.Testcase.side_effect = self.testcases.get
+    self.mock.ensure_goma.return_value = '/goma'
+    self.mock.get_gn_args.return_value = ['is_asan = true']
+    self.mock.sha_from_revision.side_effect = (
+        lambda revision, *_: 'sha%d' % revision)
+    self.mock.build_target.side_effect = self.build_target
+    self.mock.reproduce_crash.side_effect = self.reproduce_crash
+    self.binaries = {}
+
+  def build_target(self, builder):
+    common.make_directory(builder.build_directory)
+    with open(os.path.join(builder.build_directory, 'd8'), 'w') as f:
+      f.write(str(builder.revision))
+
+  def reproduce_crash(self, binary_path, current_testcase, **_):
+    with open(binary_path, 'r') as f:
+      self.binaries[current_testcase.id] = f.read()
+    return 1, 'output', 'match'
+
+  def test_binaries_kept(self):
+    """Tests that each testcase runs the binary of its own revision, although
+    all of them are built before any runs."""
+
+    reproduce_batch.execute(['1', '2'], None, False, False, 2, None)
+
+    self.assertEqual({1: '100', 2: '200'}, self.binaries)
+    index = out_dirs.OutDirIndex('/v8/src')
+    for name in index.out_dirs:
+      out_dir_lock = index.get_lock(name)
+      self.assertTrue(out_dir_lock.acquire(blocking=False))
+      out_dir_lock.release()
@@ -17,13 +17,86 @@ from __future__ import print_function
 
 import json
 import os
+import subprocess
+import sys
 import mock
 
+from clusterfuzz import cache
 from clusterfuzz import common
+from clusterfuzz import http_client
+from clusterfuzz import stack_analyzer
+from clusterfuzz import trace
 from clusterfuzz.commands import reproduce
 from test import helpers
 
 
+class ImportTest(helpers.ExtendedTestCase):
+  """Tests that the command imports what it only needs to reproduce
+  locally when it is used."""
+
+  def test_deferred_imports(self):
+    """Tests that the network and build modules aren't imported with the
+    command."""
+
+    modules = json.loads(subprocess.check_output([
+        sys.executable, '-c',
+        'import json, sys; import clusterfuzz.commands.reproduce; '
+        'print(json.dumps(sorted(sys.modules)))']))
+
+    for module in ['clusterfuzz.binary_providers', 'clusterfuzz.testcase',
+                   'clusterfuzz.http_client', 'httplib', 'urllib',
+                   'webbrowser']:
+      self.assertNotIn(module, modules)
+
+
+class ExecuteWithDaemonTest(helpers.ExtendedTestCase):
+  """Tests that execute submits reproductions to a running daemon."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.daemon.is_running',
+                         'clusterfuzz.daemon.submit',
+                         'clusterfuzz.commands.reproduce.reproduce'])
+    self.mock.is_running.return_value = True
+    self.mock.submit.return_value = 0
+
+  def test_submitted(self):
+    reproduce.execute('1234', False, True, runs=20, parallel=4)
+    self.assert_exact_calls(self.mock.submit, [mock.call('reproduce', {
+        'testcase_id': '1234', 'current': False, 'download': True,
+        'runs': 20, 'parallel': 4, 'timeout': None, 'cpu_timeout': None})])
+    self.assert_n_calls(0, [self.mock.reproduce])
+
+  def test_exit_code(self):
+    self.mock.submit.return_value = 3
+    with self.assertRaises(SystemExit) as cm:
+      reproduce.execute('1234', False, True)
+    self.assertEqual(cm.exception.code, 3)
+
+  def test_rejected(self):
+    """Tests that a job the daemon turns down runs here."""
+
+    self.mock.submit.return_value = None
+    reproduce.execute('1234', False, True, parallel=2)
+    self.assert_exact_calls(self.mock.reproduce, [
+        mock.call('1234', False, True, 1, 2, None, None)])
+
+  def test_no_daemon(self):
+    """Tests that the daemon isn't used when asked not to."""
+
+    reproduce.execute('1234', False, True, parallel=2, no_daemon=True)
+    self.assert_n_calls(0, [self.mock.submit])
+    self.assert_exact_calls(self.mock.reproduce, [
+        mock.call('1234', False, True, 1, 2, None, None)])
+
+  def test_offline(self):
+    """Tests that offline reproductions don't use the daemon."""
+
+    self.addCleanup(http_client.set_offline, False)
+    reproduce.execute('1234', False, True, parallel=2, offline=True)
+    self.assert_n_calls(0, [self.mock.submit])
+    self.assert_n_calls(1, [self.mock.reproduce])
+
+
 class ExecuteTest(helpers.ExtendedTestCase):
   """Test execute."""
 
@@ -36,7 +109,9 @@ class ExecuteTest(helpers.ExtendedTestCase):
         'clusterfuzz.commands.reproduce.ensure_goma',
         'clusterfuzz.binary_providers.V8DownloadedBinary',
         'clusterfuzz.binary_providers.V8Builder',
-        'clusterfuzz.commands.reproduce.reproduce_crash'])
+        'clusterfuzz.commands.reproduce.reproduce_crash',
+        'clusterfuzz.daemon.is_running'])
+    self.mock.is_running.return_value = False
     self.response = {
         'id': 1234,
         'crash_type': 'Bad Crash',
@@ -49,6 +124,7 @@ class ExecuteTest(helpers.ExtendedTestCase):
     self.mock.get_testcase_info.return_value = self.response
     self.mock.Testcase.return_value = self.testcase
     self.mock.ensure_goma.return_value = '/goma/dir'
+    self.mock.reproduce_crash.return_value = (0, 'output', 'match')
 
   def test_grab_data_with_download(self):
     """Ensures all method calls are made correctly when downloading."""
@@ -57,7 +133,8 @@ class ExecuteTest(helpers.ExtendedTestCase):
     reproduce.execute('1234', False, True)
 
     self.assert_exact_calls(self.mock.get_testcase_info, [mock.call('1234')])
-    self.assert_exact_calls(self.mock.ensure_goma, [mock.call()])
+    self.assert_n_calls(0, [self.mock.ensure_goma])
+    self.assert_exact_calls(self.testcase.get_testcase_path, [mock.call()])
     self.assert_exact_calls(self.mock.Testcase, [mock.call(self.response)])
     self.assert_exact_calls(
         self.mock.V8DownloadedBinary.return_value.get_binary_path,
@@ -65,7 +142,9 @@ class ExecuteTest(helpers.ExtendedTestCase):
     self.assert_exact_calls(self.mock.V8DownloadedBinary,
                             [mock.call(1234, 'chrome_build_url')])
     self.assert_exact_calls(self.mock.reproduce_crash,
-                            [mock.call('/path/to/binary', self.testcase)])
+                            [mock.call('/path/to/binary', self.testcase,
+                                       exit_on_error=False, timeout=None,
+                                       cpu_timeout=None)])
 
   def test_grab_data_no_download(self):
     """Ensures all method calls are made correctly when building locally."""
@@ -75,6 +154,7 @@ class ExecuteTest(helpers.ExtendedTestCase):
 
     self.assert_exact_calls(self.mock.get_testcase_info, [mock.call('1234')])
     self.assert_exact_calls(self.mock.ensure_goma, [mock.call()])
+    self.assert_exact_calls(self.testcase.get_testcase_path, [mock.call()])
     self.assert_exact_calls(self.mock.Testcase, [mock.call(self.response)])
     self.assert_exact_calls(
         self.mock.V8Builder.return_value.get_binary_path, [mock.call()])
@@ -82,17 +162,69 @@ class ExecuteTest(helpers.ExtendedTestCase):
                             [mock.call(1234, 'chrome_build_url', 123456,
                                        False, '/goma/dir', '/v8/src')])
     self.assert_exact_calls(self.mock.reproduce_crash,
-                            [mock.call('/path/to/binary', self.testcase)])
+                            [mock.call('/path/to/binary', self.testcase,
+                                       exit_on_error=False, timeout=None,
+                                       cpu_timeout=None)])
+    self.assert_exact_calls(self.mock.V8Builder.return_value.release,
+                            [mock.call()])
+
+  def test_released_on_failure(self):
+    """Ensures the binary is released when the reproduction fails."""
+    self.mock.reproduce_crash.side_effect = SystemExit(1)
+
+    with self.assertRaises(SystemExit):
+      reproduce.execute('1234', False, False)
+
+    self.assert_exact_calls(self.mock.V8Builder.return_value.release,
+                            [mock.call()])
+
+  def test_trace_file(self):
+    """Ensures the phases are traced and written out, even on failure."""
+    helpers.patch(self, ['clusterfuzz.trace.write_chrome_trace',
+                         'clusterfuzz.trace.print_summary'])
+    self.mock.reproduce_crash.side_effect = SystemExit(1)
+    trace.reset()
+
+    with self.assertRaises(SystemExit):
+      reproduce.execute('1234', False, True, trace_file='/tmp/trace.json')
+
+    self.assert_exact_calls(self.mock.write_chrome_trace,
+                            [mock.call('/tmp/trace.json')])
+    self.assert_exact_calls(self.mock.print_summary, [mock.call()])
+    self.assertEqual(
+        ['get_binary', 'get_testcase_info', 'get_testcase_path',
+         'reproduce_crash'],
+        sorted(s.name for s in trace.get_spans()))
+
+  def test_runs(self):
+    """Ensures flakiness is measured when running more than once."""
+    helpers.patch(self, ['clusterfuzz.commands.reproduce.measure_flakiness'])
+    self.mock.V8DownloadedBinary.return_value.get_binary_path.return_value = (
+        '/path/to/binary')
+
+    reproduce.execute('1234', False, True, runs=20, parallel=4)
+
+    self.assert_exact_calls(self.mock.measure_flakiness, [
+        mock.call('/path/to/binary', self.testcase, 20, 4, None, None)])
+    self.assert_n_calls(0, [self.mock.reproduce_crash])
+
+  def test_no_trace_file(self):
+    """Ensures nothing is written without a trace file."""
+    helpers.patch(self, ['clusterfuzz.trace.write_chrome_trace'])
+    reproduce.execute('1234', False, True)
+
+    self.assert_n_calls(0, [self.mock.write_chrome_trace])
 
 class GetTestcaseInfoTest(helpers.ExtendedTestCase):
   """Test get_testcase_info."""
 
   def setUp(self):
+    self.setup_fake_filesystem()
     helpers.patch(self, [
         'clusterfuzz.common.get_stored_auth_header',
         'clusterfuzz.common.store_auth_header',
         'clusterfuzz.commands.reproduce.get_verification_header',
-        'urlfetch.fetch'])
+        'clusterfuzz.http_client.fetch'])
 
   def test_correct_stored_authorization(self):
     """Ensures that the testcase info is returned when stored auth is correct"""
@@ -212,6 +344,69 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
             headers={'Authorization': 'VerificationCode 12345'},
             url=reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL % '12345')])
 
+class CachedTestcaseInfoTest(helpers.ExtendedTestCase):
+  """Tests the caching of get_testcase_info."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.send_request',
+        'time.time'])
+    self.mock.time.return_value = 1000
+    self.info = {'id': '12345', 'crash_type': 'Bad Crash'}
+    self.mock.send_request.return_value = mock.Mock(
+        status=200, body=json.dumps(self.info),
+        headers={'etag': '"v1"', 'last-modified': 'Mon, 01 Jan 2016'})
+    self.url = reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL % '12345'
+    self.addCleanup(http_client.set_offline, False)
+
+  def test_fresh(self):
+    """Tests that a fresh copy is used without any request."""
+
+    self.assertEqual(reproduce.get_testcase_info('12345'), self.info)
+    self.mock.time.return_value = 1000 + cache.DEFAULT_TESTCASE_INFO_TTL - 1
+    self.assertEqual(reproduce.get_testcase_info('12345'), self.info)
+    self.assert_exact_calls(self.mock.send_request, [mock.call(self.url, {})])
+
+  def test_revalidated(self):
+    """Tests that a stale copy is revalidated with a conditional request."""
+
+    reproduce.get_testcase_info('12345')
+    self.mock.time.return_value = 1000 + cache.DEFAULT_TESTCASE_INFO_TTL
+    self.mock.send_request.return_value = mock.Mock(status=304, headers={})
+
+    self.assertEqual(reproduce.get_testcase_info('12345'), self.info)
+    self.mock.send_request.assert_called_with(
+        self.url, {'If-None-Match': '"v1"',
+                   'If-Modified-Since': 'Mon, 01 Jan 2016'})
+    self.assertEqual(cache.TestcaseInfoCache().get('12345')['validated'],
+                     1000 + cache.DEFAULT_TESTCASE_INFO_TTL)
+
+  def test_changed(self):
+    """Tests that changed information replaces the cached copy."""
+
+    reproduce.get_testcase_info('12345')
+    self.mock.time.return_value = 1000 + cache.DEFAULT_TESTCASE_INFO_TTL
+    new_info = {'id': '12345', 'crash_type': 'Other Crash'}
+    self.mock.send_request.return_value = mock.Mock(
+        status=200, body=json.dumps(new_info), headers={})
+
+    self.assertEqual(reproduce.get_testcase_info('12345'), new_info)
+    self.assertEqual(cache.TestcaseInfoCache().get('12345')['info'], new_info)
+
+  def test_offline(self):
+    """Tests that offline, any cached copy is used and nothing is sent."""
+
+    reproduce.get_testcase_info('12345')
+    http_client.set_offline(True)
+    self.mock.time.return_value = 1000000
+
+    self.assertEqual(reproduce.get_testcase_info('12345'), self.info)
+    with self.assertRaises(common.OfflineError):
+      reproduce.get_testcase_info('67890')
+    self.assert_n_calls(1, [self.mock.send_request])
+
+
 class GetVerificationHeaderTest(helpers.ExtendedTestCase):
   """Tests the get_verification_header method"""
 
@@ -227,7 +422,7 @@ class GetVerificationHeaderTest(helpers.ExtendedTestCase):
     response = reproduce.get_verification_header()
 
     self.mock.open.assert_has_calls([mock.call(
-        reproduce.GOOGLE_OAUTH_URL,
+        reproduce.get_google_oauth_url(),
         new=1,
         autoraise=True)])
     self.assertEqual(response, 'VerificationCode 12345')
@@ -283,10 +478,37 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
     mocked_testcase = mock.Mock(id=1234, reproduction_args=args,
                                 environment=env)
     mocked_testcase.get_testcase_path.return_value = testcase_file
+    mocked_testcase.get_crash_signature.return_value = None
+    self.mock.execute.return_value = (1, 'output')
 
-    reproduce.reproduce_crash(source, mocked_testcase)
+    self.assertEqual((1, 'output', 'unknown'),
+                     reproduce.reproduce_crash(source, mocked_testcase))
     self.assert_exact_calls(self.mock.execute, [mock.call(
         '%s %s %s' % ('/chrome/source/folder/d8',
                       args, testcase_file),
         '/chrome/source/folder',
-        environment=env)])
+        print_output=True,
+        exit_on_error=True,
+        environment=env,
+        line_callback=None,
+        timeout=None,
+        cpu_timeout=None,
+        hang_timeout=reproduce.REPRODUCTION_HANG_TIMEOUT)])
+
+  def test_stop_on_verdict(self):
+    """Ensures the binary is stopped once the crash matches."""
+
+    mocked_testcase = mock.Mock(id=1234, reproduction_args='', environment={})
+    mocked_testcase.get_testcase_path.return_value = '/testcase.js'
+    mocked_testcase.get_crash_signature.return_value = (
+        stack_analyzer.Signature('SEGV', ('Foo',)))
+    def execute(*_, **kwargs):
+      callback = kwargs['line_callback']
+      self.assertFalse(callback('==1==ERROR: AddressSanitizer: SEGV on 0x0'))
+      self.assertTrue(callback('    #0 0x4a in Foo(int) foo.cc:1:2'))
+      return -9, 'output'
+    self.mock.execute.side_effect = execute
+
+    self.assertEqual(
+        (-9, 'output', 'match'),
+        reproduce.reproduce_crash('/d8', mocked_testcase, stop_on_verdict=True))
@@ -0,0 +1,67 @@
+"""Test the 'serve' command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from clusterfuzz.commands import serve
+from test import helpers
+
+
+class WarmGomaTest(helpers.ExtendedTestCase):
+  """Tests the WarmGoma class."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.commands.reproduce.ensure_goma',
+                         'time.time'])
+    self.mock.ensure_goma.return_value = '/goma'
+    self.mock.time.return_value = 1000
+
+  def test_started_once(self):
+    """Tests that goma is only checked again after the interval."""
+
+    goma = serve.WarmGoma()
+    self.assertEqual(goma.get_goma_dir(), '/goma')
+    self.mock.time.return_value += serve.GOMA_CHECK_INTERVAL
+    self.assertEqual(goma.get_goma_dir(), '/goma')
+    self.assert_n_calls(1, [self.mock.ensure_goma])
+
+    self.mock.time.return_value += 1
+    goma.get_goma_dir()
+    self.assert_n_calls(2, [self.mock.ensure_goma])
+
+
+class ReproduceCommandTest(helpers.ExtendedTestCase):
+  """Tests the make_reproduce_command method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.commands.reproduce.reproduce'])
+    self.goma = mock.Mock(spec=serve.WarmGoma)
+    self.goma.get_goma_dir.return_value = '/goma'
+    self.command = serve.make_reproduce_command(self.goma)
+
+  def test_build(self):
+    """Tests that builds use the goma started by the daemon."""
+
+    self.command('1234', False, False, 1, 4, None, None)
+    self.assert_exact_calls(self.mock.reproduce, [
+        mock.call('1234', False, False, 1, 4, None, None, goma_dir='/goma')])
+
+  def test_download(self):
+    """Tests that goma is left alone for downloaded builds."""
+
+    self.command('1234', False, True, 1, 4, 60, None)
+    self.assert_exact_calls(self.mock.reproduce, [
+        mock.call('1234', False, True, 1, 4, 60, None, goma_dir=None)])
+    self.assert_n_calls(0, [self.goma.get_goma_dir])
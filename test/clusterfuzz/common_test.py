@@ -16,7 +16,11 @@
 import cStringIO
 import subprocess
 import os
+import shutil
+import tempfile
 import stat
+import time
+import threading
 import mock
 
 from clusterfuzz import common
@@ -76,9 +80,12 @@ class ExecuteTest(helpers.ExtendedTestCase):
 
   def build_popen_mock(self, code):
     """Builds the mocked Popen object."""
-    return mock.MagicMock(
-        stdout=cStringIO.StringIO(self.lines),
-        returncode=code)
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, self.lines)
+    os.close(write_fd)
+    stdout = os.fdopen(read_fd, 'rb')
+    self.addCleanup(stdout.close)
+    return mock.MagicMock(stdout=stdout, returncode=code)
 
   def run_execute(self, print_out, exit_on_err):
     return common.execute(
@@ -111,7 +118,8 @@ class ExecuteTest(helpers.ExtendedTestCase):
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         cwd='~/working/directory',
-        env=None)])
+        env=None,
+        preexec_fn=None)])
 
   def test_process_runs_successfully(self):
     """Test execute when the process successfully runs."""
@@ -130,6 +138,232 @@ class ExecuteTest(helpers.ExtendedTestCase):
         self.run_popen_assertions(return_code, print_out, exit_on_error)
 
 
+  def test_output_file(self):
+    """Test that the full output is spilled to 'output_file'."""
+
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    output_file = os.path.join(temp_dir, 'output.log')
+    self.mock.Popen.return_value = self.build_popen_mock(0)
+
+    common.execute('cmd', '~/working/directory', output_file=output_file)
+
+    with open(output_file, 'r') as f:
+      self.assertEqual(f.read(), self.lines)
+
+
+class ExecuteLineCallbackTest(helpers.ExtendedTestCase):
+  """Tests the line_callback of execute, with real processes."""
+
+  def test_lines(self):
+    """Tests that lines are passed on whole, including the last one."""
+
+    lines = []
+    common.execute('printf "a\\nb\\nc"', '/', print_output=False,
+                   line_callback=lines.append)
+    self.assertEqual(['a', 'b', 'c'], lines)
+
+  def test_kill(self):
+    """Tests that the command and its children are killed."""
+
+    returncode, output = common.execute(
+        'echo stop; sleep 30 & sleep 30', '/', print_output=False,
+        exit_on_error=False, line_callback=lambda line: line == 'stop')
+    self.assertEqual(-9, returncode)
+    self.assertEqual('stop\n', output)
+
+  def test_interrupt(self):
+    """Tests that the process group is killed when execute is interrupted,
+    as it doesn't get the Ctrl-C of the terminal."""
+
+    pgids = []
+    def interrupt(line):
+      pgids.append(int(line))
+      raise KeyboardInterrupt()
+
+    with self.assertRaises(KeyboardInterrupt):
+      common.execute('echo $$; sleep 30 & sleep 30', '/', print_output=False,
+                     line_callback=interrupt, hang_timeout=30)
+    # Killed children are reaped by init, which may take a moment.
+    for _ in range(50):
+      try:
+        os.killpg(pgids[0], 0)
+      except OSError:
+        return
+      time.sleep(0.1)
+    self.fail('The process group is still running.')
+
+  def test_kill_running_commands(self):
+    """Tests that commands run by other threads are killed along with their
+    children."""
+
+    pgids = []
+    results = []
+    started = threading.Event()
+    def run():
+      results.append(common.execute(
+          'echo $$; sleep 30 & sleep 30', '/', print_output=False,
+          exit_on_error=False,
+          line_callback=lambda line: pgids.append(int(line)) or started.set(),
+          hang_timeout=30))
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait(10)
+
+    common.kill_running_commands()
+    thread.join(10)
+
+    self.assertEqual(-9, results[0][0])
+    for _ in range(50):
+      try:
+        os.killpg(pgids[0], 0)
+      except OSError:
+        return
+      time.sleep(0.1)
+    self.fail('The process group is still running.')
+
+
+class ExecuteLimitsTest(helpers.ExtendedTestCase):
+  """Tests the timeouts of execute, with real processes."""
+
+  def setUp(self):
+    for name, value in [('WATCHDOG_INTERVAL', 0.1),
+                        ('TERMINATION_GRACE_PERIOD', 0.5)]:
+      patcher = mock.patch.object(common, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def run_execute(self, command, **kwargs):
+    """Returns the status of the CommandTimeoutError raised, or None."""
+
+    try:
+      common.execute(command, '/', print_output=False, exit_on_error=False,
+                     **kwargs)
+    except common.CommandTimeoutError as e:
+      return e.status
+    return None
+
+  def test_timeout(self):
+    """Tests that a command running too long is stopped."""
+
+    self.assertEqual('timeout', self.run_execute('sleep 30', timeout=0.5))
+
+  def test_hang(self):
+    """Tests that a command without output or CPU use is stopped."""
+
+    self.assertEqual('hang', self.run_execute('sleep 30', hang_timeout=0.5))
+
+  def test_output_is_progress(self):
+    """Tests that a command printing regularly is not hung."""
+
+    self.assertIsNone(self.run_execute(
+        'for i in 1 2 3 4 5; do echo $i; sleep 0.2; done', hang_timeout=0.5))
+
+  def test_escalation(self):
+    """Tests that the group is killed if it ignores SIGTERM."""
+
+    self.assertEqual('timeout', self.run_execute(
+        'trap "" TERM; sleep 30 & sleep 30; wait', timeout=0.5))
+
+  def test_interactive_hang(self):
+    """Tests that an interactive command stays in the process group of this
+    process, and is still stopped along with its children."""
+
+    pgids = []
+    with self.assertRaises(common.CommandTimeoutError) as cm:
+      common.execute('ps -o pgid= $$; sleep 30 & sleep 30', '/',
+                     print_output=False, exit_on_error=False,
+                     line_callback=lambda line: pgids.append(int(line)),
+                     hang_timeout=0.5, interactive=True)
+    self.assertEqual('hang', cm.exception.status)
+    self.assertEqual([os.getpgrp()], pgids)
+
+  def test_cpu_timeout(self):
+    """Tests that a command using too much CPU is stopped."""
+
+    self.assertEqual('cpu_timeout', self.run_execute(
+        'while true; do :; done', cpu_timeout=1))
+
+
+class GetProcessGroupCpuTimeTest(helpers.ExtendedTestCase):
+  """Tests the get_process_group_cpu_time method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def write_stat(self, pid, name, pgid, times, ppid=1):
+    os.makedirs('/proc/%d' % pid)
+    with open('/proc/%d/stat' % pid, 'w') as f:
+      f.write('%d (%s) S %d %d %d 0 -1 0 0 0 0 0 %s 20 0 1 0\n' % (
+          pid, name, ppid, pgid, pgid, ' '.join(str(t) for t in times)))
+
+  def test_group(self):
+    """Tests that only the processes of the group are counted."""
+
+    self.write_stat(10, 'sh', 10, [1, 2, 3, 4])
+    self.write_stat(11, 'd8 (copy)', 10, [10, 20, 0, 0])
+    self.write_stat(12, 'other', 12, [100, 100, 100, 100])
+    os.makedirs('/proc/self')
+
+    self.assertEqual(40, common.get_process_group_cpu_time(10))
+
+  def test_tree(self):
+    """Tests that only pid and its descendants are counted, whatever their
+    group."""
+
+    self.write_stat(10, 'sh', 1, [1, 2, 3, 4], ppid=1)
+    self.write_stat(11, 'git', 1, [10, 20, 0, 0], ppid=10)
+    self.write_stat(12, 'git-remote-https', 1, [5, 0, 0, 0], ppid=11)
+    self.write_stat(13, 'other', 1, [100, 100, 100, 100], ppid=1)
+
+    self.assertEqual(45, common.get_process_tree_cpu_time(10))
+
+
+class OutputBufferTest(helpers.ExtendedTestCase):
+  """Tests the OutputBuffer class."""
+
+  def test_small_output(self):
+    """Tests that output within the limits is kept as is."""
+
+    output = common.OutputBuffer(head_size=10, tail_size=10)
+    output.write('abc\n')
+    output.write('def\n')
+    self.assertEqual(output.getvalue(), 'abc\ndef\n')
+
+  def test_truncated_output(self):
+    """Tests that only the head and the tail are kept."""
+
+    output = common.OutputBuffer(head_size=4, tail_size=6)
+    for line in ['aaa\n', 'bbb\n', 'ccc\n', 'ddd\n', 'eee\n']:
+      output.write(line)
+
+    self.assertEqual(
+        output.getvalue(),
+        'aaa\n' + common.OUTPUT_TRUNCATION_MESSAGE % 10 + 'd\neee\n')
+    self.assertEqual(output.total_length, 20)
+
+  def test_head_only(self):
+    """Tests that no tail is kept when its size is 0."""
+
+    output = common.OutputBuffer(head_size=4, tail_size=0)
+    output.write('abcdefgh')
+
+    self.assertEqual(output.getvalue(),
+                     'abcd' + common.OUTPUT_TRUNCATION_MESSAGE % 4)
+
+  def test_spill_file(self):
+    """Tests that the spill file receives everything."""
+
+    spill_file = cStringIO.StringIO()
+    output = common.OutputBuffer(head_size=1, tail_size=1,
+                                 spill_file=spill_file)
+    output.write('abc')
+    output.write('def')
+    self.assertEqual(spill_file.getvalue(), 'abcdef')
+    self.assertEqual(
+        output.getvalue(), 'a' + common.OUTPUT_TRUNCATION_MESSAGE % 4 + 'f')
+
+
 class StoreAuthHeaderTest(helpers.ExtendedTestCase):
   """Tests the store_auth_header method."""
 
@@ -233,3 +467,26 @@ class AskTest(helpers.ExtendedTestCase):
         mock.call('Initial Question: '),
         mock.call('Please answer correctly: ')])
     self.assertEqual(result, 'correct')
+
+  def test_not_interactive(self):
+    """Tests that nothing is asked when the process can't prompt."""
+
+    common.set_interactive(False)
+    self.addCleanup(common.set_interactive, True)
+    with self.assertRaises(common.NotInteractiveError):
+      common.ask('Initial Question', 'Please answer correctly', bool)
+    with self.assertRaises(common.NotInteractiveError):
+      common.confirm('A question')
+    self.assert_n_calls(0, [self.mock.raw_input])
+
+
+class GetCommandNameTest(helpers.ExtendedTestCase):
+  """Tests the get_command_name method."""
+
+  def test_name(self):
+    """Tests that variable assignments and arguments are left out."""
+
+    self.assertEqual('gyp_v8', common.get_command_name(
+        'GYP_DEFINES=asan=1 gypfiles/gyp_v8 --flag'))
+    self.assertEqual('wget', common.get_command_name(
+        'wget --header="Authorization: secret" url'))
@@ -0,0 +1,165 @@
+"""Test the 'daemon' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cStringIO
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+
+from clusterfuzz import common
+from clusterfuzz import daemon
+from clusterfuzz import output
+from clusterfuzz import scheduler
+from test import helpers
+
+
+class DaemonTest(helpers.ExtendedTestCase):
+  """Tests a daemon and its client over a real socket."""
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.socket_path = os.path.join(self.temp_dir, 'daemon.sock')
+    self.mock_os_environment({'CLUSTERFUZZ_DAEMON_SOCKET': self.socket_path})
+    self.addCleanup(setattr, sys, 'stdout', sys.stdout)
+    self.addCleanup(common.set_interactive, True)
+    self.release = threading.Event()
+    self.release.set()
+
+  def start(self, jobs=1):
+    """Starts a daemon with commands that print and exit."""
+
+    def echo(text, exit_code=0):
+      self.release.wait()
+      print text
+      # Output of the threads a job starts goes to its client too.
+      scheduler.run([scheduler.Task('echo', lambda: sys.stdout.write('!\n'))])
+      if exit_code:
+        sys.exit(exit_code)
+
+    def fail():
+      raise ValueError('broken')
+
+    def ask():
+      print 'Checking out...'
+      common.confirm('Proceed')
+
+    server = daemon.Daemon({'echo': echo, 'fail': fail, 'ask': ask}, jobs)
+    server.listen()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(thread.join)
+    self.addCleanup(server.stop)
+    return server
+
+  def submit(self, command, args):
+    """Returns the exit code and output of a job."""
+
+    stream = cStringIO.StringIO()
+    exit_code = daemon.submit(command, args, stream=stream)
+    return exit_code, stream.getvalue()
+
+  def test_not_running(self):
+    self.assertFalse(daemon.is_running())
+    with open(self.socket_path, 'w'):
+      pass
+    self.assertFalse(daemon.is_running())
+
+  def test_job(self):
+    """Tests that the output and exit code of a job are sent back."""
+
+    self.start()
+    self.assertTrue(daemon.is_running())
+    self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0600)
+
+    self.assertEqual(self.submit('echo', {'text': 'hello'}), (0, 'hello\n!\n'))
+    self.assertEqual(self.submit('echo', {'text': 'bye', 'exit_code': 3}),
+                     (3, 'bye\n!\n'))
+
+  def test_error(self):
+    """Tests that an exception fails the job, not the daemon."""
+
+    self.start()
+    exit_code, job_output = self.submit('fail', {})
+    self.assertEqual(exit_code, 1)
+    self.assertIn('ValueError: broken', job_output)
+    self.assertEqual(self.submit('echo', {'text': 'a'})[0], 0)
+
+  def test_rejected(self):
+    """Tests that jobs are turned down when they would run differently."""
+
+    self.start()
+    self.assertEqual(self.submit('unknown', {}),
+                     (None, 'Not using the daemon: unknown command unknown\n'))
+
+  def test_needs_terminal(self):
+    """Tests that jobs asking the user something are turned down, for the
+    client to run them."""
+
+    self.start()
+    self.assertEqual(self.submit('ask', {}), (
+        None, 'Checking out...\nNot using the daemon: it needs a terminal to'
+        ' ask "Proceed"\n'))
+
+  def test_environment_differs(self):
+    server = daemon.Daemon({'echo': None}, 1)
+    self.mock_os_environment({'V8_SRC': '/v8', 'CLUSTERFUZZ_NINJA_JOBS': '4'})
+    request = {'command': 'echo', 'environment': {'V8_SRC': '/v8'}}
+
+    self.assertEqual(server.get_rejection(request),
+                     'it was started with a different $CLUSTERFUZZ_NINJA_JOBS')
+    request['environment']['CLUSTERFUZZ_NINJA_JOBS'] = '4'
+    self.assertIsNone(server.get_rejection(request))
+
+  def test_queue(self):
+    """Tests that jobs beyond the concurrency limit wait in the queue."""
+
+    server = self.start(jobs=1)
+    self.release.clear()
+    results = {}
+    def submit(name):
+      results[name] = self.submit('echo', {'text': name})
+    first = threading.Thread(target=submit, args=('first',))
+    first.start()
+    while not server.running:
+      first.join(0.01)
+    second = threading.Thread(target=submit, args=('second',))
+    second.start()
+    while server.queue.empty():
+      second.join(0.01)
+
+    self.release.set()
+    first.join()
+    second.join()
+    self.assertEqual(results['first'], (0, 'first\n!\n'))
+    self.assertEqual(results['second'],
+                     (0, 'Waiting for 1 jobs to finish...\nsecond\n!\n'))
+
+  def test_already_running(self):
+    self.start()
+    with self.assertRaises(common.DaemonAlreadyRunningError):
+      daemon.Daemon({}, 1).listen()
+
+  def test_not_interactive(self):
+    """Tests that jobs can't prompt the user."""
+
+    self.start()
+    self.submit('echo', {'text': 'a'})
+    self.assertFalse(common.is_interactive())
+    self.assertIsInstance(sys.stdout, output.ThreadOutput)
@@ -0,0 +1,46 @@
+"""Test the 'elf' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from clusterfuzz import elf
+from test import helpers
+
+
+class GetNeededLibrariesTest(helpers.ExtendedTestCase):
+  """Tests the get_needed_libraries method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_dynamic_binary(self):
+    """Tests reading the libraries of a dynamically linked binary."""
+
+    self.fs.CreateFile('/build/d8', contents=helpers.build_elf(
+        ['libv8.so', 'libc++.so', 'libc.so.6']))
+    self.assertEqual(elf.get_needed_libraries('/build/d8'),
+                     ['libv8.so', 'libc++.so', 'libc.so.6'])
+
+  def test_static_binary(self):
+    """Tests a binary without DT_NEEDED entries."""
+
+    self.fs.CreateFile('/build/d8', contents=helpers.build_elf([]))
+    self.assertEqual(elf.get_needed_libraries('/build/d8'), [])
+
+  def test_not_elf(self):
+    """Tests that data files have no libraries."""
+
+    self.fs.CreateFile('/build/icudtl.dat', contents='icu data')
+    self.fs.CreateFile('/build/empty', contents='')
+    self.assertEqual(elf.get_needed_libraries('/build/icudtl.dat'), [])
+    self.assertEqual(elf.get_needed_libraries('/build/empty'), [])
@@ -0,0 +1,121 @@
+"""Tests the module for measuring how reliably a testcase reproduces."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import mock
+
+from clusterfuzz import flakiness
+from clusterfuzz import stack_analyzer
+from test import helpers
+
+
+class WilsonIntervalTest(helpers.ExtendedTestCase):
+  """Tests the wilson_interval method."""
+
+  def test_no_crashes(self):
+    """Tests that the interval is one-sided without crashes."""
+
+    lower, upper = flakiness.wilson_interval(0, 10)
+    self.assertEqual(0, lower)
+    self.assertAlmostEqual(0.2775, upper, places=4)
+
+  def test_half(self):
+    """Tests that the interval is centered on the observed rate."""
+
+    lower, upper = flakiness.wilson_interval(50, 100)
+    self.assertAlmostEqual(0.4038, lower, places=4)
+    self.assertAlmostEqual(0.5962, upper, places=4)
+
+  def test_no_runs(self):
+    """Tests that nothing is known without runs."""
+
+    self.assertEqual((0, 1), flakiness.wilson_interval(0, 0))
+
+
+class MeasureTest(helpers.ExtendedTestCase):
+  """Tests the measure method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.flakiness.run_once'])
+
+  def test_stops_early(self):
+    """Tests that a testcase that always crashes stops after a few runs."""
+
+    self.mock.run_once.side_effect = (
+        lambda index, command, env, signature, limits: flakiness.Run(
+            index, True, 'match', 1, 0.5))
+
+    runs = flakiness.measure('d8 testcase.js', {}, 100, 1)
+
+    self.assertEqual(9, len(runs))
+    self.assertTrue(flakiness.is_decided(runs))
+    self.assertFalse(flakiness.is_decided(runs[:-1]))
+
+  def test_max_runs(self):
+    """Tests that no more than max_runs are started."""
+
+    self.mock.run_once.side_effect = (
+        lambda index, command, env, signature, limits: flakiness.Run(
+            index, index % 2 == 0, 'unknown', 0, 0.5))
+
+    runs = flakiness.measure('d8 testcase.js', {}, 10, 3)
+
+    self.assertEqual(range(1, 11), sorted(r.index for r in runs))
+
+
+class RunOnceTest(helpers.ExtendedTestCase):
+  """Tests the run_once method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute'])
+    self.mock.execute.return_value = (1, 'output')
+
+  def test_run(self):
+    """Tests that each run has its own working directory."""
+
+    run = flakiness.run_once(3, 'd8 testcase.js', {'ASAN_OPTIONS': ''})
+
+    self.assertEqual((3, True, 'unknown', 1), run[:4])
+    working_directory = self.mock.execute.call_args[0][1]
+    self.assertFalse(os.path.exists(working_directory))
+    self.assert_exact_calls(self.mock.execute, [mock.call(
+        'd8 testcase.js', working_directory, print_output=False,
+        exit_on_error=False, environment={'ASAN_OPTIONS': ''},
+        line_callback=mock.ANY)])
+
+  def test_different_crash(self):
+    """Tests that a crash with another signature doesn't count."""
+
+    def execute(*_, **kwargs):
+      kwargs['line_callback']('==1==ERROR: AddressSanitizer: SEGV on address')
+      return 1, ''
+    self.mock.execute.side_effect = execute
+    signature = stack_analyzer.Signature('heap-use-after-free', ('Foo',))
+
+    run = flakiness.run_once(1, 'd8 testcase.js', {}, signature)
+
+    self.assertEqual((False, 'mismatch'), (run.crashed, run.verdict))
+
+
+class GetPercentileTest(helpers.ExtendedTestCase):
+  """Tests the get_percentile method."""
+
+  def test_percentile(self):
+    """Tests the nearest-rank percentile."""
+
+    values = [5, 1, 4, 2, 3]
+    self.assertEqual(3, flakiness.get_percentile(values, 50))
+    self.assertEqual(5, flakiness.get_percentile(values, 90))
+    self.assertEqual(1, flakiness.get_percentile(values, 0))
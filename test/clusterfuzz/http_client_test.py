@@ -0,0 +1,156 @@
+"""Test the 'http_client' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import socket
+import mock
+
+from clusterfuzz import common
+from clusterfuzz import http_client
+from clusterfuzz import trace
+from test import helpers
+
+
+class HttpSessionTest(helpers.ExtendedTestCase):
+  """Tests the HttpSession class against a local HTTP server."""
+
+  def setUp(self):
+    helpers.patch(self, ['time.sleep'])
+    self.server = helpers.start_http_server({'/info': '{"id": 1}'})
+    self.addCleanup(self.server.shutdown)
+    self.session = http_client.HttpSession()
+    self.addCleanup(self.session.close)
+    self.url = 'http://localhost:%d' % self.server.server_port
+    trace.reset()
+
+  def test_keep_alive(self):
+    """Tests that requests to a host reuse the same connection."""
+
+    for _ in range(3):
+      response = self.session.request('GET', self.url + '/info',
+                                      headers={'Authorization': 'Bearer 1'})
+      self.assertEqual(response.status, 200)
+      self.assertEqual(response.body, '{"id": 1}')
+
+    self.assertEqual(len(set(r[2] for r in self.server.requests)), 1)
+    self.assertEqual(self.server.requests[0][1]['Authorization'], 'Bearer 1')
+
+  def test_instrumented(self):
+    """Tests that requests are counted and traced."""
+
+    self.session.request('GET', self.url + '/info?secret=1')
+    self.session.request('GET', self.url + '/info')
+
+    self.assertEqual(self.session.request_count, 2)
+    self.assertGreater(self.session.total_latency, 0)
+    spans = [s for s in trace.get_spans() if s.category == 'http']
+    self.assertEqual([s.args for s in spans],
+                     [{'url': self.url + '/info', 'status': 200}] * 2)
+
+  def test_retry_server_error(self):
+    """Tests that 5xx responses are retried with backoff."""
+
+    self.server.routes['/flaky'] = [503, 500, 'ok']
+    response = self.session.request('GET', self.url + '/flaky')
+
+    self.assertEqual(response.body, 'ok')
+    self.assertEqual(len(self.server.requests), 3)
+    self.assert_exact_calls(self.mock.sleep, [mock.call(0.5), mock.call(1.0)])
+
+  def test_client_error_not_retried(self):
+    """Tests that 4xx responses are returned as is."""
+
+    response = self.session.request('GET', self.url + '/missing')
+    self.assertEqual(response.status, 404)
+    self.assertEqual(len(self.server.requests), 1)
+
+  def test_redirect(self):
+    """Tests that redirects on the same host keep the Authorization header."""
+
+    self.server.routes['/moved'] = (302, '/info')
+    response = self.session.request('GET', self.url + '/moved',
+                                    headers={'Authorization': 'Bearer 1'})
+
+    self.assertEqual(response.status, 200)
+    self.assertEqual(response.body, '{"id": 1}')
+    self.assertEqual([r[0] for r in self.server.requests], ['/moved', '/info'])
+    self.assertEqual(self.server.requests[1][1]['Authorization'], 'Bearer 1')
+
+  def test_redirect_other_host(self):
+    """Tests that the Authorization header isn't sent to another host."""
+
+    self.server.routes['/moved'] = (
+        302, 'http://127.0.0.1:%d/info' % self.server.server_port)
+    response = self.session.request('GET', self.url + '/moved',
+                                    headers={'Authorization': 'Bearer 1'})
+
+    self.assertEqual(response.body, '{"id": 1}')
+    self.assertEqual(self.server.requests[0][1]['Authorization'], 'Bearer 1')
+    self.assertNotIn('Authorization', self.server.requests[1][1])
+
+  def test_redirect_limit(self):
+    """Tests that a redirect loop is returned once the limit is reached."""
+
+    self.server.routes['/loop'] = (302, '/loop')
+    response = self.session.request('GET', self.url + '/loop')
+
+    self.assertEqual(response.status, 302)
+    self.assertEqual(len(self.server.requests), http_client.MAX_REDIRECTS + 1)
+
+  def test_connection_error(self):
+    """Tests that connection errors are raised once retries run out."""
+
+    session = http_client.HttpSession(max_retries=1)
+    with mock.patch('httplib.HTTPConnection.request',
+                    side_effect=socket.error('refused')):
+      with self.assertRaises(socket.error):
+        session.request('GET', self.url + '/info')
+    self.assertEqual(session.request_count, 2)
+
+
+class DownloadTest(helpers.ExtendedTestCase):
+  """Tests the download method."""
+
+  def setUp(self):
+    self.server = helpers.start_http_server({'/testcase': 'x' * 200000})
+    self.addCleanup(self.server.shutdown)
+    self.addCleanup(http_client.get_session().close)
+    self.url = 'http://localhost:%d' % self.server.server_port
+    self.setup_fake_filesystem()
+    self.fs.CreateDirectory('/testcases')
+
+  def test_download(self):
+    """Tests that the body is streamed to the file."""
+
+    http_client.download(self.url + '/testcase', '/testcases/testcase.js')
+    with open('/testcases/testcase.js', 'r') as f:
+      self.assertEqual(f.read(), 'x' * 200000)
+    self.assertEqual(os.listdir('/testcases'), ['testcase.js'])
+
+  def test_redirect(self):
+    """Tests that a redirected download is streamed to the file."""
+
+    self.server.routes['/moved'] = (302, '/testcase')
+    http_client.download(self.url + '/moved', '/testcases/testcase.js')
+    with open('/testcases/testcase.js', 'r') as f:
+      self.assertEqual(f.read(), 'x' * 200000)
+
+  def test_failure(self):
+    """Tests that nothing is left behind when the download fails."""
+
+    with self.assertRaises(common.HttpError) as cm:
+      http_client.download(self.url + '/missing', '/testcases/testcase.js')
+    self.assertEqual(cm.exception.status, 404)
+    self.assertEqual(os.listdir('/testcases'), [])
@@ -0,0 +1,79 @@
+"""Test the 'locks' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+from clusterfuzz import locks
+from test import helpers
+
+
+def try_lock(name, directory, result):
+  """Tries to take a lock without waiting, from another process."""
+
+  lock = locks.FileLock(name, directory)
+  acquired = lock.acquire(blocking=False)
+  result.put(acquired)
+  if acquired:
+    lock.release()
+
+
+class FileLockTest(helpers.ExtendedTestCase):
+  """Tests the FileLock class."""
+
+  def setUp(self):
+    # Record locks need real file descriptors.
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.directory = os.path.join(self.temp_dir, 'locks')
+
+  def try_lock_in_other_process(self, name):
+    result = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=try_lock, args=(name, self.directory, result))
+    process.start()
+    process.join()
+    return result.get()
+
+  def test_other_process_excluded(self):
+    """Tests that another process cannot take a held lock."""
+
+    with locks.FileLock('abc', self.directory):
+      self.assertFalse(self.try_lock_in_other_process('abc'))
+      self.assertTrue(self.try_lock_in_other_process('def'))
+    self.assertTrue(self.try_lock_in_other_process('abc'))
+    self.assertTrue(os.path.isfile(os.path.join(self.directory, 'abc.lock')))
+
+  def test_other_thread_excluded(self):
+    """Tests that another thread of the same process waits for the lock."""
+
+    events = []
+    lock = locks.FileLock('abc', self.directory)
+    lock.acquire()
+    def wait_for_lock():
+      with locks.FileLock('abc', self.directory):
+        events.append('acquired')
+    thread = threading.Thread(target=wait_for_lock)
+    thread.start()
+
+    self.assertFalse(locks.FileLock('abc', self.directory).acquire(
+        blocking=False))
+    events.append('released')
+    lock.release()
+    thread.join()
+    self.assertEqual(events, ['released', 'acquired'])
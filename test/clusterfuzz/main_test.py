@@ -25,7 +25,11 @@ class MainTest(unittest.TestCase):
 
   def setUp(self):
     helpers.patch(self, [
-        'clusterfuzz.commands.reproduce.execute'
+        'clusterfuzz.commands.reproduce.execute',
+        ('cache_execute', 'clusterfuzz.commands.cache.execute'),
+        ('build_log_execute', 'clusterfuzz.commands.build_log.execute'),
+        ('batch_execute', 'clusterfuzz.commands.reproduce_batch.execute'),
+        ('serve_execute', 'clusterfuzz.commands.serve.execute')
     ])
 
   def test_parse_reproduce(self):
@@ -34,7 +38,67 @@ class MainTest(unittest.TestCase):
     main.execute(['reproduce', '1234', '--current'])
     main.execute(['reproduce', '1234', '--download'])
     main.execute(['reproduce', '1234', '--current', '--download'])
+    main.execute(['reproduce', '1234', '--trace-file', '/tmp/trace.json'])
+    main.execute(['reproduce', '1234', '--runs', '20', '--parallel', '4'])
+    main.execute(['reproduce', '1234', '--download', '--offline'])
+    main.execute(['reproduce', '1234', '--no-daemon'])
 
     self.mock.execute.assert_has_calls(
-        [mock.call('1234', False, False), mock.call('1234', True, False),
-         mock.call('1234', False, True), mock.call('1234', True, True)])
+        [mock.call('1234', False, False, None, 1, None, None, None, False,
+                   False),
+         mock.call('1234', True, False, None, 1, None, None, None, False,
+                   False),
+         mock.call('1234', False, True, None, 1, None, None, None, False,
+                   False),
+         mock.call('1234', True, True, None, 1, None, None, None, False,
+                   False),
+         mock.call('1234', False, False, '/tmp/trace.json', 1, None, None,
+                   None, False, False),
+         mock.call('1234', False, False, None, 20, 4, None, None, False,
+                   False),
+         mock.call('1234', False, True, None, 1, None, None, None, True,
+                   False),
+         mock.call('1234', False, False, None, 1, None, None, None, False,
+                   True)])
+
+  def test_parse_reproduce_batch(self):
+    """Test parse reproduce-batch command."""
+    main.execute(['reproduce-batch', '1234', '5678'])
+    main.execute(['reproduce-batch', '-f', 'ids.txt', '--download', '-j', '4',
+                  '-o', 'results.json'])
+
+    self.mock.batch_execute.assert_has_calls(
+        [mock.call(testcase_ids=['1234', '5678'], ids_file=None,
+                   current=False, download=False, jobs=None, output=None,
+                   timeout=300, cpu_timeout=None),
+         mock.call(testcase_ids=[], ids_file='ids.txt', current=False,
+                   download=True, jobs=4, output='results.json', timeout=300,
+                   cpu_timeout=None)])
+
+  def test_parse_cache(self):
+    """Test parse cache command."""
+    main.execute(['cache', 'ls'])
+    main.execute(['cache', 'gc'])
+    main.execute(['cache', 'gc', '--quota', '20G'])
+
+    self.mock.cache_execute.assert_has_calls(
+        [mock.call(action='ls', quota=None),
+         mock.call(action='gc', quota=None),
+         mock.call(action='gc', quota='20G')])
+
+  def test_parse_serve(self):
+    """Test parse serve command."""
+    main.execute(['serve'])
+    main.execute(['serve', '-j', '4'])
+
+    self.mock.serve_execute.assert_has_calls(
+        [mock.call(None), mock.call(4)])
+
+  def test_parse_build_log(self):
+    """Test parse build-log command."""
+    main.execute(['build-log'])
+    main.execute(['build-log', 'out/a', 'out/b', '-n', '20'])
+
+    self.mock.build_log_execute.assert_has_calls(
+        [mock.call(build_directories=[], count=10),
+         mock.call(build_directories=['out/a', 'out/b'], count=20)])
@@ -0,0 +1,107 @@
+"""Test the 'manifest' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+from clusterfuzz import cache
+from clusterfuzz import manifest
+from test import helpers
+
+
+class ManifestTest(helpers.ExtendedTestCase):
+  """Tests creating and verifying manifests."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.directory = '/builds/abc'
+    self.fs.CreateFile('/builds/abc/d8', contents='fake d8')
+    self.fs.CreateFile('/builds/abc/lib/libv8.so', contents='fake lib')
+    cache.mark_complete(self.directory)
+
+  def write(self, name, contents):
+    with open(os.path.join(self.directory, name), 'w') as f:
+      f.write(contents)
+
+  def test_create(self):
+    """Tests that every file but the marker is listed."""
+
+    manifest.create(self.directory, jobs=2)
+
+    with open(manifest.get_path(self.directory), 'r') as f:
+      files = json.load(f)['files']
+    self.assertEqual(sorted(files), ['d8', 'lib/libv8.so'])
+    self.assertEqual(files['d8']['size'], 7)
+    self.assertEqual(files['d8']['sha1'],
+                     manifest.get_hash('/builds/abc/d8'))
+
+  def test_intact(self):
+    manifest.create(self.directory)
+    self.write('extra', 'not listed')
+    self.assertEqual(manifest.verify(self.directory), [])
+    self.assertEqual(manifest.verify(self.directory, full=True, jobs=2), [])
+
+  def test_missing_manifest(self):
+    self.assertEqual(manifest.verify(self.directory), ['no manifest'])
+
+  def test_truncated(self):
+    """Tests that the stat pass finds a truncated file."""
+
+    manifest.create(self.directory)
+    self.write('d8', 'fake')
+    self.assertEqual(manifest.verify(self.directory),
+                     ['d8 has 4 bytes instead of 7'])
+
+  def test_missing_file(self):
+    manifest.create(self.directory)
+    os.remove('/builds/abc/lib/libv8.so')
+    self.assertEqual(manifest.verify(self.directory),
+                     ['lib/libv8.so is missing'])
+
+  def test_modified(self):
+    """Tests that only the hash pass finds a file of the same size that
+    changed."""
+
+    manifest.create(self.directory)
+    self.write('d8', 'fake d9')
+    self.assertEqual(manifest.verify(self.directory), [])
+    self.assertEqual(manifest.verify(self.directory, full=True, jobs=2),
+                     ['d8 has the wrong hash'])
+
+
+class IsIntactTest(helpers.ExtendedTestCase):
+  """Tests the is_intact method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.fs.CreateFile('/testcases/1_testcase/testcase.js', contents='abc')
+    manifest.create('/testcases/1_testcase')
+    with open('/testcases/1_testcase/testcase.js', 'w') as f:
+      f.write('abd')
+
+  def test_modes(self):
+    """Tests that the check is chosen by $CLUSTERFUZZ_VERIFY_CACHE."""
+
+    self.assertTrue(manifest.is_intact('/testcases/1_testcase'))
+    self.mock_os_environment({'CLUSTERFUZZ_VERIFY_CACHE': 'hash'})
+    self.assertFalse(manifest.is_intact('/testcases/1_testcase'))
+    self.mock_os_environment({'CLUSTERFUZZ_VERIFY_CACHE': 'off'})
+    os.remove(manifest.get_path('/testcases/1_testcase'))
+    self.assertTrue(manifest.is_intact('/testcases/1_testcase'))
+
+  def test_invalid_mode(self):
+    self.mock_os_environment({'CLUSTERFUZZ_VERIFY_CACHE': 'full'})
+    with self.assertRaises(ValueError):
+      manifest.is_intact('/testcases/1_testcase')
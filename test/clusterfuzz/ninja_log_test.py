@@ -0,0 +1,105 @@
+"""Test the 'ninja_log' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cStringIO
+import os
+import mock
+
+from clusterfuzz import common
+from clusterfuzz import ninja_log
+from test import helpers
+
+# Two builds: a full one, then an incremental one that rebuilt a.o and d8.
+NINJA_LOG = '\n'.join([
+    '# ninja log v5',
+    '0\t1000\t0\tobj/a.o\taaaa',
+    '0\t3000\t0\tobj/b.o\tbbbb',
+    '3000\t4000\t0\tgen/c.h\tcccc',
+    '3000\t4000\t0\tgen/c.cc\tcccc',
+    '4000\t9000\t0\td8\tdddd',
+    '500\t1000\t0\tgen/x.h\tffff',
+    '0\t2000\t0\tobj/a.o\teeee',
+    '2000\t6000\t0\td8\tdddd',
+    ''])
+
+
+class BuildSummaryTest(helpers.ExtendedTestCase):
+  """Tests the BuildSummary class."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.build_directory = '/v8/src/out/clusterfuzz_abc'
+    self.fs.CreateFile(
+        os.path.join(self.build_directory, ninja_log.NINJA_LOG_FILE),
+        contents=NINJA_LOG)
+
+  def test_last_build(self):
+    """Tests that only the last build is summarized."""
+
+    summary = ninja_log.BuildSummary(self.build_directory)
+    self.assertEqual([e.outputs for e in summary.edges],
+                     [['gen/x.h'], ['obj/a.o'], ['d8']])
+    self.assertEqual(summary.wall_time, 6.0)
+    self.assertEqual(summary.total_time, 6.5)
+    self.assertEqual(summary.known_outputs, 6)
+    self.assertEqual(summary.rebuilt_outputs, 3)
+    self.assertEqual(summary.reuse_ratio, 0.5)
+
+  def test_slowest(self):
+    """Tests that edges are sorted by duration."""
+
+    summary = ninja_log.BuildSummary(self.build_directory)
+    self.assertEqual([e.outputs[0] for e in summary.get_slowest(2)],
+                     ['d8', 'obj/a.o'])
+
+  def test_critical_path(self):
+    """Tests that the critical path follows the timeline back."""
+
+    edges = ninja_log.get_edges(ninja_log.split_builds(
+        ninja_log.read_entries(os.path.join(self.build_directory,
+                                            ninja_log.NINJA_LOG_FILE)))[0])
+    self.assertEqual([e.outputs for e in ninja_log.get_critical_path(edges)],
+                     [['obj/b.o'], ['gen/c.h', 'gen/c.cc'], ['d8']])
+
+  def test_instant_edges(self):
+    """Tests edges that took no time."""
+
+    edges = [ninja_log.Edge(1.0, 1.0, ['a']), ninja_log.Edge(1.0, 1.0, ['b'])]
+    self.assertEqual(len(ninja_log.get_critical_path(edges)), 2)
+
+  def test_no_log(self):
+    """Tests an out directory that was never built."""
+
+    summary = ninja_log.BuildSummary('/v8/src/out/empty')
+    self.assertEqual(summary.edges, [])
+    with mock.patch('sys.stdout', new_callable=cStringIO.StringIO) as stdout:
+      summary.print_summary()
+    self.assertIn('Nothing was built', stdout.getvalue())
+
+  def test_print_summary(self):
+    """Tests that the summary names the slowest edges."""
+
+    with mock.patch('sys.stdout', new_callable=cStringIO.StringIO) as stdout:
+      ninja_log.BuildSummary(self.build_directory).print_summary(1)
+    self.assertIn('3 edges in 6.0s', stdout.getvalue())
+    self.assertIn('3 of 6 known outputs up to date (50%)', stdout.getvalue())
+    self.assertIn('... 1 earlier edges', stdout.getvalue())
+
+  def test_unsupported_version(self):
+    """Tests that unknown log formats are rejected."""
+
+    self.fs.CreateFile('/old/.ninja_log', contents='# ninja log v4\n')
+    with self.assertRaises(common.NinjaLogError):
+      ninja_log.BuildSummary('/old')
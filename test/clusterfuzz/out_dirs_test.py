@@ -0,0 +1,105 @@
+"""Test the 'out_dirs' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from clusterfuzz import out_dirs
+from test import helpers
+
+
+class GetArgsKeyTest(helpers.ExtendedTestCase):
+  """Tests the get_args_key method."""
+
+  def test_formatting_ignored(self):
+    """Tests that comments, spacing and order don't change the key."""
+
+    self.assertEqual(
+        out_dirs.get_args_key(['is_asan = true', 'is_debug = false']),
+        out_dirs.get_args_key(['# Build arguments', 'is_debug=false', '',
+                               'is_asan  =  true  # ASan']))
+
+  def test_different_args(self):
+    """Tests that different configurations have different keys."""
+
+    self.assertNotEqual(out_dirs.get_args_key(['is_asan = true']),
+                        out_dirs.get_args_key(['is_asan = false']))
+
+
+class OutDirIndexTest(helpers.ExtendedTestCase):
+  """Tests the OutDirIndex class."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.index = out_dirs.OutDirIndex('/v8/src')
+
+  def add_out_dir(self, name, sha, revision, args_key):
+    os.makedirs(self.index.out_dir_path(name))
+    self.index.record(name, sha, revision, args_key)
+
+  def test_new_configuration(self):
+    """Tests that a configuration never built gets its own out directory."""
+
+    self.add_out_dir('clusterfuzz_other', 'sha', 10, 'other')
+    self.assertEqual(self.index.find('sha', 10, 'args'), 'clusterfuzz_args')
+
+  def test_same_sha(self):
+    """Tests that an out directory at the same sha is preferred."""
+
+    self.add_out_dir('a', 'sha1', 10, 'args')
+    self.add_out_dir('b', 'sha2', 20, 'args')
+    self.assertEqual(self.index.find('sha1', 19, 'args'), 'a')
+
+  def test_nearest_revision(self):
+    """Tests that the nearest revision is reused for a new sha."""
+
+    self.add_out_dir('a', 'sha1', 10, 'args')
+    self.add_out_dir('b', 'sha2', 20, 'args')
+    self.assertEqual(self.index.find('sha3', 16, 'args'), 'b')
+
+  def test_deleted_out_dir(self):
+    """Tests that out directories deleted from disk are ignored."""
+
+    self.add_out_dir('a', 'sha1', 10, 'args')
+    os.rmdir(self.index.out_dir_path('a'))
+    self.assertEqual(self.index.find('sha1', 10, 'args'), 'clusterfuzz_args')
+
+  def test_persisted(self):
+    """Tests that the index is read back from disk."""
+
+    self.add_out_dir('a', 'sha1', 10, 'args')
+    self.index.remove('a')
+    self.add_out_dir('b', 'sha2', 20, 'args')
+    index = out_dirs.OutDirIndex('/v8/src')
+    self.assertIsNone(index.get('a'))
+    self.assertEqual(index.get('b')['sha'], 'sha2')
+
+
+class FingerprintsTest(helpers.ExtendedTestCase):
+  """Tests the Fingerprints class."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_update(self):
+    """Tests that fingerprints are stored in the directory."""
+
+    fingerprint = out_dirs.get_fingerprint('deps', 'sha')
+    out_dirs.Fingerprints('/v8/src/out').update('gyp_v8', fingerprint)
+
+    fingerprints = out_dirs.Fingerprints('/v8/src/out')
+    self.assertTrue(fingerprints.is_current('gyp_v8', fingerprint))
+    self.assertFalse(fingerprints.is_current(
+        'gyp_v8', out_dirs.get_fingerprint('deps', 'other_sha')))
+    self.assertFalse(fingerprints.is_current('gn_gen', fingerprint))
@@ -0,0 +1,60 @@
+"""Test the 'output' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cStringIO
+import threading
+
+from clusterfuzz import output
+from test import helpers
+
+
+class ThreadOutputTest(helpers.ExtendedTestCase):
+  """Tests the ThreadOutput class."""
+
+  def setUp(self):
+    self.default = cStringIO.StringIO()
+    self.stdout = output.ThreadOutput(self.default)
+    self.addCleanup(output.set_stream, None)
+
+  def test_default(self):
+    self.stdout.write('a')
+    self.assertEqual(self.default.getvalue(), 'a')
+
+  def test_thread_stream(self):
+    """Tests that each thread writes to its own stream, and that threads
+    started with propagate inherit it."""
+
+    streams = [cStringIO.StringIO(), cStringIO.StringIO()]
+    def job(stream, text):
+      output.set_stream(stream)
+      self.stdout.write(text)
+      child = threading.Thread(
+          target=output.propagate(lambda: self.stdout.write(text.upper())))
+      child.start()
+      child.join()
+      unrelated = threading.Thread(target=lambda: self.stdout.write('-'))
+      unrelated.start()
+      unrelated.join()
+
+    threads = [threading.Thread(target=job, args=(streams[0], 'a')),
+               threading.Thread(target=job, args=(streams[1], 'b'))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(streams[0].getvalue(), 'aA')
+    self.assertEqual(streams[1].getvalue(), 'bB')
+    self.assertEqual(self.default.getvalue(), '--')
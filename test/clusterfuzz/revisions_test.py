@@ -0,0 +1,182 @@
+"""Test the 'revisions' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cStringIO
+import json
+import os
+import mock
+
+from clusterfuzz import revisions
+from test import helpers
+
+
+class BuildRevisionToShaUrlTest(helpers.ExtendedTestCase):
+  """Tests the build_revision_to_sha_url method."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.http_client.fetch'])
+
+  def test_correct_url_building(self):
+    """Tests if the SHA url is built correctly"""
+
+    result = revisions.build_revision_to_sha_url(12345, 'v8/v8')
+    self.assertEqual(result, ('https://cr-rev.appspot.com/_ah/api/crrev/v1'
+                              '/get_numbering?project=chromium&repo=v8%2Fv8'
+                              '&number=12345&numbering_type='
+                              'COMMIT_POSITION&numbering_identifier=refs'
+                              '%2Fheads%2Fmaster'))
+
+
+class FetchShaFromRevisionTest(helpers.ExtendedTestCase):
+  """Tests the fetch_sha_from_revision method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.http_client.fetch'])
+
+  def test_get_sha_from_response_body(self):
+    """Tests to ensure that the sha is grabbed from the response correctly"""
+
+    self.mock.fetch.return_value = mock.Mock(body=json.dumps({
+        'id': 12345,
+        'git_sha': '1a2s3d4f',
+        'crash_type': 'Bad Crash'}))
+
+    result = revisions.fetch_sha_from_revision(123456, 'v8/v8')
+    self.assertEqual(result, '1a2s3d4f')
+
+
+class UpdateJsonTest(helpers.ExtendedTestCase):
+  """Tests the update_json method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_keeps_concurrent_changes(self):
+    """Tests that the file is reloaded before it is changed, and replaced
+    without leaving temporary files behind."""
+
+    cache = revisions.RevisionCache('/cache/revisions.json')
+    revisions.RevisionCache('/cache/revisions.json').set('v8/v8', 1, 'sha1')
+    cache.set('v8/v8', 2, 'sha2')
+
+    self.assertEqual({'v8/v8': {'1': 'sha1', '2': 'sha2'}},
+                     revisions.load_json('/cache/revisions.json', {}))
+    self.assertEqual(['revisions.json'], os.listdir('/cache'))
+
+
+class ShaFromRevisionTest(helpers.ExtendedTestCase):
+  """Tests the sha_from_revision method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.revisions.fetch_sha_from_revision',
+        'clusterfuzz.revisions.CommitPositionIndex.update'])
+    self.mock.fetch_sha_from_revision.return_value = '1a2s3d4f'
+
+  def test_memoized(self):
+    """Tests that cr-rev is only asked once per revision."""
+
+    self.assertEqual(revisions.sha_from_revision(123, 'v8/v8'), '1a2s3d4f')
+    self.assertEqual(revisions.sha_from_revision(123, 'v8/v8'), '1a2s3d4f')
+
+    self.assert_exact_calls(self.mock.fetch_sha_from_revision, [
+        mock.call(123, 'v8/v8')])
+    self.assertEqual(revisions.RevisionCache().get('v8/v8', 123), '1a2s3d4f')
+    self.assertEqual(revisions.RevisionCache().get('chromium/src', 123), None)
+
+  def test_local_checkout(self):
+    """Tests that the local checkout is used before cr-rev."""
+
+    self.fs.CreateDirectory('/v8/src')
+    index = revisions.CommitPositionIndex('/v8/src')
+    index.positions['123'] = 'localsha'
+    revisions.save_json(index.path, {'head': 'head',
+                                     'positions': index.positions})
+
+    self.assertEqual(revisions.sha_from_revision(123, 'v8/v8', '/v8/src'),
+                     'localsha')
+    self.assert_n_calls(0, [self.mock.fetch_sha_from_revision])
+    self.assert_n_calls(1, [self.mock.update])
+
+  def test_missing_from_local_checkout(self):
+    """Tests falling back to cr-rev when the checkout lacks the revision."""
+
+    self.fs.CreateDirectory('/v8/src')
+    self.assertEqual(revisions.sha_from_revision(123, 'v8/v8', '/v8/src'),
+                     '1a2s3d4f')
+    self.assert_n_calls(1, [self.mock.fetch_sha_from_revision])
+
+
+class CommitPositionIndexTest(helpers.ExtendedTestCase):
+  """Tests the CommitPositionIndex class."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['clusterfuzz.common.execute', 'subprocess.Popen'])
+    self.log = ('commit:bbbb\nSecond\n\n'
+                'Cr-Commit-Position: refs/heads/master@{#2}\n'
+                'commit:cccc\nBranch commit\n\n'
+                'Cr-Commit-Position: refs/branch-heads/5.0@{#1}\n'
+                'commit:aaaa\nFirst\n\n'
+                'Cr-Commit-Position: refs/heads/master@{#1}\n')
+
+  def build_popen_mock(self, log, returncode=0):
+    proc = mock.Mock(stdout=cStringIO.StringIO(log),
+                     stderr=cStringIO.StringIO(''))
+    proc.wait.return_value = returncode
+    return proc
+
+  def test_build_and_update(self):
+    """Tests building the index and then updating it incrementally."""
+
+    self.mock.execute.return_value = (0, 'bbbb\n')
+    self.mock.Popen.return_value = self.build_popen_mock(self.log)
+    index = revisions.CommitPositionIndex('/v8/src')
+    index.update()
+
+    self.assertEqual(index.get(1), 'aaaa')
+    self.assertEqual(index.get(2), 'bbbb')
+    self.assertEqual(len(index.positions), 2)
+
+    self.mock.execute.return_value = (0, 'dddd\n')
+    self.mock.Popen.return_value = self.build_popen_mock(
+        'commit:dddd\nThird\nCr-Commit-Position: refs/heads/master@{#3}\n')
+    index = revisions.CommitPositionIndex('/v8/src')
+    index.update()
+
+    self.assertEqual(index.get(3), 'dddd')
+    self.assertEqual(index.get(1), 'aaaa')
+    self.assertEqual(self.mock.Popen.call_args_list[-1][0][0][-1],
+                     'bbbb..dddd')
+
+  def test_unchanged(self):
+    """Tests that git log is not run when nothing changed."""
+
+    revisions.save_json(revisions.CommitPositionIndex('/v8/src').path,
+                        {'head': 'bbbb', 'positions': {'2': 'bbbb'}})
+    self.mock.execute.return_value = (0, 'bbbb\n')
+    revisions.CommitPositionIndex('/v8/src').update()
+    self.assert_n_calls(0, [self.mock.Popen])
+
+  def test_not_a_checkout(self):
+    """Tests that nothing is indexed when git fails."""
+
+    self.mock.execute.return_value = (128, 'fatal: not a git repository')
+    index = revisions.CommitPositionIndex('/v8/src')
+    index.update()
+    self.assertEqual(index.positions, {})
+    self.assert_n_calls(0, [self.mock.Popen])
@@ -0,0 +1,80 @@
+"""Tests the module for running dependent steps concurrently."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+from clusterfuzz import scheduler
+from test import helpers
+
+
+class RunTest(helpers.ExtendedTestCase):
+  """Tests the run method."""
+
+  def test_dependencies(self):
+    """Tests that results are passed on to the tasks that need them."""
+
+    results = scheduler.run([
+        scheduler.Task('total', lambda a, b: a + b, ['a', 'b']),
+        scheduler.Task('a', lambda: 1),
+        scheduler.Task('b', lambda a: a + 1, ['a'])])
+
+    self.assertEqual({'a': 1, 'b': 2, 'total': 3}, results)
+
+  def test_concurrent(self):
+    """Tests that independent tasks run at the same time."""
+
+    # Each task waits for the other, so this only finishes if both run at
+    # once.
+    barrier = [threading.Event(), threading.Event()]
+    def task(i):
+      barrier[i].set()
+      return barrier[1 - i].wait(5)
+
+    results = scheduler.run([scheduler.Task('a', lambda: task(0)),
+                             scheduler.Task('b', lambda: task(1))])
+
+    self.assertEqual({'a': True, 'b': True}, results)
+
+  def test_error(self):
+    """Tests that errors are re-raised and stop dependent tasks."""
+
+    dependent_calls = []
+    def fail():
+      raise SystemExit(1)
+
+    with self.assertRaises(SystemExit):
+      scheduler.run([
+          scheduler.Task('fail', fail),
+          scheduler.Task('dependent', lambda fail: dependent_calls.append(1),
+                         ['fail'])])
+    self.assertEqual([], dependent_calls)
+
+  def test_interrupt(self):
+    """Tests that the commands run by tasks are killed on Ctrl-C, which
+    only the main thread gets."""
+
+    helpers.patch(self, ['clusterfuzz.common.kill_running_commands',
+                         'clusterfuzz.scheduler.wait'])
+    self.mock.wait.side_effect = KeyboardInterrupt()
+
+    with self.assertRaises(KeyboardInterrupt):
+      scheduler.run([scheduler.Task('a', lambda: None)])
+    self.assert_n_calls(1, [self.mock.kill_running_commands])
+
+  def test_unknown_dependency(self):
+    """Tests that tasks that can never run are reported."""
+
+    with self.assertRaises(ValueError):
+      scheduler.run([scheduler.Task('a', lambda b: b, ['b'])])
@@ -0,0 +1,147 @@
+"""Test the 'sliced_download' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from clusterfuzz import common
+from clusterfuzz import http_client
+from clusterfuzz import sliced_download
+from test import helpers
+
+
+class GetSlicesTest(helpers.ExtendedTestCase):
+  """Tests the get_slices method."""
+
+  def test_slices(self):
+    self.assertEqual(sliced_download.get_slices(250, 100),
+                     [(0, 99), (100, 199), (200, 249)])
+    self.assertEqual(sliced_download.get_slices(200, 100),
+                     [(0, 99), (100, 199)])
+    self.assertEqual(sliced_download.get_slices(0, 100), [])
+
+
+class GetExpectedMd5Test(helpers.ExtendedTestCase):
+  """Tests the get_expected_md5 method."""
+
+  def test_goog_hash(self):
+    self.assertEqual(sliced_download.get_expected_md5(
+        {'x-goog-hash': 'crc32c=n03x6A==, md5=1B2M2Y8AsgTpgAmY7PhCfg=='}),
+                     'd41d8cd98f00b204e9800998ecf8427e')
+
+  def test_content_md5(self):
+    self.assertEqual(sliced_download.get_expected_md5(
+        {'content-md5': '1B2M2Y8AsgTpgAmY7PhCfg=='}),
+                     'd41d8cd98f00b204e9800998ecf8427e')
+
+  def test_composite_object(self):
+    self.assertIsNone(sliced_download.get_expected_md5(
+        {'x-goog-hash': 'crc32c=n03x6A=='}))
+
+
+class DownloadTest(helpers.ExtendedTestCase):
+  """Tests the download method against a local range-serving server."""
+
+  def setUp(self):
+    self.body = os.urandom(1000)
+    self.server = helpers.start_http_server({'/abc.zip': self.body})
+    self.addCleanup(self.server.shutdown)
+    self.addCleanup(http_client.get_session().close)
+    self.url = 'http://localhost:%d/abc.zip' % self.server.server_port
+    # Slices are written through separate file objects, which a fake
+    # filesystem doesn't share contents between.
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+    self.path = os.path.join(self.directory, 'abc.zip')
+
+  def download(self):
+    return sliced_download.download(self.url, self.path, jobs=4,
+                                    slice_size=100, min_size=0)
+
+  def get_ranges(self):
+    return [r[1].get('Range') for r in self.server.requests
+            if r[1].get('Range')]
+
+  def write_state(self, done, etag=None):
+    """Records that the slices in 'done' were fetched before."""
+
+    etag = etag or '"%s"' % hashlib.md5(self.body).hexdigest()
+    with open(self.path + sliced_download.STATE_SUFFIX, 'w') as f:
+      json.dump({'identity': {'url': self.url, 'size': len(self.body),
+                              'etag': etag},
+                 'done': done}, f)
+
+  def assert_downloaded(self):
+    with open(self.path, 'rb') as f:
+      self.assertEqual(f.read(), self.body)
+    self.assertEqual(os.listdir(self.directory), ['abc.zip'])
+
+  def test_sliced(self):
+    """Tests that every slice is fetched and written at its offset."""
+
+    self.assertEqual(self.download(), self.path)
+
+    self.assert_downloaded()
+    self.assertEqual(sorted(self.get_ranges()), sorted(
+        'bytes=%d-%d' % (start, start + 99) for start in range(0, 1000, 100)))
+
+  def test_small_object(self):
+    """Tests that objects below the minimum size are fetched whole."""
+
+    sliced_download.download(self.url, self.path, jobs=4, slice_size=100,
+                             min_size=2000)
+
+    self.assert_downloaded()
+    self.assertEqual(self.get_ranges(), [])
+
+  def test_resume(self):
+    """Tests that the slices of an interrupted download are not fetched
+    again."""
+
+    with open(self.path + sliced_download.PARTIAL_SUFFIX, 'wb') as f:
+      f.write(self.body[:500] + '\0' * 500)
+    self.write_state([0, 1, 2, 3, 4])
+
+    self.download()
+
+    self.assert_downloaded()
+    self.assertEqual(sorted(self.get_ranges()), sorted(
+        'bytes=%d-%d' % (start, start + 99) for start in range(500, 1000, 100)))
+
+  def test_object_changed(self):
+    """Tests that the slices of another version of the object are ignored."""
+
+    with open(self.path + sliced_download.PARTIAL_SUFFIX, 'wb') as f:
+      f.write('\0' * 1000)
+    self.write_state(range(10), etag='"old"')
+
+    self.download()
+
+    self.assert_downloaded()
+    self.assertEqual(len(self.get_ranges()), 10)
+
+  def test_checksum_mismatch(self):
+    """Tests that a corrupt download is removed and reported."""
+
+    with open(self.path + sliced_download.PARTIAL_SUFFIX, 'wb') as f:
+      f.write('\0' * 1000)
+    self.write_state([0])
+
+    with self.assertRaises(common.BuildDownloadError):
+      self.download()
+    self.assertEqual(os.listdir(self.directory), [])
@@ -0,0 +1,131 @@
+"""Tests the module for comparing sanitizer crash reports."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from clusterfuzz import stack_analyzer
+from test import helpers
+
+REPORT = [
+    'Some output',
+    '=================================================================',
+    '==1234==ERROR: AddressSanitizer: heap-use-after-free on address 0x6 at',
+    'READ of size 8 at 0x6 thread T0',
+    '    #0 0x7f1 in __asan_memcpy /asan/asan_interceptors.cc:413',
+    '    #1 0x7f2 in v8::internal::Heap::Scavenge(int, bool) src/heap.cc:3:1',
+    '    #2 0x7f3 in (/lib/x86_64-linux-gnu/libc.so.6+0x2082f)',
+    '    #3 0x7f4 in v8::(anonymous namespace)::Run() src/d8.cc:12',
+    '    #4 0x7f5 in main src/d8.cc:30:5',
+    '',
+    '0x6 is located 0 bytes inside of 8-byte region',
+    'freed by thread T0 here:',
+    '    #0 0x7f9 in free /asan/asan_malloc_linux.cc:38']
+SIGNATURE = stack_analyzer.Signature(
+    'heap-use-after-free',
+    ('v8::internal::Heap::Scavenge', 'v8::{anonymous}::Run', 'main'))
+
+
+class GetSignatureTest(helpers.ExtendedTestCase):
+  """Tests the get_signature method."""
+
+  def test_report(self):
+    """Tests that runtime and unsymbolized frames are left out."""
+
+    self.assertEqual(SIGNATURE, stack_analyzer.get_signature(REPORT))
+
+  def test_no_report(self):
+    """Tests that output without a report has no signature."""
+
+    self.assertIsNone(stack_analyzer.get_signature(['Some output']))
+
+
+class SignatureMatcherTest(helpers.ExtendedTestCase):
+  """Tests the SignatureMatcher class."""
+
+  def feed(self, matcher, lines):
+    """Returns how many lines were fed before the verdict was known."""
+
+    for i, line in enumerate(lines):
+      if matcher.feed(line):
+        return i + 1
+    return None
+
+  def test_match(self):
+    """Tests that the match is known after the last expected frame."""
+
+    matcher = stack_analyzer.SignatureMatcher(SIGNATURE)
+    self.assertEqual(9, self.feed(matcher, REPORT))
+    self.assertEqual(stack_analyzer.MATCH, matcher.get_verdict())
+
+  def test_different_type(self):
+    """Tests that a different crash type is a mismatch right away."""
+
+    matcher = stack_analyzer.SignatureMatcher(
+        SIGNATURE._replace(crash_type='SEGV'))
+    self.assertEqual(3, self.feed(matcher, REPORT))
+    self.assertEqual(stack_analyzer.MISMATCH, matcher.get_verdict())
+
+  def test_different_frame(self):
+    """Tests that a different frame is a mismatch right away."""
+
+    matcher = stack_analyzer.SignatureMatcher(
+        SIGNATURE._replace(frames=('v8::internal::Heap::Scavenge', 'Other')))
+    self.assertEqual(8, self.feed(matcher, REPORT))
+    self.assertEqual(stack_analyzer.MISMATCH, matcher.get_verdict())
+
+  def test_no_expected_frames(self):
+    """Tests that a signature without frames is matched on the crash type
+    alone."""
+
+    matcher = stack_analyzer.SignatureMatcher(SIGNATURE._replace(frames=()))
+    self.assertEqual(3, self.feed(matcher, REPORT))
+    self.assertEqual(stack_analyzer.MATCH, matcher.get_verdict())
+
+    matcher = stack_analyzer.SignatureMatcher(SIGNATURE._replace(frames=()))
+    for line in REPORT:
+      matcher.feed(line)
+    self.assertEqual(stack_analyzer.MATCH, matcher.get_verdict())
+
+  def test_short_stack(self):
+    """Tests that a stack ending early is compared once it ends."""
+
+    report = [l for l in REPORT if 'in main' not in l]
+    matcher = stack_analyzer.SignatureMatcher(SIGNATURE)
+    self.assertEqual(9, self.feed(matcher, report))
+    self.assertEqual(stack_analyzer.MATCH, matcher.get_verdict())
+
+  def test_no_crash(self):
+    """Tests the verdict when the binary didn't crash."""
+
+    matcher = stack_analyzer.SignatureMatcher(SIGNATURE)
+    self.assertIsNone(self.feed(matcher, ['Some output']))
+    self.assertEqual(stack_analyzer.NO_CRASH, matcher.get_verdict())
+
+  def test_no_signature(self):
+    """Tests that nothing is decided without a signature."""
+
+    matcher = stack_analyzer.SignatureMatcher()
+    self.assertIsNone(self.feed(matcher, REPORT))
+    self.assertEqual(stack_analyzer.UNKNOWN, matcher.get_verdict())
+
+
+class IsReproducedTest(helpers.ExtendedTestCase):
+  """Tests the is_reproduced method."""
+
+  def test_is_reproduced(self):
+    """Tests that failing runs only count without a signature."""
+
+    self.assertTrue(stack_analyzer.is_reproduced(stack_analyzer.MATCH, -9))
+    self.assertFalse(stack_analyzer.is_reproduced(stack_analyzer.MISMATCH, 1))
+    self.assertTrue(stack_analyzer.is_reproduced(stack_analyzer.UNKNOWN, 1))
+    self.assertFalse(stack_analyzer.is_reproduced(stack_analyzer.UNKNOWN, 0))
@@ -17,6 +17,8 @@ import os
 import mock
 
 from test import helpers
+from clusterfuzz import cache
+from clusterfuzz import manifest
 from clusterfuzz import testcase
 
 def build_base_testcase(stacktrace_lines=None, revision=None, build_url=None,
@@ -57,6 +59,21 @@ class TestcaseSetupTest(helpers.ExtendedTestCase):
     self.assertEqual(result.build_url, 'build_url')
 
 
+class GetCrashSignatureTest(helpers.ExtendedTestCase):
+  """Tests the get_crash_signature method."""
+
+  def test_signature(self):
+    """Ensures the signature is taken from the original stacktrace."""
+
+    stacktrace_lines = [
+        {'content': '==1==ERROR: AddressSanitizer: SEGV on unknown address'},
+        {'content': '    #0 0x4a in v8::internal::Foo(int) src/foo.cc:1:2'},
+        {'content': '    #1 0x4b in main src/d8.cc:3:4'}]
+    self.assertEqual(
+        ('SEGV', ('v8::internal::Foo', 'main')),
+        build_base_testcase(stacktrace_lines).get_crash_signature())
+
+
 class GetTestcasePathTest(helpers.ExtendedTestCase):
   """Tests the get_testcase_path method."""
 
@@ -64,7 +81,7 @@ class GetTestcasePathTest(helpers.ExtendedTestCase):
     self.setup_fake_filesystem()
     helpers.patch(self, [
         'clusterfuzz.common.get_stored_auth_header',
-        'clusterfuzz.common.execute'])
+        'clusterfuzz.http_client.download'])
     self.mock.get_stored_auth_header.return_value = 'Bearer 1a2s3d4f'
     self.testcase_dir = os.path.expanduser(os.path.join(
         '~', '.clusterfuzz', 'testcases', '12345_testcase'))
@@ -77,26 +94,65 @@ class GetTestcasePathTest(helpers.ExtendedTestCase):
     os.makedirs(self.testcase_dir)
     with open(filename, 'w') as f:
       f.write('testcase exists')
+    manifest.create(self.testcase_dir)
     self.assertTrue(os.path.isfile(filename))
 
     result = self.test.get_testcase_path()
     self.assertEqual(result, filename)
     self.assert_n_calls(0, [self.mock.get_stored_auth_header,
-                            self.mock.execute])
+                            self.mock.download])
+
+  def test_truncated(self):
+    """Tests that a testcase that does not match its manifest is downloaded
+    again."""
+
+    filename = os.path.join(self.testcase_dir, 'testcase.js')
+    self.fs.CreateFile(filename, contents='testcase exists')
+    manifest.create(self.testcase_dir)
+    with open(filename, 'w') as f:
+      f.write('testcase')
+
+    self.test.get_testcase_path()
+
+    self.assert_n_calls(1, [self.mock.download])
+
+  def test_downloaded_while_waiting(self):
+    """Tests that a requester that found the testcase truncated uses the one
+    downloaded again while it waited on the entry lock."""
+
+    filename = os.path.join(self.testcase_dir, 'testcase.js')
+    self.fs.CreateFile(filename, contents='testcase exists')
+    manifest.create(self.testcase_dir)
+    with open(filename, 'w') as f:
+      f.write('testcase')
+    def downloaded_by_other_requester():
+      with open(filename, 'w') as f:
+        f.write('testcase exists')
+    helpers.patch(self, ['clusterfuzz.cache.get_entry_lock'])
+    self.mock.get_entry_lock.return_value.__enter__.side_effect = (
+        downloaded_by_other_requester)
+
+    self.assertEqual(self.test.get_testcase_path(), filename)
+    self.assert_n_calls(0, [self.mock.download])
 
   def test_not_already_downloaded(self):
     """Tests the creation of folders & downloading of the testcase"""
 
     filename = os.path.join(self.testcase_dir, 'testcase.js')
     self.assertFalse(os.path.exists(self.testcase_dir))
+    self.mock.download.side_effect = (
+        lambda url, path, headers: self.fs.CreateFile(path, contents='test'))
 
     result = self.test.get_testcase_path()
 
     self.assertEqual(result, filename)
     self.assert_exact_calls(self.mock.get_stored_auth_header, [mock.call()])
-    self.assert_exact_calls(self.mock.execute, [mock.call(
-        ('wget --header="Authorization: %s" "%s" -O ./testcase.js' %
-         (self.mock.get_stored_auth_header.return_value,
-          testcase.CLUSTERFUZZ_TESTCASE_URL % str(12345))),
-        self.testcase_dir)])
-    self.assertTrue(os.path.exists(self.testcase_dir))
+    self.assert_exact_calls(self.mock.download, [mock.call(
+        testcase.CLUSTERFUZZ_TESTCASE_URL % str(12345),
+        os.path.join(self.testcase_dir + '.partial', 'testcase.js'),
+        headers={'Authorization': 'Bearer 1a2s3d4f'})])
+    self.assertTrue(os.path.isfile(filename))
+    self.assertFalse(os.path.exists(self.testcase_dir + '.partial'))
+    self.assertEqual(manifest.verify(self.testcase_dir), [])
+    self.assertEqual(cache.CacheIndex().testcases['12345']['path'],
+                     self.testcase_dir)
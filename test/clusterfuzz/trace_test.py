@@ -0,0 +1,89 @@
+"""Tests the module for timing phases."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+from clusterfuzz import trace
+from test import helpers
+
+
+class SpanTest(helpers.ExtendedTestCase):
+  """Tests the span context manager."""
+
+  def setUp(self):
+    trace.reset()
+    helpers.patch(self, ['time.time'])
+    self.mock.time.side_effect = [10.0, 12.5]
+
+  def test_records_span(self):
+    """Tests that the duration and args are recorded."""
+
+    with trace.span('ninja', jobs=40):
+      pass
+
+    # pylint infers the spans from the empty list trace starts with.
+    [span] = trace.get_spans()  # pylint: disable=unbalanced-tuple-unpacking
+    self.assertEqual(('ninja', 'phase', 10.0, 2.5, {'jobs': 40}),
+                     (span.name, span.category, span.start, span.duration,
+                      span.args))
+
+  def test_records_on_error(self):
+    """Tests that a failing phase is still recorded."""
+
+    with self.assertRaises(SystemExit):
+      with trace.span('ninja'):
+        raise SystemExit(1)
+
+    self.assertEqual(['ninja'], [s.name for s in trace.get_spans()])
+
+
+class WriteChromeTraceTest(helpers.ExtendedTestCase):
+  """Tests the write_chrome_trace method."""
+
+  def setUp(self):
+    trace.reset()
+    self.setup_fake_filesystem()
+
+  def test_write(self):
+    """Tests that spans are written as complete events in microseconds."""
+
+    trace.record('gn_gen', 'phase', 1.5, 0.25, {'jobs': 1})
+    trace.write_chrome_trace('/trace.json')
+
+    with open('/trace.json') as f:
+      events = json.load(f)['traceEvents']
+    self.assertEqual(1, len(events))
+    self.assertEqual(
+        {'name': 'gn_gen', 'cat': 'phase', 'ph': 'X', 'ts': 1500000,
+         'dur': 250000, 'args': {'jobs': 1}},
+        {k: v for k, v in events[0].items() if k not in ('pid', 'tid')})
+
+
+class GetSummaryTest(helpers.ExtendedTestCase):
+  """Tests the get_summary method."""
+
+  def setUp(self):
+    trace.reset()
+
+  def test_summary(self):
+    """Tests that spans are grouped by name, slowest first."""
+
+    trace.record('gn_gen', 'phase', 0, 1.0)
+    trace.record('ninja', 'phase', 1, 3.0)
+    trace.record('ninja', 'phase', 4, 2.0)
+    trace.record('git', 'command', 0, 9.0)
+
+    self.assertEqual([('ninja', 2, 5.0, 3.0), ('gn_gen', 1, 1.0, 1.0)],
+                     trace.get_summary())
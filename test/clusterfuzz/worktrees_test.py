@@ -0,0 +1,142 @@
+"""Test the 'worktrees' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+
+from clusterfuzz import worktrees
+from test import helpers
+
+
+class WorktreePoolTest(helpers.ExtendedTestCase):
+  """Tests the WorktreePool class."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['clusterfuzz.common.execute'])
+    self.mock.execute.side_effect = self.execute
+    self.addCleanup(worktrees._in_use.clear)  # pylint: disable=protected-access
+    self.fs.CreateFile('/chrome/.gclient', contents='solutions = []')
+    self.fs.CreateDirectory('/chrome/v8')
+    self.pool = worktrees.WorktreePool('/chrome/v8', 2)
+    self.known_shas = set(['sha1', 'sha2', 'sha3'])
+
+  def execute(self, command, cwd, **_):
+    """Stands in for git and gclient."""
+
+    words = command.split()
+    if command.startswith('git cat-file'):
+      return int(words[-1].split('^')[0] not in self.known_shas), ''
+    if command.startswith('git worktree add'):
+      self.fs.CreateFile(os.path.join(words[-2], 'DEPS'),
+                         contents='deps ' + words[-1])
+    elif command.startswith('git checkout'):
+      with open(os.path.join(cwd, 'DEPS'), 'w') as f:
+        f.write('deps ' + words[-1])
+    return 0, ''
+
+  def get_commands(self):
+    return [c[0][0] for c in self.mock.execute.call_args_list]
+
+  def test_create(self):
+    """Tests that a worktree is created and its dependencies synced."""
+
+    path = self.pool.acquire('sha1', 1)
+
+    self.assertEqual(path, self.pool.worktree_path('worktree_0'))
+    self.assertTrue(os.path.isfile(os.path.join(os.path.dirname(path),
+                                                '.gclient')))
+    self.assertEqual(self.get_commands(), [
+        'git cat-file -e sha1^{commit}',
+        'git worktree add --detach %s sha1' % path,
+        'gclient sync --nohooks --revision v8@sha1'])
+
+  def test_reuse_same_sha(self):
+    """Tests that a released worktree at the same sha is reused as is."""
+
+    path = self.pool.acquire('sha1', 1)
+    self.pool.release(path)
+    self.mock.execute.reset_mock()
+
+    self.assertEqual(self.pool.acquire('sha1', 1), path)
+    self.assert_n_calls(0, [self.mock.execute])
+
+  def test_reserved_worktree_not_shared(self):
+    """Tests that a worktree in use is not handed out twice."""
+
+    first = self.pool.acquire('sha1', 1)
+    second = self.pool.acquire('sha1', 1)
+    self.assertNotEqual(first, second)
+
+  def test_reserved_by_another_process(self):
+    """Tests that a worktree held by another running process is left alone,
+    and one whose process exited is reused."""
+
+    path = self.pool.acquire('sha1', 1)
+    worktrees._in_use.clear()  # pylint: disable=protected-access
+    index = json.loads(self.fs.GetObject(self.pool.index_path).contents)
+    index['worktree_0']['owner'] = os.getppid()
+    self.fs.RemoveObject(self.pool.index_path)
+    self.fs.CreateFile(self.pool.index_path, contents=json.dumps(index))
+
+    self.assertNotEqual(self.pool.acquire('sha1', 1), path)
+
+    helpers.patch(self, ['clusterfuzz.worktrees.is_process_running'])
+    self.mock.is_process_running.return_value = False
+    self.assertEqual(self.pool.acquire('sha1', 1), path)
+
+  def test_recycle_least_recently_used(self):
+    """Tests that the least recently used worktree is recycled."""
+
+    first = self.pool.acquire('sha1', 1)
+    second = self.pool.acquire('sha2', 2)
+    self.pool.release(first)
+    self.pool.release(second)
+    self.mock.execute.reset_mock()
+
+    self.assertEqual(self.pool.acquire('sha3', 3), first)
+    self.assertEqual(self.get_commands(), [
+        'git cat-file -e sha3^{commit}',
+        'git checkout --detach sha3',
+        'gclient sync --nohooks --revision v8@sha3'])
+
+  def test_fetch_missing_sha(self):
+    """Tests that only shas missing from the object database are fetched."""
+
+    self.pool.acquire('sha4', 4)
+    self.assertEqual(self.get_commands()[:2], [
+        'git cat-file -e sha4^{commit}', 'git fetch'])
+
+  def test_trim(self):
+    """Tests that a pool grown past its size is trimmed once released."""
+
+    paths = [self.pool.acquire(sha, i) for i, sha in
+             enumerate(['sha1', 'sha2', 'sha3'])]
+    for path in paths:
+      self.pool.release(path)
+
+    self.assertEqual(self.pool.acquire('sha3', 3), paths[2])
+    self.assertFalse(os.path.exists(paths[0]))
+    self.assertTrue(os.path.exists(paths[1]))
+    self.mock.execute.assert_called_with('git worktree prune', '/chrome/v8',
+                                         print_output=False)
+
+  def test_failure_releases(self):
+    """Tests that a worktree is released if it could not be set up."""
+
+    self.mock.execute.side_effect = SystemExit(1)
+    with self.assertRaises(SystemExit):
+      self.pool.acquire('sha1', 1)
+    self.assertEqual(worktrees._in_use, set())  # pylint: disable=protected-access
@@ -13,7 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import BaseHTTPServer
+import SocketServer
+import base64
+import hashlib
 import os
+import re
+import struct
+import threading
+import time
 import mock
 from pyfakefs import fake_filesystem_unittest
 
@@ -37,6 +45,14 @@ class ExtendedTestCase(fake_filesystem_unittest.TestCase):
     """Sets up PyFakefs and creates aliases for filepaths."""
 
     self.setUpPyfakefs()
+    # Fake files have no descriptors to lock.
+    patcher = mock.patch('fcntl.lockf')
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    # Locks left held by earlier tests were on their own fake files.
+    patcher = mock.patch.dict('clusterfuzz.locks._thread_locks', clear=True)
+    patcher.start()
+    self.addCleanup(patcher.stop)
     self.clusterfuzz_dir = os.path.expanduser(os.path.join(
         '~', '.clusterfuzz'))
     self.auth_header_file = os.path.join(self.clusterfuzz_dir,
@@ -83,3 +99,125 @@ def patch(testcase_obj, names):
     patcher = mock.patch(full_path, autospec=True, spec_set=True)
     testcase_obj.addCleanup(patcher.stop)
     setattr(testcase_obj.mock, attr_name, patcher.start())
+
+
+class _StandInRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Serves the bodies in self.server.routes, keyed by path.
+
+  A route can also be a list of responses, served one per request, where an
+  int is an error status, and a (status, location) tuple is a redirect.
+  Byte ranges are served like Cloud Storage does,
+  with the MD5 of the body in x-goog-hash."""
+
+  protocol_version = 'HTTP/1.1'
+
+  def do_HEAD(self):  # pylint: disable=invalid-name
+    self.respond(send_body=False)
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    self.respond(send_body=True)
+
+  def respond(self, send_body):
+    """Sends the response to a GET or HEAD request."""
+
+    self.server.requests.append((self.path, self.headers, self.client_address))
+    body = self.server.routes.get(self.path.split('?')[0])
+    if isinstance(body, list):
+      body = body.pop(0) if len(body) > 1 else body[0]
+    if isinstance(body, tuple):
+      self.send_response(body[0])
+      self.send_header('Location', body[1])
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    if body is None or isinstance(body, int):
+      self.send_response(body or 404)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+
+    md5 = hashlib.md5(body)
+    byte_range = re.match(r'bytes=(\d+)-(\d+)$',
+                          self.headers.get('Range', ''))
+    if byte_range:
+      first, last = int(byte_range.group(1)), int(byte_range.group(2))
+      self.send_response(206)
+      self.send_header('Content-Range',
+                       'bytes %d-%d/%d' % (first, last, len(body)))
+      body = body[first:last + 1]
+    else:
+      self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('Accept-Ranges', 'bytes')
+    self.send_header('ETag', '"%s"' % md5.hexdigest())
+    self.send_header('x-goog-hash', 'crc32c=AAAAAA==,md5=%s' %
+                     base64.b64encode(md5.digest()))
+    self.end_headers()
+    if send_body:
+      self.write_body(body)
+
+  def write_body(self, body):
+    """Writes body, at self.server.rate bytes per second if it is set."""
+
+    rate = getattr(self.server, 'rate', None)
+    if not rate:
+      self.wfile.write(body)
+      return
+    chunk_size = max(1, rate // 100)
+    for start in range(0, len(body), chunk_size):
+      self.wfile.write(body[start:start + chunk_size])
+      time.sleep(0.01)
+
+  def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+    pass
+
+
+class _StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Serves each connection in its own thread, so that connections kept
+  alive don't block the others."""
+
+  daemon_threads = True
+
+
+def start_http_server(routes):
+  """Starts a local HTTP server that stands in for a remote one.
+
+  'routes' maps request paths to response bodies. The (path, headers,
+  client address) of each request are appended to the requests attribute,
+  and setting the rate attribute limits each response to that many bytes
+  per second.
+  Call shutdown() on the returned server to stop it."""
+
+  server = _StandInServer(('localhost', 0), _StandInRequestHandler)
+  server.routes = routes
+  server.requests = []
+  thread = threading.Thread(target=server.serve_forever,
+                            kwargs={'poll_interval': 0.01})
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+def build_elf(needed_libraries):
+  """Returns a minimal 64-bit ELF file with the given DT_NEEDED entries."""
+
+  strings = '\x00' + ''.join(l + '\x00' for l in needed_libraries)
+  dynamic = ''
+  offset = 1
+  for library in needed_libraries:
+    dynamic += struct.pack('<qQ', 1, offset)
+    offset += len(library) + 1
+  dynamic += struct.pack('<qQ', 0, 0)
+
+  strings_offset = 64
+  dynamic_offset = strings_offset + len(strings)
+  sections_offset = dynamic_offset + len(dynamic)
+  header = '\x7fELF\x02\x01\x01' + '\x00' * 9 + struct.pack(
+      '<HHIQQQIHHHHHH', 3, 62, 1, 0, 0, sections_offset, 0, 64, 0, 0, 64, 3,
+      0)
+  sections = '\x00' * 64
+  sections += struct.pack('<IIQQQQIIQQ', 0, 3, 0, 0, strings_offset,
+                          len(strings), 0, 0, 1, 0)
+  sections += struct.pack('<IIQQQQIIQQ', 0, 6, 0, 0, dynamic_offset,
+                          len(dynamic), 1, 0, 8, 16)
+  return header + strings + dynamic + sections